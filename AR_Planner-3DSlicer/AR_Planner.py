@@ -1,18 +1,30 @@
 # This code has been developed by Alicia Pose Díez de la Lastra (Universidad Carlos III de Madrid) and David Morton (PerkLab)
 # It is based on the template designed by Jean-Christophe Fillion-Robin (Kitware Inc.), Andras Lasso (PerkLab), and Steve Pieper (Isomics, Inc).
 import logging
+import math
 import os
 
+import qt
 import vtk
 
 import slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
+import vtk.util.numpy_support
 
 import numpy as np
+import sys
 import time
 from pathlib import Path
 
+# The PedicleScrewPlannerLib package is shared with Desktop_Planner and lives in the repository root
+_repositoryDirectory = str(Path(__file__).resolve().parent.parent)
+if _repositoryDirectory not in sys.path:
+	sys.path.append(_repositoryDirectory)
+import PedicleScrewPlannerLib
+from PedicleScrewPlannerLib import framehash, imagecodec, intensitystatistics, latency, openigtlink, pose, pyramid, reslicequality, scheduling, screws, sessionlog, windowing, workers
+from PedicleScrewPlannerLib.plannerlogic import PlannerLogicMixin
+
 #
 # AR_Planner
 #
@@ -100,19 +112,33 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         #### OpenIGTLink Connection SECTION
 		self.ui.serverActiveCheckBox.connect("toggled(bool)", self.onActivateOpenIGTLinkConnectionClicked)
 
+		### Latency SECTION
+		self.latencyTimer = qt.QTimer()
+		self.latencyTimer.setInterval(1000)
+		self.latencyTimer.connect('timeout()', self.updateLatencyLabel)
+		self.ui.resetLatencyButton.connect('clicked(bool)', self.onResetLatencyClicked)
+		self.ui.exportLatencyButton.connect('clicked(bool)', self.onExportLatencyClicked)
+
 		### Update screws SECTION
 		self.ui.screwDirButton.connect('directorySelected(QString)', self.onScrewDirChanged)
 		self.ui.loadScrewModelsButton.connect('clicked(bool)', self.onLoadScrewModelsFromFileClicked)
+		self.ui.autoSyncScrewsCheckBox.connect('toggled(bool)', self.onAutoSyncScrewsToggled)
 
 		### SAVE SECTION
 		self.ui.savingPath.connect('directorySelected(QString)', self.onSaveDirectoryChanged)
 		self.ui.patientID_text.connect("textChanged(QString)", self.updateParameterNodeFromGUI)
 		self.ui.userID_text.connect("textChanged(QString)", self.updateParameterNodeFromGUI)
 		self.ui.saveDataButton.connect('clicked(bool)', self.onSaveDataClicked)
+		self.ui.recordSessionCheckBox.connect('toggled(bool)', self.onRecordSessionToggled)
+		self.ui.recordSlicesCheckBox.connect('toggled(bool)', self.updateParameterNodeFromGUI)
+		self.ui.saveSceneCheckBox.connect('toggled(bool)', self.updateParameterNodeFromGUI)
+		self.ui.saveSceneInBackgroundCheckBox.connect('toggled(bool)', self.updateParameterNodeFromGUI)
+		self.ui.sceneCompressionLevelSpinBox.connect('valueChanged(int)', self.updateParameterNodeFromGUI)
 
 		# Make sure parameter node is initialized (needed for module reload)
 		self.initializeParameterNode()
 		self.initializeGUI() # This is an addition to avoid initializing parameter node before connections
+		self.offerPlanRecovery()
 
 	def initializeGUI(self):
 		"""
@@ -129,11 +155,38 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 			self.ui.screwDirButton.directory = settings.value(self.logic.SCREWS_DIRECTORY)
 
 
+	def offerPlanRecovery(self):
+		"""
+			If the last session did not end cleanly (e.g. 3D Slicer crashed), offer to restore its screws from the plan journal
+		"""
+		journalReplay = self.logic.findPlanToRecover()
+		if journalReplay is None:
+			return
+		if not slicer.util.confirmYesNoDisplay("The planning session started on {0} did not end cleanly.\nRestore its {1} screw(s)?".format(
+			journalReplay.header.get("startTime", "?"), len(journalReplay.screws))):
+			return
+		with slicer.util.tryWithErrorDisplay("Failed to restore the plan.", waitCursor=True):
+			self.logic.restorePlan(journalReplay, self.logic.restoreJournalScrew)
+
+	def onReload(self):
+		"""
+		Reload the PedicleScrewPlannerLib submodules, then this module (the base reload only executes this file again).
+		"""
+		PedicleScrewPlannerLib.reloadSubmodules()
+		ScriptedLoadableModuleWidget.onReload(self)
+
 	def cleanup(self):
 		"""
 		Called when the application closes and the module widget is destroyed.
 		"""
 		self.removeObservers()
+		self.latencyTimer.stop()
+		self.logic.StopResliceWorker()
+		self.logic.StopSessionRecording()
+		self.logic.StopScrewSyncObservations()
+		self.logic.waitForSceneSave()
+		self.logic.stopPlanJournal()
+		self.logic.removeObservers()
 
 	def enter(self):
 		"""
@@ -191,21 +244,25 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 		It updates the range of the histogram slide bar, and the WW and WL spin boxes.
 		"""
 		self.updateParameterNodeFromGUI()
-		self.logic.updateHistLimitsFromInput()
+		# Intensity statistics are cached, so switching back to a previous volume does not scan it again
+		volumeStatistics = self.logic.updateHistLimitsFromInput()
+		if volumeStatistics is None:
+			return
+		minLevel = float(volumeStatistics.minimum)
+		maxLevel = float(volumeStatistics.maximum)
 		# Update the slide bar limits
-		self.ui.imageHistogramSlideBar.minimum = float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_minLimit))
-		self.ui.imageHistogramSlideBar.maximum = float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_maxLimit))
+		self.ui.imageHistogramSlideBar.minimum = minLevel
+		self.ui.imageHistogramSlideBar.maximum = maxLevel
 		# Set the maximum and minimum values for the WW and WL spin boxes
-		maxWidth = float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_maxLimit)) - float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_minLimit))
+		maxWidth = maxLevel - minLevel
 		self.ui.imageWWSpinBox.minimum = 0.0
 		self.ui.imageWWSpinBox.maximum = maxWidth
-		minLevel = float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_minLimit))
-		maxLevel = float(self._parameterNode.GetParameter(self.logic.IMAGE_HIST_SLIDEBAR_maxLimit))
 		self.ui.imageWLSpinBox.maximum = maxLevel
 		self.ui.imageWLSpinBox.minimum = minLevel
-		# update the window level to be zero and the width to be half the maximum in the parameter node
-		self._parameterNode.SetParameter(self.logic.WINDOW_LEVEL, str(0))
-		self._parameterNode.SetParameter(self.logic.WINDOW_WIDTH, str(0.5*maxWidth))
+		# update the window width and level in the parameter node to cover the central percentiles of the intensities
+		windowWidth, windowLevel = volumeStatistics.windowLevelFromPercentiles(*self.logic.DEFAULT_WINDOW_PERCENTILES)
+		self._parameterNode.SetParameter(self.logic.WINDOW_LEVEL, str(windowLevel))
+		self._parameterNode.SetParameter(self.logic.WINDOW_WIDTH, str(windowWidth))
 
 	def onWWSpinBoxChanged(self, value):
 		"""
@@ -277,6 +334,9 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 			imageTransform = slicer.util.getFirstNodeByName("Image_T")
 			self.logic.ApplyTransformToObject(imageTransform, spineTransformName)
 
+			# Coarse spine while the 3D views are rotated and in the slice views
+			self.logic.showModelWithLevelsOfDetail(spineModel, os.path.join(spinePath, spineFileName))
+
 			# set the spine model as the current model
 			self.ui.loadSpineModelButton.enabled = False
 
@@ -295,6 +355,14 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 		self.updateParameterNodeFromGUI()
 		self.logic.LoadScrewModelsFromFile()
 
+	def onAutoSyncScrewsToggled(self, enable):
+		"""
+		Enable or disable the automatic update of the screw models.
+		"""
+		self.updateParameterNodeFromGUI()
+		self.logic.SetAutoScrewSyncEnabled(enable)
+		self.ui.loadScrewModelsButton.enabled = not enable
+
 	def onActivateOpenIGTLinkConnectionClicked(self, connect):
 		"""
 		Run processing when user clicks on the OpenIGTLink checkbox.
@@ -307,10 +375,31 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 				if status == 1:
 						self.connect = False # set connect variable to false
 						self.ui.OIGTLconnectionLabel.text = "OpenIGTLink server - ACTIVE" # Update displaying text
+						self.latencyTimer.start()
 		else: # If the connection (checkbox) is enabled
 				self.logic.StopOIGTLConnection() # Stop connection
 				self.connect = True # set connect variable to true
 				self.ui.OIGTLconnectionLabel.text = "OpenIGTLink server - INACTIVE" # Update displaying text
+				self.latencyTimer.stop()
+				self.updateLatencyLabel()
+
+	def updateLatencyLabel(self):
+		"""
+		Show the rolling latency percentiles of the image stream.
+		"""
+		self.ui.latencyLabel.setText(self.logic.latencyTracker.summaryText())
+
+	def onResetLatencyClicked(self):
+		self.logic.ResetLatencyStatistics()
+		self.updateLatencyLabel()
+
+	def onExportLatencyClicked(self):
+		"""
+		Save the latency timelines of the last frames as a CSV file.
+		"""
+		path = qt.QFileDialog.getSaveFileName(None, "Export latency", "latency.csv", "CSV files (*.csv)")
+		if path:
+				self.logic.ExportLatencyCsv(path)
 				
 	def onSaveDirectoryChanged(self, directory):
 		"""
@@ -328,8 +417,35 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 		with slicer.util.tryWithErrorDisplay("Failed to compute results.", waitCursor=True):
 
 				# Compute output
-				save_folder_path = self.logic.SaveData()
-				self.ui.filesSavedLabel.setText("All files have been saved in:\n" + save_folder_path)
+				save_folder_path = self.logic.SaveData(self.onSceneSaveProgress)
+				if self.logic.isSceneSaving():
+						self.ui.filesSavedLabel.setText("Plan saved, saving the scene in:\n" + save_folder_path)
+				else:
+						self.ui.filesSavedLabel.setText("All files have been saved in:\n" + save_folder_path)
+
+	def onSceneSaveProgress(self, archiveWriter):
+		"""
+		Show the progress of the scene saved in the background.
+		"""
+		if not archiveWriter.finished:
+				self.ui.filesSavedLabel.setText("Saving the scene ({0:.0f}%) in:\n{1}".format(100 * archiveWriter.progress, os.path.dirname(archiveWriter.archivePath)))
+		elif archiveWriter.error is not None:
+				self.ui.filesSavedLabel.setText("Scene saving failed: {0}".format(archiveWriter.error))
+		else:
+				self.ui.filesSavedLabel.setText("All files have been saved in:\n" + os.path.dirname(archiveWriter.archivePath))
+
+	def onRecordSessionToggled(self, record):
+		"""
+		Start or stop the recording of the transforms received from HoloLens (and of the slices sent back).
+		"""
+		self.updateParameterNodeFromGUI()
+		if record:
+				with slicer.util.tryWithErrorDisplay("Failed to start the session recording.", waitCursor=True):
+						recordingDirectory = self.logic.StartSessionRecording()
+						self.ui.filesSavedLabel.setText("Recording session in:\n" + recordingDirectory)
+		else:
+				self.logic.StopSessionRecording()
+		self.ui.recordSlicesCheckBox.enabled = not self.logic.IsSessionRecording()
 
 	#
 	# Parameter node and GUI interaction
@@ -400,6 +516,11 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
 		# Update node selectors and sliders
 		self.ui.inputSelector.setCurrentNode(self._parameterNode.GetNodeReference(self.logic.INPUT_VOLUME))
+		self.ui.recordSlicesCheckBox.checked = self._parameterNode.GetParameter(self.logic.RECORD_SLICES) == "true"
+		self.ui.saveSceneCheckBox.checked = self._parameterNode.GetParameter(self.logic.SAVE_SCENE) != "false"
+		self.ui.saveSceneInBackgroundCheckBox.checked = self._parameterNode.GetParameter(self.logic.SAVE_SCENE_IN_BACKGROUND) == "true"
+		self.ui.sceneCompressionLevelSpinBox.value = int(self._parameterNode.GetParameter(self.logic.SCENE_COMPRESSION_LEVEL))
+		self.ui.autoSyncScrewsCheckBox.checked = self._parameterNode.GetParameter(self.logic.AUTO_SYNC_SCREWS) == "true"
 		
 		# if the window level and width are set
 		if self._parameterNode.GetParameter(self.logic.WINDOW_LEVEL) and self._parameterNode.GetParameter(self.logic.WINDOW_WIDTH):
@@ -452,6 +573,10 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 		self._parameterNode.SetParameter(self.logic.MODELS_DIRECTORY, spineDirName)
 		self._parameterNode.SetParameter(self.logic.SPINE_FILENAME, spineFileName)
 		self._parameterNode.SetParameter(self.logic.SCREWS_DIRECTORY, self.ui.screwDirButton.directory)
+		self._parameterNode.SetParameter(self.logic.RECORD_SLICES, "true" if self.ui.recordSlicesCheckBox.checked else "false")
+		self._parameterNode.SetParameter(self.logic.SAVE_SCENE, "true" if self.ui.saveSceneCheckBox.checked else "false")
+		self._parameterNode.SetParameter(self.logic.SAVE_SCENE_IN_BACKGROUND, "true" if self.ui.saveSceneInBackgroundCheckBox.checked else "false")
+		self._parameterNode.SetParameter(self.logic.SCENE_COMPRESSION_LEVEL, str(self.ui.sceneCompressionLevelSpinBox.value))
 		
 		
 		self._parameterNode.EndModify(wasModified)
@@ -461,7 +586,7 @@ class AR_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 # AR_PlannerLogic
 #
 
-class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
+class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin, PlannerLogicMixin):
 
 	# Image slide
 	INPUT_VOLUME = 'InputVolume'
@@ -471,6 +596,8 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 	IMAGE_HIST_SLIDEBAR_maxLimit = 'ImageHistogramSlideBar_maxLimit'
 	WINDOW_WIDTH = 'WindowWidth'
 	WINDOW_LEVEL = 'WindowLevel'
+	LIVE_WINDOW_LEVEL = 'LiveWindowLevel' # "true": window the CT_reslice output, "false": bake WW/WL into the input volume
+	DEFAULT_WINDOW_PERCENTILES = (1.0, 99.5) # Intensity percentiles spanned by the default window of a new input volume
 
 	# OpenIGTLink connection
 	ACTIVE_SERVER_CHECKBOX = 'serverActiveCheckBox'
@@ -480,24 +607,101 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 	SPINE_MODEL = 'SpineModel'
 	SPINE_FILENAME = 'SpineFileName'
 	SCREWS_DIRECTORY = 'ScrewsDirectory'
+	SCREW_MODEL_NAME_ATTRIBUTE = screws.MODEL_NAME_ATTRIBUTE # Model file a screw model was loaded from
+	SCREW_MODEL_COLOR_ATTRIBUTE = screws.MODEL_COLOR_ATTRIBUTE # "r,g,b" color of a screw model
+	AUTO_SYNC_SCREWS = 'AutoSyncScrews' # "true": update the screw models automatically when the screws change in HoloLens
+	SCREW_SYNC_DELAY_MS = 'ScrewSyncDelay' # Milliseconds without screw changes before the automatic update
+	SCREW_SYNC_MAX_DELAY_MS = 1000 # The automatic update is not postponed longer than this while changes keep arriving
 
 	# Transforms
 	SPINE_TRANSFORM = 'Spine_T'
 	IMAGE_TRANSFORM = 'Image_T'
+	INITIAL_SLICE_TRANSLATION = (-100.0, -100.0, 0.0) # Image_T when the slice is created, until HoloLens sends it (see pose.poseMatrix)
+	INITIAL_SLICE_ROTATION = (30.0, 30.0) # Degrees about X, then Y
 
 	# Saving path
 	SAVING_DIRECTORY = 'savingPath'
 	PATIENT_ID = 'PatientID'
 	USER_ID = 'UserID'
 
+	# Session recording
+	RECORD_SLICES = 'RecordSlices' # "true": the session recording also contains the CT_reslice frames sent to HoloLens
+
 	# Parameters
 	CT_RESLICE_OUTPUT = 'CT_reslice'
+	RESLICE_TARGET_RATE = 'ResliceTargetRate' # Maximum number of reslice updates per second (0: no limit)
+	RESLICE_IN_BACKGROUND = 'ResliceInBackground' # "true": reslice on a worker thread, the main thread only publishes the frames
+	PUBLISH_INTERVAL_MS = 10 # How often the frames completed by the background reslice are checked for
+
+	# Image transport to HoloLens
+	IMAGE_TRANSPORT = 'ImageTransport' # raw: send CT_reslice. zlib, delta-zlib (lz4, delta-lz4 if installed): send CT_reslice_Packed
+	IMAGE_COMPRESSION_LEVEL = 'ImageCompressionLevel'
+	IMAGE_KEY_FRAME_INTERVAL = 'ImageKeyFrameInterval' # Delta modes send a full frame every this many frames
+	COMPRESSED_RESLICE_OUTPUT = 'CT_reslice_Packed'
+	DEDUPLICATE_FRAMES = 'DeduplicateFrames' # "true": a frame identical to the previous one is neither published nor sent
+
+	# Reslice output geometry and quality policy
+	RESLICE_OUTPUT_SIZE = 'ResliceOutputSize' # "columns,rows" of CT_reslice
+	RESLICE_SPACING = 'ResliceSpacing' # Millimeters/pixel of CT_reslice
+	RESLICE_INTERACTIVE_FACTOR = 'ResliceInteractiveFactor' # While the plane moves, sample this many times coarser
+	RESLICE_INTERACTIVE_INTERPOLATION = 'ResliceInteractiveInterpolation' # nearest, linear or cubic, while the plane moves
+	RESLICE_REFINED_INTERPOLATION = 'ResliceRefinedInterpolation' # nearest, linear or cubic, once the plane is still
+	RESLICE_SETTLE_TIME = 'ResliceSettleTime' # Milliseconds without motion before the refinement pass
+	RESLICE_MOTION_THRESHOLD = 'ResliceMotionThreshold' # Speed (mm/s and deg/s) above which the plane is moving
+	RESLICE_PYRAMID_LEVELS = 'ReslicePyramidLevels' # Number of downsampled (2x, 4x, 8x...) copies of the volume to reslice from (0: none)
+	RESLICE_QUALITY_DEFAULTS = {
+		RESLICE_OUTPUT_SIZE: "100,100",
+		RESLICE_SPACING: "1.0",
+		RESLICE_INTERACTIVE_FACTOR: "1",
+		RESLICE_INTERACTIVE_INTERPOLATION: "linear",
+		RESLICE_REFINED_INTERPOLATION: "linear", # as before the quality policy; "cubic" is sharper but slower
+		RESLICE_SETTLE_TIME: "200",
+		RESLICE_MOTION_THRESHOLD: "2.0",
+		RESLICE_PYRAMID_LEVELS: "3",
+	}
+	INTERPOLATION_MODES = {
+		"nearest": vtk.VTK_RESLICE_NEAREST,
+		"linear": vtk.VTK_RESLICE_LINEAR,
+		"cubic": vtk.VTK_RESLICE_CUBIC,
+	}
 
 	def __init__(self):
 		"""
 		Called when the logic class is instantiated. Can be used for initializing member variables.
 		"""
 		ScriptedLoadableModuleLogic.__init__(self)
+		VTKObservationMixin.__init__(self)
+		PlannerLogicMixin.__init__(self)
+		self.volumeStatistics = intensitystatistics.IntensityStatisticsCache() # Intensity statistics of the volumes, by node ID
+		self.reslice = None # vtkImageReslice created by CreateSlide
+		self.windowResliceOutput = False # True if the reslice output is windowed into CT_reslice (live window/level mode)
+		self.resliceWindowLevel = windowing.WindowLevelMapper() # Maps the reslice output to [0,255] in live window/level mode
+		self.resliceScheduler = None # Coalesces the Image_T updates into reslice updates at the target rate
+		self.resliceObservation = None # (Image_T node, observer tag) that requests the reslice updates
+		self.resliceTimer = qt.QTimer()
+		self.resliceTimer.setSingleShot(True)
+		self.resliceTimer.connect('timeout()', self.onResliceTimerTimeout)
+		self.resliceWorker = None # Background reslice worker (ResliceInBackground mode)
+		self.publishTimer = qt.QTimer()
+		self.publishTimer.setInterval(self.PUBLISH_INTERVAL_MS)
+		self.publishTimer.connect('timeout()', self.onPublishTimerTimeout)
+		self.resliceQualityPolicy = None # Coarse reslice while the plane moves, refined once it is still
+		self.reslicePyramid = None # Downsampled levels of the resliced volume
+		self.reslicePyramidLevels = [] # (vtkImageData, sliceToLevelIjk vtkTransform) of each pyramid level
+		self.refineTimer = qt.QTimer()
+		self.refineTimer.setSingleShot(True)
+		self.refineTimer.connect('timeout()', self.onRefineTimerTimeout)
+		self.frameEncoder = None # Encodes CT_reslice into CT_reslice_Packed (compressed image transport)
+		self.frameDeduplicator = framehash.FrameDeduplicator() # Detects CT_reslice frames identical to the last published one
+		self.latencyTracker = latency.LatencyTracker() # Timelines of the frames, from the Image_T pose to the image sent
+		self.sessionRecorder = None # Records the received transforms (and the sent frames) while a session recording is active
+		self.syncedScrews = {} # ScrewSpec of each screw number, as of the last screw sync
+		self.syncedNumberOfScrews = None # NumOfScrews of Image_T, as of the last screw sync
+		self.screwSyncObservedNodes = [] # Nodes observed for the automatic screw sync
+		self.screwSyncRequestTime = None # Time of the first change not synchronized yet
+		self.screwSyncTimer = qt.QTimer()
+		self.screwSyncTimer.setSingleShot(True)
+		self.screwSyncTimer.connect('timeout()', self.onScrewSyncTimerTimeout)
 
 	def setDefaultParameters(self, parameterNode):
 		"""
@@ -505,24 +709,77 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		"""
 		if not parameterNode.GetParameter(self.ACTIVE_SERVER_CHECKBOX):
 				parameterNode.SetParameter(self.ACTIVE_SERVER_CHECKBOX, "0")
+		if not parameterNode.GetParameter(self.LIVE_WINDOW_LEVEL):
+				parameterNode.SetParameter(self.LIVE_WINDOW_LEVEL, "true")
+		if not parameterNode.GetParameter(self.RESLICE_TARGET_RATE):
+				parameterNode.SetParameter(self.RESLICE_TARGET_RATE, "30")
+		if not parameterNode.GetParameter(self.RESLICE_IN_BACKGROUND):
+				parameterNode.SetParameter(self.RESLICE_IN_BACKGROUND, "false")
+		if not parameterNode.GetParameter(self.IMAGE_TRANSPORT):
+				parameterNode.SetParameter(self.IMAGE_TRANSPORT, "raw")
+		if not parameterNode.GetParameter(self.IMAGE_COMPRESSION_LEVEL):
+				parameterNode.SetParameter(self.IMAGE_COMPRESSION_LEVEL, "1")
+		if not parameterNode.GetParameter(self.IMAGE_KEY_FRAME_INTERVAL):
+				parameterNode.SetParameter(self.IMAGE_KEY_FRAME_INTERVAL, "30")
+		if not parameterNode.GetParameter(self.DEDUPLICATE_FRAMES):
+				parameterNode.SetParameter(self.DEDUPLICATE_FRAMES, "true")
+		if not parameterNode.GetParameter(self.RECORD_SLICES):
+				parameterNode.SetParameter(self.RECORD_SLICES, "false")
+		if not parameterNode.GetParameter(self.AUTO_SYNC_SCREWS):
+				parameterNode.SetParameter(self.AUTO_SYNC_SCREWS, "false")
+		if not parameterNode.GetParameter(self.SCREW_SYNC_DELAY_MS):
+				parameterNode.SetParameter(self.SCREW_SYNC_DELAY_MS, "250")
+		if not parameterNode.GetParameter(self.SAVE_SCENE):
+				parameterNode.SetParameter(self.SAVE_SCENE, "true")
+		if not parameterNode.GetParameter(self.SAVE_SCENE_IN_BACKGROUND):
+				parameterNode.SetParameter(self.SAVE_SCENE_IN_BACKGROUND, "true")
+		if not parameterNode.GetParameter(self.SCENE_COMPRESSION_LEVEL):
+				parameterNode.SetParameter(self.SCENE_COMPRESSION_LEVEL, "1")
+		for parameterName, defaultValue in self.RESLICE_QUALITY_DEFAULTS.items():
+			if not parameterNode.GetParameter(parameterName):
+				parameterNode.SetParameter(parameterName, defaultValue)
+
+	def isLiveWindowLevel(self):
+		"""
+		Return True if the window width and level are applied to the CT_reslice output instead of the input volume.
+		"""
+		return self.getParameterNode().GetParameter(self.LIVE_WINDOW_LEVEL) != "false"
+
+	def GetVolumeStatistics(self, volumeNode):
+		"""
+		Get the intensity statistics (min, max, histogram, percentiles) of the volume.
+		They are computed once and cached until the voxels of the volume are modified.
+		"""
+		imageData = volumeNode.GetImageData()
+		if imageData is None:
+			return None
+		if not self.hasObserver(volumeNode, slicer.vtkMRMLVolumeNode.ImageDataModifiedEvent, self.onVolumeImageDataModified):
+			self.addObserver(volumeNode, slicer.vtkMRMLVolumeNode.ImageDataModifiedEvent, self.onVolumeImageDataModified)
+		return self.volumeStatistics.get(volumeNode.GetID(), imageData.GetMTime(), lambda: slicer.util.arrayFromVolume(volumeNode))
+
+	def onVolumeImageDataModified(self, caller, event):
+		"""
+		Discard the cached intensity statistics of a volume whose voxels have changed.
+		"""
+		self.volumeStatistics.invalidate(caller.GetID())
 
 	def updateHistLimitsFromInput(self):
 		"""
 		Update the min and max values of the histogram slide bar from the input volume.
+		Return the intensity statistics of the input volume (None if there is no input volume).
 		"""
 		parameterNode = self.getParameterNode()
 		inputVolume = parameterNode.GetNodeReference(self.INPUT_VOLUME)
-		# if the volume is not loaded, set the hist slidebar to 
+		# if the volume is not loaded, keep the current hist slidebar limits
 		if inputVolume is None:
-			return
-		# get the image array
-		imageArray = slicer.util.arrayFromVolume(inputVolume)
-		# get the min and max values of the image array
-		minValue = int(imageArray.min())
-		maxValue = int(imageArray.max())
+			return None
+		volumeStatistics = self.GetVolumeStatistics(inputVolume)
+		if volumeStatistics is None:
+			return None
 		# set the min and max values in the parameter node
-		parameterNode.SetParameter(self.IMAGE_HIST_SLIDEBAR_minLimit, str(minValue))
-		parameterNode.SetParameter(self.IMAGE_HIST_SLIDEBAR_maxLimit, str(maxValue))			
+		parameterNode.SetParameter(self.IMAGE_HIST_SLIDEBAR_minLimit, str(int(volumeStatistics.minimum)))
+		parameterNode.SetParameter(self.IMAGE_HIST_SLIDEBAR_maxLimit, str(int(volumeStatistics.maximum)))
+		return volumeStatistics
 
 	def UpdateImageValuesWithSlider(self):
 		"""
@@ -550,10 +807,24 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		parameterNode.SetParameter(self.WINDOW_WIDTH, str(ww))
 		parameterNode.SetParameter(self.WINDOW_LEVEL, str(wl))
 
+		# In live mode, re-map the last reslice so that the new contrast is sent without waiting for a plane motion
+		if self.windowResliceOutput and ww > 0:
+			if self.resliceWindowLevel.setWindowLevel(ww, wl):
+				if self.resliceWorker is not None:
+					self.RequestResliceUpdate() # the worker windows its own reslice output
+				else:
+					self.UpdateResliceOutput()
+
 	def CreateImageSlice(self):
 		"""
 		Create an image reslice.
+		In live window/level mode the input volume is resliced as is and only the reslice output is windowed.
+		Otherwise, the window width and level are baked into a [0-255] unsigned char copy of the input volume.
 		"""
+		if self.isLiveWindowLevel():
+			inputVolume = self.getParameterNode().GetNodeReference(self.INPUT_VOLUME)
+			self.CreateSlide(inputVolume)
+			return
 
 		self.SetVolumeRangeTo_0_255()
 		
@@ -567,57 +838,71 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		"""
 		parameterNode = self.getParameterNode()
 		inputVolume = parameterNode.GetNodeReference(self.INPUT_VOLUME)
+		# arrayFromVolume returns a view of the voxels, no copy is made
 		imageArray = slicer.util.arrayFromVolume(inputVolume)
 
 		# Get the window width and window level parameters
 		displayNode = inputVolume.GetDisplayNode()
 		windowWidth = displayNode.GetWindow()
 		windowLevel = displayNode.GetLevel()
-		lowerlimit = windowLevel - (windowWidth/2)
-		# Update the image array with the new values
-		imageArray = ((imageArray - lowerlimit)/windowWidth)*255
-		#Clip the values to [0,255] range so that every value below 0 is set to 0 and every value above 255 is set to 255
-		imageArray = np.clip(imageArray, 0,255)
-		#Update the volume with the new values
-		slicer.util.updateVolumeFromArray(inputVolume, imageArray)
+		# Map [WL - WW/2, WL + WW/2] to [0,255], slab by slab, so that no full-size temporary is created.
+		# Values below the window are set to 0 and values above it to 255.
+		if np.issubdtype(imageArray.dtype, np.integer) and windowing.holdsUCharRange(imageArray.dtype):
+			# In place: the integer voxels hold [0,255] exactly
+			windowing.applyWindowLevel(imageArray, windowWidth, windowLevel, out=imageArray)
+			# Let Slicer know that the voxels have changed
+			slicer.util.arrayFromVolumeModified(inputVolume)
+		else:
+			# int8 voxels cannot hold [128,255], and float voxels would be truncated: window into a new uint8 array instead
+			slicer.util.updateVolumeFromArray(inputVolume, windowing.applyWindowLevel(imageArray, windowWidth, windowLevel))
 
 	def ChangeScalarTypeToUChar(self):
 		"""
-		Change the type of image to UChar using the "Resample Image (BRAINS)" module.
+		Create the "UCharVolume" node: an unsigned char copy of the (already windowed) input volume.
+		The voxels are copied in-process into a volume with the same origin, spacing and directions, so no resampling is needed.
 		"""
 		parameterNode = self.getParameterNode()
 		inputVolume = parameterNode.GetNodeReference(self.INPUT_VOLUME)
 
-		# Set all the parameters required for the cli module
-		parameters = {}
-		parameters["inputVolume"] = inputVolume.GetID()
-		parameters["referenceVolume"] = 'None'
-		outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "UCharVolume")
-		parameters["outputVolume"] = outputVolume.GetID()
-		parameters["pixelType"] = "uchar"
-		parameters["deformationVolume"] = 'None'
-		identityTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "Identity_T")
-		parameters["warpTransform"] = identityTransform.GetID()
-		parameters["interpolationMode"] = "Linear"
-		parameters["inverseTransform"] = 'False'
+		# To allow re-run of this script, reuse the existing node before creating a new one
+		outputVolume = slicer.mrmlScene.GetFirstNodeByName("UCharVolume")
+		if outputVolume is None:
+			outputVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "UCharVolume")
 
-		# Access the "Resample Image (BRAINS)" module and apply the parameters to it
-		node  = slicer.cli.createNode(slicer.modules.brainsresample)
-		resampleImageModule = slicer.modules.brainsresample
-		slicer.cli.run(resampleImageModule, node, parameters, True) # Execute it
+		# Keep the geometry of the input volume
+		ijkToRasMatrix = vtk.vtkMatrix4x4()
+		inputVolume.GetIJKToRASMatrix(ijkToRasMatrix)
+		outputVolume.SetIJKToRASMatrix(ijkToRasMatrix)
 
-		slicer.mrmlScene.RemoveNode(slicer.util.getNode('Identity_T')) # We had to create an identity transform to run the process. Once we have finish, delete this transform from the scene
+		# Allocate the unsigned char voxels and copy the [0,255] values straight into them
+		imageData = vtk.vtkImageData()
+		imageData.SetDimensions(inputVolume.GetImageData().GetDimensions())
+		imageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+		outputVolume.SetAndObserveImageData(imageData)
+		outputArray = slicer.util.arrayFromVolume(outputVolume)
+		np.copyto(outputArray, slicer.util.arrayFromVolume(inputVolume), casting='unsafe')
+		slicer.util.arrayFromVolumeModified(outputVolume)
 
-	def CreateSlide(self):
+		return outputVolume
+
+	def CreateSlide(self, inputVolume=None):
 		"""
 		Create the image reslice.
+		If inputVolume is given, it is resliced at full precision and the reslice output is windowed into CT_reslice
+		with the current window width and level of the volume. Otherwise, the [0-255] "UCharVolume" node is resliced.
 		"""
 		parameterNode = self.getParameterNode()
-		inputVolume = slicer.mrmlScene.GetFirstNodeByName("UCharVolume")
+		liveWindowLevel = inputVolume is not None
+		if liveWindowLevel:
+			displayNode = inputVolume.GetDisplayNode()
+			self.resliceWindowLevel.setWindowLevel(displayNode.GetWindow(), displayNode.GetLevel())
+		else:
+			inputVolume = slicer.mrmlScene.GetFirstNodeByName("UCharVolume")
 
-		observerTag = None
-		outputSpacing = [1.0, 1.0, 1.0]  # Millimeters/pixel
-		outputExtent = [0, 99, 0, 99, 0, 0] # First and last pixel indices along each axis
+		# CT_reslice geometry comes from the parameter node. While the plane moves, the reslice may be computed
+		# on a coarser grid (and upsampled to this geometry).
+		self.resliceQualityPolicy = self.CreateResliceQualityPolicy()
+		outputExtent, outputSpacing, _ = self.resliceQualityPolicy.outputGeometry(reslicequality.REFINED) # First and last pixel indices along each axis, millimeters/pixel
 
 		'''
 		Extent cannot be negative, because some Slicer components assume that extent starts at zero
@@ -633,14 +918,18 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		inputVolume.GetRASToIJKMatrix(volumeToIjkMatrix)
 
 		sliceToRasTransform = vtk.vtkTransform()
-		sliceToRasTransform.Translate(-100, -100, 0.0)
-		sliceToRasTransform.RotateX(30)
-		sliceToRasTransform.RotateY(30)
+		sliceToRasTransform.SetMatrix(slicer.util.vtkMatrixFromArray(np.array(pose.poseMatrix(self.INITIAL_SLICE_TRANSLATION, *self.INITIAL_SLICE_ROTATION))))
 
 		sliceToIjkTransform = vtk.vtkTransform()
 		sliceToIjkTransform.Concatenate(volumeToIjkMatrix)
 		sliceToIjkTransform.Concatenate(sliceToRasTransform)
 
+		# Downsampled copies of the volume, used when the reslice samples it at a coarser spacing than its voxels
+		self.BuildReslicePyramid(inputVolume, sliceToIjkTransform)
+
+		# The first frame of the new slice is always published
+		self.frameDeduplicator.reset()
+
 		# Use MRML node to modify transform in GUI
 		sliceToRasNode = slicer.mrmlScene.GetFirstNodeByName("Image_T")
 		if sliceToRasNode is None:
@@ -653,14 +942,19 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		reslice = vtk.vtkImageReslice()
 		reslice.SetInputData(inputVolume.GetImageData())
 		reslice.SetResliceTransform(sliceToIjkTransform)
-		reslice.SetInterpolationModeToLinear()
 		reslice.SetOutputOrigin(0.0, 0.0, 0.0)  # Must keep zero so transform overlays slice with volume
-		reslice.SetOutputSpacing(outputSpacing)
 		reslice.SetOutputDimensionality(2)
-		reslice.SetOutputExtent(outputExtent)
-		reslice.SetBackgroundLevel(0)
+		self.SetResliceGeometry(reslice, self.resliceQualityPolicy.outputGeometry(reslicequality.REFINED))
+		if liveWindowLevel:
+			# Fill the outside of the volume with its lowest intensity, so that it is mapped to black
+			reslice.SetBackgroundLevel(self.GetVolumeStatistics(inputVolume).minimum)
+		else:
+			reslice.SetBackgroundLevel(0)
 		reslice.Update()
 		reslice.GetOutput().SetSpacing(1,1,1)  # Spacing will be set on MRML node to let Slicer know
+		self.reslice = reslice
+		self.refineTimer.stop()
+		self.windowResliceOutput = liveWindowLevel
 
 		# To allow re-run of this script, try to reuse exisiting node before creating a new one
 		# Get the output node by ID instead
@@ -672,7 +966,13 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 				# get the node again, and print it
 				outputNode = parameterNode.GetNodeReference(self.CT_RESLICE_OUTPUT)
 		
-		outputNode.SetAndObserveImageData(reslice.GetOutput())
+		# CT_reslice holds an unsigned char copy of the reslice output (windowed in live mode), so that it can
+		# also receive the frames computed in the background
+		outputImageData = vtk.vtkImageData()
+		outputImageData.SetExtent(outputExtent)
+		outputImageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+		outputNode.SetAndObserveImageData(outputImageData)
+		self.UpdateResliceOutput()
 		outputNode.SetSpacing(outputSpacing)
 		outputNode.CreateDefaultDisplayNodes()
 		displayNode = outputNode.GetDisplayNode()
@@ -696,31 +996,439 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 
 		# Callback function for transform updates
 
-		def UpdateReslice(event, caller):
+		def UpdateReslice():
+				timeline = self.latencyTracker.beginFrame()
+				inputTransformId = inputVolume.GetTransformNodeID()
+				if inputTransformId is not None:
+						inputTransformNode = slicer.mrmlScene.GetNodeByID(inputTransformId)
+						rasToVolumeMatrix = vtk.vtkMatrix4x4()
+						inputTransformNode.GetMatrixTransformFromWorld(rasToVolumeMatrix)
+						sliceToIjkTransform.Identity()
+						sliceToIjkTransform.Concatenate(volumeToIjkMatrix)
+						sliceToIjkTransform.Concatenate(rasToVolumeMatrix)
+						sliceToIjkTransform.Concatenate(sliceToRasTransform)
+
+				geometry = self.resliceQualityPolicy.outputGeometry(self.resliceQualityPolicy.quality())
+				pyramidLevel = self.reslicePyramid.selectLevel(geometry[1][0])
+
+				if self.resliceWorker is not None:
+						# Only pass the pose (and contrast) to the worker, the frame is published when it is completed
+						window = self.resliceWindowLevel.window if liveWindowLevel else None
+						level = self.resliceWindowLevel.level if liveWindowLevel else None
+						self.resliceWorker.submit((slicer.util.arrayFromVTKMatrix(sliceToIjkTransform.GetMatrix()), window, level, geometry, pyramidLevel, timeline))
+						return
+
 				try:
 						slicer.app.pauseRender()
-						
-						inputTransformId = inputVolume.GetTransformNodeID()
-						if inputTransformId is not None:
-								inputTransformNode = slicer.mrmlScene.GetNodeByID(inputTransformId)
-								rasToVolumeMatrix = vtk.vtkMatrix4x4()
-								inputTransformNode.GetMatrixTransformFromWorld(rasToVolumeMatrix)
-								sliceToIjkTransform.Identity()
-								sliceToIjkTransform.Concatenate(volumeToIjkMatrix)
-								sliceToIjkTransform.Concatenate(rasToVolumeMatrix)
-								sliceToIjkTransform.Concatenate(sliceToRasTransform)
-						
+						self.SetResliceGeometry(reslice, geometry)
+						self.SetReslicePyramidLevel(reslice, pyramidLevel)
+						self.latencyTracker.mark(timeline, latency.RESLICE_START)
 						reslice.Update()
+						self.latencyTracker.mark(timeline, latency.RESLICE_END)
 						reslice.GetOutput().SetSpacing(1,1,1)
+						self.UpdateResliceOutput(timeline)
 
 				finally:
 						slicer.app.resumeRender()
 
-		if observerTag is not None:
-				sliceToRasNode.RemoveObserver(observerTag)
-				observerTag = None
+		# Transform updates only request a reslice. Requests arriving faster than the target rate are coalesced,
+		# and the reslice always uses the latest pose when it runs.
+		self.resliceTimer.stop()
+		self.resliceScheduler = scheduling.CoalescingScheduler(UpdateReslice, self.GetResliceTargetRate())
+
+		if self.resliceObservation is not None:
+				self.resliceObservation[0].RemoveObserver(self.resliceObservation[1])
+				self.resliceObservation = None
+
+		observerTag = sliceToRasNode.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onImageTransformModified)
+		self.resliceObservation = (sliceToRasNode, observerTag)
+
+		# Restart the background reslice (if enabled) on the new volume
+		self.StopResliceWorker()
+		if self.IsResliceInBackground():
+			self.StartResliceWorker()
+
+	def IsResliceInBackground(self):
+		"""
+		Return True if the reslice is computed on a worker thread.
+		"""
+		return self.getParameterNode().GetParameter(self.RESLICE_IN_BACKGROUND) == "true"
+
+	def SetResliceInBackground(self, enable):
+		"""
+		Enable or disable the background reslice mode.
+		"""
+		self.getParameterNode().SetParameter(self.RESLICE_IN_BACKGROUND, "true" if enable else "false")
+		self.StopResliceWorker()
+		if enable and self.reslice is not None:
+			self.StartResliceWorker()
+
+	def StartResliceWorker(self):
+		"""
+		Start reslicing on a worker thread. The worker has its own reslice filter working on a read-only snapshot
+		of the resliced volume. Completed frames are swapped into a front buffer and copied to CT_reslice by the publish timer.
+		"""
+		outputExtent, _, _ = self.resliceQualityPolicy.outputGeometry(reslicequality.REFINED)
+		outputShape = (outputExtent[5] - outputExtent[4] + 1, outputExtent[3] - outputExtent[2] + 1, outputExtent[1] - outputExtent[0] + 1)
+
+		# The voxels are not modified while the slice is displayed, so the worker can read them through shallow copies
+		snapshots = []
+		for levelImage, _ in self.reslicePyramidLevels:
+				snapshot = vtk.vtkImageData()
+				snapshot.ShallowCopy(levelImage)
+				snapshots.append(snapshot)
+		backgroundReslice = vtk.vtkImageReslice()
+		backgroundReslice.SetOutputOrigin(self.reslice.GetOutputOrigin())
+		backgroundReslice.SetOutputDimensionality(2)
+		backgroundReslice.SetBackgroundLevel(self.reslice.GetBackgroundLevel())
+		resliceAxes = vtk.vtkMatrix4x4()
+		backgroundReslice.SetResliceAxes(resliceAxes)
+		backgroundWindowLevel = windowing.WindowLevelMapper()
+
+		def ComputeReslice(request, outputArray):
+				sliceToIjkMatrix, window, level, geometry, pyramidLevel, timeline = request
+				self.latencyTracker.mark(timeline, latency.RESLICE_START)
+				sliceToLevelIjkMatrix = pyramid.levelFromBaseIjkMatrix(pyramidLevel) @ sliceToIjkMatrix
+				resliceAxes.DeepCopy(list(sliceToLevelIjkMatrix.ravel()))
+				backgroundReslice.SetInputData(snapshots[pyramidLevel])
+				self.SetResliceGeometry(backgroundReslice, geometry)
+				backgroundReslice.Update()
+				resliceArray = self.ArrayFromResliceOutput(backgroundReslice)
+				if window is not None:
+						backgroundWindowLevel.setWindowLevel(window, level)
+						resliceArray = backgroundWindowLevel.map(resliceArray)
+				reslicequality.upsampleNearest(resliceArray, outputArray)
+				self.latencyTracker.mark(timeline, latency.RESLICE_END)
+				return timeline # published with the frame
+
+		self.resliceWorker = workers.LatestRequestWorker(ComputeReslice, outputShape, np.uint8, name="AR_PlannerReslice")
+		self.publishTimer.start()
+
+	def StopResliceWorker(self):
+		"""
+		Stop the background reslice worker, if it is running.
+		"""
+		self.publishTimer.stop()
+		if self.resliceWorker is not None:
+			self.resliceWorker.stop()
+			self.resliceWorker = None
+
+	def onPublishTimerTimeout(self):
+		"""
+		Copy the last frame completed by the background reslice into CT_reslice.
+		"""
+		outputNode = self.getParameterNode().GetNodeReference(self.CT_RESLICE_OUTPUT)
+		if self.resliceWorker is None or outputNode is None:
+			return
+		if self.resliceWorker.takeFrame(slicer.util.arrayFromVolume(outputNode)):
+			self.PublishResliceOutput(outputNode, self.resliceWorker.lastFrameMetadata)
+
+	def GetResliceTargetRate(self):
+		"""
+		Get the maximum number of reslice updates per second from the parameter node.
+		"""
+		return float(self.getParameterNode().GetParameter(self.RESLICE_TARGET_RATE))
+
+	def SetResliceTargetRate(self, rate):
+		"""
+		Set the maximum number of reslice updates per second (0: reslice on every transform update).
+		"""
+		self.getParameterNode().SetParameter(self.RESLICE_TARGET_RATE, str(rate))
+		if self.resliceScheduler is not None:
+			self.resliceScheduler.targetRate = rate
+
+	def GetResliceSchedulerStatistics(self):
+		"""
+		Get the reslice update counters (requested, run, coalesced, dropped) and durations.
+		"""
+		if self.resliceScheduler is None:
+			return None
+		return self.resliceScheduler.statistics()
+
+	def onImageTransformModified(self, caller, event):
+		"""
+		Called when the Image_T transform is modified. Schedule a reslice update.
+		"""
+		self.latencyTracker.markReceived()
+		sliceToRasMatrix = vtk.vtkMatrix4x4()
+		caller.GetMatrixTransformToParent(sliceToRasMatrix)
+		if self.resliceQualityPolicy.update(slicer.util.arrayFromVTKMatrix(sliceToRasMatrix)) and self.resliceQualityPolicy.isRefinementNeeded():
+			# Refine the image once the plane has been still for the settle time
+			self.refineTimer.start(int(round(self.resliceQualityPolicy.settleTime * 1000)))
+		self.RequestResliceUpdate()
+
+	def onRefineTimerTimeout(self):
+		"""
+		Run the refinement pass once the image plane has been still for the settle time.
+		"""
+		remainingTime = self.resliceQualityPolicy.timeUntilSettled()
+		if remainingTime > 0: # the plane moved again, or the timer fired early
+			self.refineTimer.start(int(math.ceil(remainingTime * 1000)))
+			return
+		self.RequestResliceUpdate()
+
+	def RequestResliceUpdate(self):
+		"""
+		Schedule a reslice update with the current pose.
+		"""
+		if self.resliceScheduler is None:
+			return
+		delay = self.resliceScheduler.request()
+		if delay is not None: # otherwise an update is already pending and will use this pose
+			self.resliceTimer.start(int(round(delay * 1000)))
+
+	def CreateResliceQualityPolicy(self):
+		"""
+		Create the reslice quality policy from the output geometry and quality settings of the parameter node.
+		"""
+		parameterNode = self.getParameterNode()
+		motionThreshold = float(parameterNode.GetParameter(self.RESLICE_MOTION_THRESHOLD))
+		return reslicequality.ResliceQualityPolicy(
+			outputSize=[int(size) for size in parameterNode.GetParameter(self.RESLICE_OUTPUT_SIZE).split(",")],
+			spacing=float(parameterNode.GetParameter(self.RESLICE_SPACING)),
+			interactiveFactor=int(parameterNode.GetParameter(self.RESLICE_INTERACTIVE_FACTOR)),
+			interactiveInterpolation=parameterNode.GetParameter(self.RESLICE_INTERACTIVE_INTERPOLATION),
+			refinedInterpolation=parameterNode.GetParameter(self.RESLICE_REFINED_INTERPOLATION),
+			translationSpeedThreshold=motionThreshold,
+			rotationSpeedThreshold=motionThreshold,
+			settleTime=float(parameterNode.GetParameter(self.RESLICE_SETTLE_TIME)) / 1000.0)
+
+	def BuildReslicePyramid(self, inputVolume, sliceToIjkTransform):
+		"""
+		Build the downsampled levels of the resliced volume, and the transforms from the slice to the IJK coordinates of each level.
+		"""
+		numberOfLevels = int(self.getParameterNode().GetParameter(self.RESLICE_PYRAMID_LEVELS))
+		self.reslicePyramid = pyramid.VolumePyramid(slicer.util.arrayFromVolume(inputVolume), inputVolume.GetSpacing(), numberOfLevels)
+		self.reslicePyramidLevels = [(inputVolume.GetImageData(), sliceToIjkTransform)]
+		for level in range(1, self.reslicePyramid.numberOfLevels):
+			levelArray = self.reslicePyramid.levels[level]
+			levelImage = vtk.vtkImageData()
+			levelImage.SetDimensions(levelArray.shape[::-1])
+			levelImage.GetPointData().SetScalars(vtk.util.numpy_support.numpy_to_vtk(levelArray.ravel(), deep=False)) # the pyramid keeps the array alive
+			sliceToLevelIjkTransform = vtk.vtkTransform()
+			sliceToLevelIjkTransform.Concatenate(slicer.util.vtkMatrixFromArray(pyramid.levelFromBaseIjkMatrix(level)))
+			sliceToLevelIjkTransform.Concatenate(sliceToIjkTransform) # follows the changes of the slice pose
+			self.reslicePyramidLevels.append((levelImage, sliceToLevelIjkTransform))
+		logging.debug("Reslice pyramid: {0} levels, {1:.1f} MB".format(self.reslicePyramid.numberOfLevels, self.reslicePyramid.nbytes() / 1e6))
+
+	def SetReslicePyramidLevel(self, reslice, level):
+		"""
+		Make the reslice filter sample the given pyramid level.
+		"""
+		levelImage, sliceToLevelIjkTransform = self.reslicePyramidLevels[level]
+		reslice.SetInputData(levelImage)
+		reslice.SetResliceTransform(sliceToLevelIjkTransform)
+
+	def SetResliceGeometry(self, reslice, geometry):
+		"""
+		Set the output extent, spacing and interpolation mode returned by ResliceQualityPolicy.outputGeometry to a reslice filter.
+		"""
+		outputExtent, outputSpacing, interpolation = geometry
+		reslice.SetOutputExtent(outputExtent)
+		reslice.SetOutputSpacing(outputSpacing)
+		reslice.SetInterpolationMode(self.INTERPOLATION_MODES[interpolation])
+
+	def ArrayFromResliceOutput(self, reslice):
+		"""
+		Get a KJI array view of the reslice output.
+		"""
+		resliceImage = reslice.GetOutput()
+		dims = resliceImage.GetDimensions()
+		return vtk.util.numpy_support.vtk_to_numpy(resliceImage.GetPointData().GetScalars()).reshape(dims[2], dims[1], dims[0])
 
-		observerTag = sliceToRasNode.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent, UpdateReslice)
+	def onResliceTimerTimeout(self):
+		"""
+		Run the pending reslice update.
+		"""
+		if self.resliceScheduler is not None:
+			self.resliceScheduler.runPending()
+
+	def UpdateResliceOutput(self, timeline=None):
+		"""
+		Copy the current reslice output into the unsigned char CT_reslice image, windowing it in live window/level mode.
+		A reslice computed on a coarser grid (interactive quality) is upsampled to the CT_reslice size.
+		timeline is the latency timeline of the frame, if it is tracked.
+		"""
+		outputNode = self.getParameterNode().GetNodeReference(self.CT_RESLICE_OUTPUT)
+		if self.reslice is None or outputNode is None:
+			return
+		resliceArray = self.ArrayFromResliceOutput(self.reslice)
+		outputArray = slicer.util.arrayFromVolume(outputNode)
+		if self.windowResliceOutput:
+			if resliceArray.shape == outputArray.shape:
+				self.resliceWindowLevel.map(resliceArray, out=outputArray)
+			else:
+				reslicequality.upsampleNearest(self.resliceWindowLevel.map(resliceArray), outputArray)
+		else:
+			reslicequality.upsampleNearest(resliceArray, outputArray)
+		self.PublishResliceOutput(outputNode, timeline)
+
+	def HasResliceOutput(self):
+		"""
+		Return True once CreateSlide has resliced a frame into CT_reslice.
+		"""
+		outputNode = self.getParameterNode().GetNodeReference(self.CT_RESLICE_OUTPUT)
+		return self.reslice is not None and outputNode is not None and outputNode.GetImageData() is not None
+
+	def PublishResliceOutput(self, outputNode, timeline=None):
+		"""
+		Notify that a new frame was written into CT_reslice and, with a compressed image transport, encode it into CT_reslice_Packed.
+		A frame identical to the last published one is suppressed: no Modified event, so nothing is rendered or sent.
+		The connector sends the image while it processes the Modified event, which ends the latency timeline of the frame.
+		"""
+		self.latencyTracker.mark(timeline, latency.PUBLISH)
+		outputArray = slicer.util.arrayFromVolume(outputNode)
+		if self.IsFrameDeduplicationEnabled() and self.frameDeduplicator.isDuplicate(outputArray):
+			self.latencyTracker.dropFrame(timeline)
+			return
+		slicer.util.arrayFromVolumeModified(outputNode)
+		if self.sessionRecorder is not None:
+			self.sessionRecorder.recordSlice(outputArray[0])
+		if self.frameEncoder is not None:
+			packet = self.frameEncoder.encode(outputArray[0])
+			compressedNode = self.GetOrCreateCompressedResliceNode()
+			slicer.util.updateVolumeFromArray(compressedNode, imagecodec.packetToImage(packet)[np.newaxis])
+			logging.debug("Frame {sequence}: {rawBytes} -> {encodedBytes} bytes (ratio {compressionRatio:.2f}, key frame: {keyFrame}), encoded in {encodeTime:.6f} s".format(
+				**self.frameEncoder.lastFrameStatistics))
+		self.latencyTracker.finishFrame(timeline)
+
+	def IsFrameDeduplicationEnabled(self):
+		"""
+		Return True if frames identical to the previous one are suppressed.
+		"""
+		return self.getParameterNode().GetParameter(self.DEDUPLICATE_FRAMES) != "false"
+
+	def SetFrameDeduplicationEnabled(self, enable):
+		"""
+		Enable or disable the suppression of frames identical to the previous one.
+		"""
+		self.getParameterNode().SetParameter(self.DEDUPLICATE_FRAMES, "true" if enable else "false")
+		self.frameDeduplicator.reset()
+
+	def GetFrameDeduplicationStatistics(self):
+		"""
+		Get the counters of checked, suppressed and published CT_reslice frames.
+		"""
+		return self.frameDeduplicator.statistics()
+
+	def GetLatencySummary(self):
+		"""
+		Get the rolling p50/p95/p99 latencies (seconds) of each stage of the image stream.
+		"""
+		return self.latencyTracker.summary()
+
+	def ResetLatencyStatistics(self):
+		self.latencyTracker.reset()
+
+	def ExportLatencyCsv(self, path):
+		"""
+		Write the latency timelines of the last frames to a CSV file.
+		"""
+		self.latencyTracker.exportCsv(path)
+		logging.info("Latency of {0} frames exported to {1}".format(len(self.latencyTracker.timelines), path))
+
+	def GetOrCreateCompressedResliceNode(self):
+		"""
+		Get the volume that carries the compressed CT_reslice frames: one imagecodec packet laid out as a single-slice uint8 image.
+		"""
+		compressedNode = slicer.mrmlScene.GetFirstNodeByName(self.COMPRESSED_RESLICE_OUTPUT)
+		if compressedNode is None:
+			compressedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", openigtlink.checkDeviceName(self.COMPRESSED_RESLICE_OUTPUT))
+			compressedNode.SetHideFromEditors(True)
+		return compressedNode
+
+	def GetImageTransport(self):
+		"""
+		Get the image transport mode from the parameter node.
+		"""
+		return self.getParameterNode().GetParameter(self.IMAGE_TRANSPORT)
+
+	def SetImageTransport(self, mode):
+		"""
+		Set the image transport mode: raw, or one of the compressed modes of imagecodec.TRANSPORT_MODES. Applied when the connection starts.
+		"""
+		if mode != "raw" and mode not in imagecodec.TRANSPORT_MODES:
+			raise ValueError("Unknown or unavailable image transport: {0}. Available: {1}".format(mode, ", ".join(imagecodec.TRANSPORT_MODES)))
+		self.getParameterNode().SetParameter(self.IMAGE_TRANSPORT, mode)
+
+	def GetImageTransportStatistics(self):
+		"""
+		Get the compression counters of the compressed image transport, or None in raw mode.
+		"""
+		if self.frameEncoder is None:
+			return None
+		return self.frameEncoder.statistics()
+
+	def IsSessionRecording(self):
+		return self.sessionRecorder is not None
+
+	def StartSessionRecording(self, directory=None):
+		"""
+		Start recording every transform received from HoloLens (the *_T transforms), and the CT_reslice frames sent if RecordSlices is enabled,
+		into the binary logs of PedicleScrewPlannerLib.sessionlog. By default they go to a Session folder next to the saved scenes.
+		The logs are written by background threads; read them with sessionlog.openLog. Return the recording directory.
+		"""
+		if self.sessionRecorder is not None:
+			self.StopSessionRecording()
+		parameterNode = self.getParameterNode()
+		if directory is None:
+			saveDirectory = slicer.app.userSettings().value(self.SAVING_DIRECTORY)
+			if not saveDirectory:
+				saveDirectory = slicer.app.defaultScenePath
+				logging.warning("No save folder selected: the session is recorded in the default scene folder {0}".format(saveDirectory))
+			directory = os.path.join(saveDirectory, "Patient_00" + parameterNode.GetParameter(self.PATIENT_ID), "User_" + parameterNode.GetParameter(self.USER_ID),
+				"{}_{}".format(time.strftime("%Y-%m-%d_%H-%M-%S"), "Session"))
+		self.sessionRecorder = sessionlog.SessionRecorder(directory, parameterNode.GetParameter(self.RECORD_SLICES) == "true")
+		for transformNode in slicer.util.getNodesByClass("vtkMRMLLinearTransformNode"):
+			self.ObserveRecordedTransform(transformNode)
+		self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedWhileRecording)
+		logging.info("Session recording started in {0}".format(directory))
+		return directory
+
+	def StopSessionRecording(self):
+		"""
+		Stop the session recording and write the queued records.
+		"""
+		if self.sessionRecorder is None:
+			return
+		self.removeObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedWhileRecording)
+		for transformNode in slicer.util.getNodesByClass("vtkMRMLLinearTransformNode"):
+			self.removeObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onRecordedTransformModified)
+		self.sessionRecorder.close()
+		logging.info("Session recording stopped: {transformCount} transforms, {sliceCount} slices, {droppedCount} records dropped".format(
+			**self.sessionRecorder.statistics()))
+		self.sessionRecorder = None
+
+	def ObserveRecordedTransform(self, transformNode):
+		"""
+		Record the modifications of a transform received from HoloLens (Image_T, Spine_T, Screw-N_T).
+		Transforms whose name does not fit in the records (sessionlog.MAX_TRANSFORM_NAME_LENGTH) are not recorded.
+		"""
+		if not transformNode.GetName().endswith("_T"):
+			return
+		try:
+			sessionlog.encodeTransformName(transformNode.GetName())
+		except ValueError as error:
+			logging.warning("Transform not recorded: {0}".format(error))
+			return
+		if not self.hasObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onRecordedTransformModified):
+			self.addObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onRecordedTransformModified)
+
+	@vtk.calldata_type(vtk.VTK_OBJECT)
+	def onNodeAddedWhileRecording(self, caller, event, node):
+		if isinstance(node, slicer.vtkMRMLLinearTransformNode):
+			self.ObserveRecordedTransform(node)
+
+	def onRecordedTransformModified(self, caller, event):
+		if self.sessionRecorder is None:
+			return
+		matrix = vtk.vtkMatrix4x4()
+		caller.GetMatrixTransformToParent(matrix)
+		try:
+			self.sessionRecorder.recordTransform(caller.GetName(), slicer.util.arrayFromVTKMatrix(matrix))
+		except ValueError as error: # renamed since it is observed
+			logging.warning("Transform not recorded anymore: {0}".format(error))
+			self.removeObserver(caller, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onRecordedTransformModified)
 
 	def LoadModelFromFile(self, modelFilePath, modelFileName, colorRGB_array, visibility_bool):
 		"""
@@ -731,7 +1439,7 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		try:
 				node = slicer.util.getNode(modelFileName)
 		except:
-				node = slicer.util.loadModel(os.path.join(modelFilePath, modelFileName))
+				node = self.addModelFromFile(os.path.join(modelFilePath, modelFileName))
 				node.GetModelDisplayNode().SetColor(colorRGB_array)
 				node.GetModelDisplayNode().SetVisibility(visibility_bool)
 				#print (modelFileName + ' model loaded')
@@ -741,42 +1449,200 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 	# Alicia function
 	def LoadScrewModelsFromFile(self):
 		"""
-			First, delete preexisting screw models in the scene. Second, parse the screw transforms received from Unity and load the corresponding screw models from the specified folder
+			Synchronize the screw models with the screw transforms received from Unity, keyed by screw number (OpenIGTLink.ModelNumber). Only the differences with
+			the current models are applied: new screws are loaded from the specified folder, screws whose model file changed are reloaded, screws whose color changed
+			are recolored and screws that are not there anymore are deleted. Return the applied screws.ScrewDiff.
 		"""
 		parameterNode = self.getParameterNode()
 		screwPath = parameterNode.GetParameter(self.SCREWS_DIRECTORY) # Get path to screw models
 
-		modelNodes = slicer.util.getNodesByClass("vtkMRMLModelNode")
-		for modelNode in modelNodes: # Everytime we click on the "Load screw models" button, we delete all screws in the scene. Then we create the new ones.
-			if ("Screw" in modelNode.GetName()):
-				slicer.mrmlScene.RemoveNode(modelNode)
-
 		imageNode = slicer.util.getFirstNodeByName("Image_T")
 		numberOfScrews = int(imageNode.GetAttribute("OpenIGTLink.NumOfScrews"))
-		transformNodes = slicer.util.getNodesByClass("vtkMRMLLinearTransformNode")
-		for i in range(len(transformNodes)):
-			tNode = transformNodes[i]
-			transformName = tNode.GetName()
-			
-			if ("Screw" in transformName):
-				screwTransformNumber = int(tNode.GetAttribute("OpenIGTLink.ModelNumber"))
 
-				if (screwTransformNumber > numberOfScrews):
-					slicer.mrmlScene.RemoveNode(tNode) # If there are preexisting screw transforms corresponding to models that are not there anymore, delete them. For instance, if there were two screw transforms in the scene and
-																						 # the user in HoloLens deletes one screw, the Screw-2_T won't be updated anymore, but it won't be deleted in 3D Slicer either. We use this lines to perform this process manually.
-																						 # We receive the number of active screws in HoloLens through the "NumOfScrews" attribute. We compare the number of screws with the amount of transforms we have in Slicer. If there are
-																						 # more transforms than screws, delete the extra ones
+		# Screws in HoloLens, from the metadata of the screw transforms
+		desiredScrews = {}
+		screwTransformNodes = {}
+		for tNode in self.screwRegistry.transforms().values():
+			if tNode.GetAttribute("OpenIGTLink.ModelNumber") is None:
+				continue
+			screwSpec = screws.screwSpecFromMetadata({key: tNode.GetAttribute("OpenIGTLink." + key) for key in ("ModelNumber", "ModelName", "ModelColor")})
+			if (screwSpec.number > numberOfScrews):
+				slicer.mrmlScene.RemoveNode(tNode) # If the user in HoloLens deletes a screw, its transform is not updated anymore, but it is not deleted in 3D Slicer either.
+				                                   # We receive the number of active screws in HoloLens through the "NumOfScrews" attribute: delete the extra transforms
+				continue
+			desiredScrews[screwSpec.number] = screwSpec
+			screwTransformNodes[screwSpec.number] = tNode
+
+		# Screws in the scene, from the attributes set when their models were loaded
+		currentScrews = {}
+		screwModelNodes = {}
+		for screwNumber, modelNode in self.screwRegistry.models().items():
+			modelColor = modelNode.GetAttribute(self.SCREW_MODEL_COLOR_ATTRIBUTE)
+			currentScrews[screwNumber] = screws.ScrewSpec(screwNumber, modelNode.GetAttribute(self.SCREW_MODEL_NAME_ATTRIBUTE),
+				screws.parseColor(modelColor) if modelColor else None)
+			screwModelNodes[screwNumber] = modelNode
+
+		screwDiff = screws.diffScrews(currentScrews, desiredScrews)
+		for screwNumber in screwDiff.removed:
+			slicer.mrmlScene.RemoveNode(screwModelNodes.pop(screwNumber))
+		for screwSpec in screwDiff.modelChanged:
+			slicer.mrmlScene.RemoveNode(screwModelNodes.pop(screwSpec.number))
+		for screwSpec in screwDiff.added + screwDiff.modelChanged:
+			screwModelNodes[screwSpec.number] = self.LoadScrewModelFromSpec(screwPath, screwSpec)
+		for screwSpec in screwDiff.colorChanged:
+			screwModelNodes[screwSpec.number].GetModelDisplayNode().SetColor(screwSpec.color)
+			screwModelNodes[screwSpec.number].SetAttribute(self.SCREW_MODEL_COLOR_ATTRIBUTE, screws.formatColor(screwSpec.color))
+			self.journalScrew(screwSpec.number)
+
+		# Make sure every screw follows its transform, which follows the spine
+		spineTransformID = self.GetOrCreateTransform(self.SPINE_TRANSFORM).GetID()
+		for screwNumber, tNode in screwTransformNodes.items():
+			if screwModelNodes[screwNumber].GetTransformNodeID() != tNode.GetID():
+				screwModelNodes[screwNumber].SetAndObserveTransformNodeID(tNode.GetID())
+			if tNode.GetTransformNodeID() != spineTransformID:
+				tNode.SetAndObserveTransformNodeID(spineTransformID)
+
+		self.syncedScrews = desiredScrews
+		self.syncedNumberOfScrews = numberOfScrews
+		logging.info("Screw sync: {0} added, {1} reloaded, {2} recolored, {3} removed".format(
+			len(screwDiff.added), len(screwDiff.modelChanged), len(screwDiff.colorChanged), len(screwDiff.removed)))
+		return screwDiff
+
+	@vtk.calldata_type(vtk.VTK_OBJECT)
+	def onNodeRemovedFromScrewRegistry(self, caller, event, node):
+		PlannerLogicMixin.onNodeRemovedFromScrewRegistry(self, caller, event, node)
+		if isinstance(node, slicer.vtkMRMLLinearTransformNode):
+			self.StopObservingScrewSyncSource(node)
+
+	def restoreJournalScrew(self, journalScrew):
+		"""
+		Recreate a screw of a plan journal: its Screw-N_T transform under Spine_T, with its last matrix and its OpenIGTLink metadata
+		(so that the screw sync keeps it), and its screw model from the screw folder.
+		"""
+		transformNode = self.getOrCreateScrewTransform(journalScrew.number)
+		if journalScrew.matrix is not None:
+			slicer.util.updateTransformMatrixFromArray(transformNode, journalScrew.matrix)
+		transformNode.SetAndObserveTransformNodeID(self.GetOrCreateTransform(self.SPINE_TRANSFORM).GetID())
+		if not journalScrew.modelName:
+			return True
+		screwSpec = screws.ScrewSpec(journalScrew.number, journalScrew.modelName, journalScrew.color or (1.0, 1.0, 1.0))
+		transformNode.SetAttribute("OpenIGTLink.ModelNumber", str(screwSpec.number))
+		transformNode.SetAttribute("OpenIGTLink.ModelName", screwSpec.modelName)
+		transformNode.SetAttribute("OpenIGTLink.ModelColor", screws.formatColor(screwSpec.color))
+		if screwSpec.number not in self.screwRegistry.models():
+			screwPath = self.getParameterNode().GetParameter(self.SCREWS_DIRECTORY)
+			self.LoadScrewModelFromSpec(screwPath, screwSpec).SetAndObserveTransformNodeID(transformNode.GetID())
+		return True
+
+	def IsAutoScrewSyncEnabled(self):
+		return self.getParameterNode().GetParameter(self.AUTO_SYNC_SCREWS) == "true"
+
+	def SetAutoScrewSyncEnabled(self, enable):
+		"""
+		Enable or disable the automatic screw sync: LoadScrewModelsFromFile runs by itself when a screw transform is added, when the metadata of a screw
+		transform changes or when NumOfScrews of Image_T changes. A burst of changes triggers a single sync, once no change arrived for ScrewSyncDelay ms.
+		Screw transforms that only move do not trigger a sync, since the screw models follow them.
+		"""
+		self.getParameterNode().SetParameter(self.AUTO_SYNC_SCREWS, "true" if enable else "false")
+		self.StopScrewSyncObservations()
+		if not enable:
+			return
+		self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedForScrewSync)
+		imageNode = slicer.mrmlScene.GetFirstNodeByName(self.IMAGE_TRANSFORM)
+		for transformNode in ([imageNode] if imageNode is not None else []) + list(self.screwRegistry.transforms().values()):
+			self.ObserveScrewSyncSource(transformNode)
+		self.RequestScrewSync()
+
+	def StopScrewSyncObservations(self):
+		self.screwSyncTimer.stop()
+		self.screwSyncRequestTime = None
+		self.removeObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedForScrewSync)
+		for node in list(self.screwSyncObservedNodes):
+			self.StopObservingScrewSyncSource(node)
+
+	def ObserveScrewSyncSource(self, transformNode):
+		"""
+		Observe Image_T (NumOfScrews attribute) or a Screw-N_T transform (metadata) for the automatic screw sync.
+		"""
+		if transformNode.GetName() != self.IMAGE_TRANSFORM and screws.parseScrewNumber(transformNode.GetName()) is None:
+			return
+		if transformNode in self.screwSyncObservedNodes:
+			return
+		self.addObserver(transformNode, vtk.vtkCommand.ModifiedEvent, self.onScrewSyncSourceModified) # attributes
+		self.addObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onScrewSyncSourceModified)
+		self.screwSyncObservedNodes.append(transformNode)
+
+	def StopObservingScrewSyncSource(self, transformNode):
+		"""
+		Stop observing a transform observed for the automatic screw sync, e.g. when it is removed from the scene.
+		"""
+		if transformNode not in self.screwSyncObservedNodes:
+			return
+		self.removeObserver(transformNode, vtk.vtkCommand.ModifiedEvent, self.onScrewSyncSourceModified)
+		self.removeObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onScrewSyncSourceModified)
+		self.screwSyncObservedNodes.remove(transformNode)
+
+	@vtk.calldata_type(vtk.VTK_OBJECT)
+	def onNodeAddedForScrewSync(self, caller, event, node):
+		if isinstance(node, slicer.vtkMRMLLinearTransformNode):
+			self.ObserveScrewSyncSource(node)
+			if node in self.screwSyncObservedNodes:
+				self.RequestScrewSync()
+
+	def onScrewSyncSourceModified(self, caller, event):
+		if self.IsScrewSyncNeeded(caller):
+			self.RequestScrewSync()
+
+	def IsScrewSyncNeeded(self, transformNode):
+		"""
+		Return True if Image_T or a screw transform describes screws different from the last sync. This only reads attributes, so it can run for every message.
+		"""
+		if transformNode.GetName() == self.IMAGE_TRANSFORM:
+			numberOfScrews = transformNode.GetAttribute("OpenIGTLink.NumOfScrews")
+			return numberOfScrews is not None and int(numberOfScrews) != self.syncedNumberOfScrews
+		metadata = {key: transformNode.GetAttribute("OpenIGTLink." + key) for key in ("ModelNumber", "ModelName", "ModelColor")}
+		if None in metadata.values():
+			return False
+		screwSpec = screws.screwSpecFromMetadata(metadata)
+		if self.syncedNumberOfScrews is not None and screwSpec.number > self.syncedNumberOfScrews:
+			return transformNode.GetScene() is not None # its transform will be removed by the next sync
+		return self.syncedScrews.get(screwSpec.number) != screwSpec
+
+	def RequestScrewSync(self):
+		"""
+		Schedule an automatic screw sync after the debounce delay. Each request postpones it, up to SCREW_SYNC_MAX_DELAY_MS after the first request.
+		"""
+		now = time.monotonic()
+		if self.screwSyncRequestTime is None:
+			self.screwSyncRequestTime = now
+		elif (now - self.screwSyncRequestTime) * 1000 >= self.SCREW_SYNC_MAX_DELAY_MS:
+			return # keep the scheduled sync
+		self.screwSyncTimer.start(int(self.getParameterNode().GetParameter(self.SCREW_SYNC_DELAY_MS)))
+
+	def onScrewSyncTimerTimeout(self):
+		self.screwSyncRequestTime = None
+		imageNode = slicer.mrmlScene.GetFirstNodeByName(self.IMAGE_TRANSFORM)
+		if imageNode is None or imageNode.GetAttribute("OpenIGTLink.NumOfScrews") is None:
+			return # nothing received from HoloLens yet
+		try:
+			self.LoadScrewModelsFromFile()
+		except Exception as error:
+			logging.error("Automatic screw sync failed: {0}".format(error))
+
+	def LoadScrewModelFromSpec(self, screwPath, screwSpec):
+		"""
+		Load the model of a screw from the screw folder, name it Screw-N, color it and remember its model file and color in its attributes.
+		"""
+		screwNode = self.addModelFromFile(os.path.join(screwPath, screwSpec.modelName))
+		screwNode.SetName(screws.screwModelName(screwSpec.number)) # Rename the model with the format Screw-1, Screw-2, etc.
+		screwNode.GetModelDisplayNode().SetColor(screwSpec.color)
+		screwNode.GetModelDisplayNode().SetVisibility(True)
+		screwNode.SetAttribute(self.SCREW_MODEL_NAME_ATTRIBUTE, screwSpec.modelName)
+		screwNode.SetAttribute(self.SCREW_MODEL_COLOR_ATTRIBUTE, screws.formatColor(screwSpec.color))
+		self.screwRegistry.addNode(screwNode) # renamed after it was added to the scene
+		self.journalScrew(screwSpec.number)
+		return screwNode
 
-				else:
-					screwName = tNode.GetAttribute("OriginalNodeName").split("_")[0]
-					fileName = tNode.GetAttribute("OpenIGTLink.ModelName") # Get the model name
-					modelColor = tNode.GetAttribute("OpenIGTLink.ModelColor") # Get the model color from the metadata of the transform message
-					colorArray = np.asarray(modelColor.split(","), dtype=float) # Parse the color numbers as floats
-					newScrew = self.LoadModelFromFile(screwPath, fileName, colorArray, True) # Load the corresponding model from file and assign to it its corresponding color
-					newScrew.SetName(screwName) # Rename the model with the format Screw-1, Screw-2, etc.
-					self.ApplyTransformToObject(newScrew, transformName) # Apply the transform to the model
-					self.ApplyTransformToObject(tNode, "Spine_T") 
-			
 	def GetOrCreateTransform(self, transformName):
 		"""
 		Gets existing tranform or create new transform containing the identity matrix.
@@ -827,8 +1693,19 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 				parameterNode = self.getParameterNode()
 				# Get the CT_RESLICE node from parameter node
 				outputNode = parameterNode.GetNodeReference(self.CT_RESLICE_OUTPUT)
-				# Add the node to the connector
-				cnode.RegisterOutgoingMRMLNode(outputNode)
+				transport = self.GetImageTransport()
+				if transport == "raw":
+					# Add the node to the connector
+					cnode.RegisterOutgoingMRMLNode(outputNode)
+				else:
+					# Send the encoded frames instead of the raw image
+					self.frameEncoder = imagecodec.FrameEncoder(transport, int(parameterNode.GetParameter(self.IMAGE_COMPRESSION_LEVEL)),
+						int(parameterNode.GetParameter(self.IMAGE_KEY_FRAME_INTERVAL)))
+					cnode.RegisterOutgoingMRMLNode(self.GetOrCreateCompressedResliceNode())
+					if self.HasResliceOutput():
+						self.frameDeduplicator.reset() # encode the current frame even if it was already published
+						self.PublishResliceOutput(outputNode)
+					# else the first frame is encoded when CreateSlide reslices the volume
 
 		
 		else:
@@ -843,12 +1720,26 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		"""    
 		cnode = slicer.util.getNode('IGTLConnector')
 		cnode.Stop()     
+		resliceStatistics = self.GetResliceSchedulerStatistics()
+		if resliceStatistics is not None:
+			logging.info("Reslice updates: {requestCount} requested, {runCount} run, {coalescedCount} coalesced, {droppedCount} dropped".format(**resliceStatistics))
+		deduplicationStatistics = self.GetFrameDeduplicationStatistics()
+		logging.info("CT_reslice frames: {checkedCount} checked, {suppressedCount} identical frames suppressed, {publishedCount} published".format(**deduplicationStatistics))
+		transportStatistics = self.GetImageTransportStatistics()
+		if transportStatistics is not None:
+			logging.info("Image transport ({mode}): {frameCount} frames, {rawBytes} -> {encodedBytes} bytes (ratio {compressionRatio:.2f}), {meanEncodeTime:.6f} s/frame".format(**transportStatistics))
+			cnode.UnregisterOutgoingMRMLNode(self.GetOrCreateCompressedResliceNode())
+			self.frameEncoder = None
 	
-	def SaveData(self):
+	def SaveData(self, progressCallback=None):
 		"""
-		Save the data in the scene.
+		Save the data in the scene. With SaveSceneInBackground, the .mrb is compressed in the background: progressCallback is called as in saveSceneInBackground.
+		Raise RuntimeError, before writing anything, if the scene must be saved while the previous scene is still being saved.
 		""" 
 		parameterNode = self.getParameterNode()
+		saveScene = parameterNode.GetParameter(self.SAVE_SCENE) != "false"
+		if saveScene and self.isSceneSaving():
+			raise RuntimeError("The previous scene is still being saved: {0}".format(self.sceneArchiveWriter.archivePath))
 
 		# Get the Save Directory from slicer settings
 		settings = slicer.app.userSettings()
@@ -874,10 +1765,19 @@ class AR_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 		# Generate file name
 		sceneName = "{}_{}_patient{}_user{}".format(currentDate, "Scene", patientID, userID)
 		sceneSaveFilename = os.path.join(save_folder_path, sceneName + ".mrb")
-		# Save scene
-		if slicer.util.saveScene(sceneSaveFilename):
-			logging.info("Scene saved to: {0}".format(sceneSaveFilename))
-		else:
-			logging.error("Scene saving failed")
+		self.setInteractiveLevelOfDetail(False) # models at full detail
+		# Save the plan (a few kilobytes), then the scene (the CT and every model)
+		referenceNodes = (parameterNode.GetNodeReference(self.INPUT_VOLUME), spineModel_node, spineT_node)
+		planJsonPath, _ = self.savePlan(sceneSaveFilename, referenceNodes, {"module": "AR_Planner", "patientID": patientID, "userID": userID, "date": currentDate,
+			"scene": os.path.basename(sceneSaveFilename) if saveScene else None})
+		logging.info("Plan saved to: {0}".format(planJsonPath))
+		logging.info("Planned screws ({0}):\n{1}".format(len(self.screwRegistry), self.screwRegistry.summary()))
+		if saveScene and parameterNode.GetParameter(self.SAVE_SCENE_IN_BACKGROUND) == "true":
+			self.saveSceneInBackground(sceneSaveFilename, progressCallback)
+		elif saveScene:
+			if slicer.util.saveScene(sceneSaveFilename):
+				logging.info("Scene saved to: {0}".format(sceneSaveFilename))
+			else:
+				logging.error("Scene saving failed")
 		
 		return save_folder_path
@@ -9,7 +9,17 @@ import vtk
 import slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
+import sys
 import time
+from pathlib import Path
+
+# The PedicleScrewPlannerLib package is shared with AR_Planner and lives in the repository root
+_repositoryDirectory = str(Path(__file__).resolve().parent.parent)
+if _repositoryDirectory not in sys.path:
+  sys.path.append(_repositoryDirectory)
+import PedicleScrewPlannerLib
+from PedicleScrewPlannerLib import pose, screws
+from PedicleScrewPlannerLib.plannerlogic import PlannerLogicMixin
 
 #
 # Desktop_Planner_Module
@@ -128,6 +138,9 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.ui.saveDirectoryButton.connect('directorySelected(QString)', self.onSaveDirectoryChanged)
     self.ui.userIDLineEdit.connect('textChanged(QString)', self.onUserIDChanged)
     self.ui.patientIDLineEdit.connect('textChanged(QString)', self.onPatientIDChanged)
+    self.ui.saveSceneCheckBox.connect('toggled(bool)', self.onSaveSceneToggled)
+    self.ui.saveSceneInBackgroundCheckBox.connect('toggled(bool)', self.onSaveSceneInBackgroundToggled)
+    self.ui.sceneCompressionLevelSpinBox.connect('valueChanged(int)', self.onSceneCompressionLevelChanged)
     self.ui.saveButton.connect('clicked(bool)', self.onSaveButton)
 
     # Make sure parameter node is initialized (needed for module reload)
@@ -135,6 +148,7 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.initializeGUI() # This is an addition to avoid initializing parameter node before connections
     self.updateWidgetsForCurrentVolume()
     self.onResetScrewButton()
+    self.offerPlanRecovery()
 
   def initializeGUI(self):
     # initailize the save directory using settings
@@ -173,6 +187,37 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     layoutManager = slicer.app.layoutManager()
     layoutManager.layoutLogic().GetLayoutNode().AddLayoutDescription(self.LAYOUT_DUAL3D, customLayout)
  
+  def offerPlanRecovery(self):
+    '''
+    If the last session did not end cleanly (e.g. 3D Slicer crashed), offers to restore its screws from the plan journal
+    '''
+    journalReplay = self.logic.findPlanToRecover()
+    if journalReplay is None:
+      return
+    if not slicer.util.confirmYesNoDisplay("The planning session started on {0} did not end cleanly.\nRestore its {1} screw(s)?".format(
+      journalReplay.header.get("startTime", "?"), len(journalReplay.screws))):
+      return
+    with slicer.util.tryWithErrorDisplay("Failed to restore the plan.", waitCursor=True):
+      self.logic.restorePlan(journalReplay, self.logic.restoreJournalScrew)
+      # New screws are numbered after the restored ones
+      self.screwNumber = max([self.screwNumber] + self.logic.screwRegistry.numbers())
+
+  def onReload(self):
+    """
+    Reload the PedicleScrewPlannerLib submodules, then this module (the base reload only executes this file again).
+    """
+    PedicleScrewPlannerLib.reloadSubmodules()
+    ScriptedLoadableModuleWidget.onReload(self)
+
+  def cleanup(self):
+    """
+    Called when the application closes and the module widget is destroyed.
+    """
+    self.removeObservers()
+    self.logic.waitForSceneSave()
+    self.logic.stopPlanJournal()
+    self.logic.removeObservers()
+
   def onSceneStartClose(self, caller, event):
     """
     Called just before the scene is closed.
@@ -248,6 +293,9 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     # update patient ID
     self.ui.patientIDLineEdit.text = self._parameterNode.GetParameter(self.logic.PATIENT_ID)
+    self.ui.saveSceneCheckBox.checked = self._parameterNode.GetParameter(self.logic.SAVE_SCENE) != "false"
+    self.ui.saveSceneInBackgroundCheckBox.checked = self._parameterNode.GetParameter(self.logic.SAVE_SCENE_IN_BACKGROUND) == "true"
+    self.ui.sceneCompressionLevelSpinBox.value = int(self._parameterNode.GetParameter(self.logic.SCENE_COMPRESSION_LEVEL))
 
     # All the GUI updates are done
     self._updatingGUIFromParameterNode = False
@@ -362,8 +410,9 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     '''
     # Get the path from the GUI
     path = self.ui.QRCodeModel_InputSelector.currentPath
-    # Load the volume
-    modelNode = slicer.util.loadModel(path)
+    # Load the model, shown with a coarse mesh while the 3D views are rotated and in the slice views
+    modelNode = self.logic.addModelFromFile(path)
+    self.logic.showModelWithLevelsOfDetail(modelNode, path)
     # Set the volume as the input volume
     self.ui.spineModelSelector.setCurrentNode(modelNode)
     # disable the button
@@ -391,7 +440,7 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.screwNumber = self.screwNumber + 1
     screwTransformName = "Screw-" + str(self.screwNumber) + "_T"
     screwNode = self.logic.LoadScrewModel(screwName, screwTransformName)
-    screwTransformNode = slicer.util.getFirstNodeByName(screwTransformName)
+    screwTransformNode = self.logic.screwRegistry.get(self.screwNumber).transform
     self.ui.screwTransformComboBox.setCurrentNode(screwTransformNode)
     # set the screw parameters as an attribute of the model
     screwNode.SetAttribute("ScrewNumber", screwName)
@@ -572,11 +621,45 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     # update the onPatientIDChanged ID in the parameter node
     self._parameterNode.SetParameter(self.logic.PATIENT_ID, patientID) 
 
+  def onSaveSceneToggled(self, saveScene):
+    '''
+    This method is called when the "Save full scene" checkbox is toggled
+    '''
+    self._parameterNode.SetParameter(self.logic.SAVE_SCENE, "true" if saveScene else "false")
+
+  def onSaveSceneInBackgroundToggled(self, inBackground):
+    '''
+    This method is called when the "In background" checkbox is toggled
+    '''
+    self._parameterNode.SetParameter(self.logic.SAVE_SCENE_IN_BACKGROUND, "true" if inBackground else "false")
+
+  def onSceneCompressionLevelChanged(self, compressionLevel):
+    '''
+    This method is called when the scene compression level is changed
+    '''
+    self._parameterNode.SetParameter(self.logic.SCENE_COMPRESSION_LEVEL, str(compressionLevel))
+
   def onSaveButton(self):
     '''
     This method is called "Save Results" button is clicked
     '''
-    self.logic.saveResults()
+    with slicer.util.tryWithErrorDisplay("Failed to save the results.", waitCursor=True):
+      self.logic.saveResults(self.onSceneSaveProgress)
+      if self.logic.isSceneSaving():
+        self.ui.FilesSavedText.setText("Plan saved, saving the scene...")
+      else:
+        self.ui.FilesSavedText.setText("All files have been saved in:\n" + slicer.app.userSettings().value(self.logic.RESULTS_SAVE_DIRECTORY_SETTING))
+
+  def onSceneSaveProgress(self, archiveWriter):
+    '''
+    Shows the progress of the scene saved in the background
+    '''
+    if not archiveWriter.finished:
+      self.ui.FilesSavedText.setText("Saving the scene ({0:.0f}%) in:\n{1}".format(100 * archiveWriter.progress, os.path.dirname(archiveWriter.archivePath)))
+    elif archiveWriter.error is not None:
+      self.ui.FilesSavedText.setText("Scene saving failed: {0}".format(archiveWriter.error))
+    else:
+      self.ui.FilesSavedText.setText("All files have been saved in:\n" + os.path.dirname(archiveWriter.archivePath))
 
   
 
@@ -585,7 +668,7 @@ class Desktop_PlannerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 # Desktop_PlannerLogic
 #
 
-class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
+class Desktop_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin, PlannerLogicMixin):
   CURRENT_INPUT_VOLUME = "CurrentInputVolume"
   MOTION_MARGIN = 100  # Allow screw to go outside image volume by this many mm
   STEP_SIZE_TRANSLATION = 1  # Translation single click in mm
@@ -613,8 +696,24 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     Called when the logic class is instantiated. Can be used for initializing member variables.
     """
     ScriptedLoadableModuleLogic.__init__(self)
+    VTKObservationMixin.__init__(self)
+    PlannerLogicMixin.__init__(self)
     self.SCREW_TRANSFORM = "screw_RAStoScrew"
     self.SCREW_TIP = "screwTip"
+    self.rotationTransformNode = None  # RotationT, which turns the screw models loaded from file to the screw axes
+
+  def restoreJournalScrew(self, journalScrew):
+    """
+    Load a screw of a plan journal (the same way as the "Load screw model" button) and move it to its last matrix.
+    Screws without a model file are not restored.
+    """
+    if not journalScrew.modelName:
+      return False
+    self.LoadScrewModel(os.path.splitext(journalScrew.modelName)[0], screws.screwTransformName(journalScrew.number))
+    transformNode = self.screwRegistry.get(journalScrew.number).transform
+    if journalScrew.matrix is not None:
+      slicer.util.updateTransformMatrixFromArray(transformNode, journalScrew.matrix)
+    return True
 
   def setDefaultParameters(self, parameterNode):
     """
@@ -635,6 +734,14 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     # Set Rotate S
     if not parameterNode.GetParameter(self.ROTATE_S):
       parameterNode.SetParameter(self.ROTATE_S, "0")
+    # Save the full scene next to the plan
+    if not parameterNode.GetParameter(self.SAVE_SCENE):
+      parameterNode.SetParameter(self.SAVE_SCENE, "true")
+    # Compress it in the background
+    if not parameterNode.GetParameter(self.SAVE_SCENE_IN_BACKGROUND):
+      parameterNode.SetParameter(self.SAVE_SCENE_IN_BACKGROUND, "true")
+    if not parameterNode.GetParameter(self.SCENE_COMPRESSION_LEVEL):
+      parameterNode.SetParameter(self.SCENE_COMPRESSION_LEVEL, "1")
     pass
 
   def setupScene(self):
@@ -652,6 +759,17 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     t90Node=slicer.vtkMRMLLinearTransformNode()
     t90Node.SetName("RotationT")
     slicer.mrmlScene.AddNode(t90Node)
+    self.rotationTransformNode = t90Node
+
+  def getRotationTransformNode(self):
+    """
+    RotationT transform created by setupScene, kept by the logic so that loading a screw does not search the scene by name.
+    """
+    if self.rotationTransformNode is None or self.rotationTransformNode.GetScene() is None:
+      self.rotationTransformNode = slicer.mrmlScene.GetFirstNodeByName("RotationT")  # e.g. the scene was closed or loaded
+      if self.rotationTransformNode is None:
+        self.rotationTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "RotationT")
+    return self.rotationTransformNode
 
   def updateTransformFromParameterNode(self):
     """
@@ -659,20 +777,17 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     """
     parameterNode = self.getParameterNode()  # Get the parameter node
 
-    # apply the translation and rotation in the world frame: TRANSLATE_R, TRANSLATE_S, ROTATE_R, ROTATE_S
+    # apply the translation and rotation in the world frame: TRANSLATE_R, TRANSLATE_S, ROTATE_R, ROTATE_S (see pose.poseMatrix)
 
-    screwToRasTransform = vtk.vtkTransform()
-    screwToRasTransform.Translate(float(parameterNode.GetParameter(self.TRANSLATE_R)),
-                                   float(parameterNode.GetParameter(self.TRANSLATE_A)),
-                                   float(parameterNode.GetParameter(self.TRANSLATE_S)))
-    screwToRasTransform.RotateX(float(parameterNode.GetParameter(self.ROTATE_R)) )  # Start at anterior direction
-    screwToRasTransform.RotateY(float(parameterNode.GetParameter(self.ROTATE_S)))
+    screwToRasMatrix = pose.poseMatrix(self.getTranslationParameters(),
+                                       float(parameterNode.GetParameter(self.ROTATE_R)),  # Start at anterior direction
+                                       float(parameterNode.GetParameter(self.ROTATE_S)))
 
     # Set the transform to the transform node
 
     screwToRasTransformNode = parameterNode.GetNodeReference(self.SCREW_TO_RAS_TRANSFORM)
     if screwToRasTransformNode is not None:
-      screwToRasTransformNode.SetAndObserveTransformToParent(screwToRasTransform)
+      slicer.util.updateTransformMatrixFromArray(screwToRasTransformNode, np.array(screwToRasMatrix))
     else:
       logging.warning("Screw transform not selected yet")
 
@@ -687,19 +802,20 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     if screwToRasTransformNode is None:
       return
 
-    screwToRasTransform = screwToRasTransformNode.GetTransformToParent()
+    # Inverse of the pose model of updateTransformFromParameterNode()
+    screwToRasTranslation, rotationR, rotationS = pose.poseFromMatrix(slicer.util.arrayFromTransformMatrix(screwToRasTransformNode))
+    self.setTranslationParameters(screwToRasTranslation)
+    parameterNode.SetParameter(self.ROTATE_R, str(rotationR))
+    parameterNode.SetParameter(self.ROTATE_S, str(rotationS))
 
-    screwToRasTranslation = np.array(screwToRasTransform.GetPosition())
-    parameterNode.SetParameter(self.TRANSLATE_R, str(screwToRasTranslation[0]))
-    parameterNode.SetParameter(self.TRANSLATE_A, str(screwToRasTranslation[1]))
-    parameterNode.SetParameter(self.TRANSLATE_S, str(screwToRasTranslation[2]))
-
-    #todo: This does not correctly preserve orientation. We need to figure out how to get rotation values to be compatible
-    # with updateTransformFromParameterNode()
+  def getTranslationParameters(self):
+    parameterNode = self.getParameterNode()
+    return [float(parameterNode.GetParameter(name)) for name in (self.TRANSLATE_R, self.TRANSLATE_A, self.TRANSLATE_S)]
 
-    screwToRasOrientation = np.array(screwToRasTransform.GetOrientation())
-    parameterNode.SetParameter(self.ROTATE_R, str(screwToRasOrientation[0] + 90))
-    parameterNode.SetParameter(self.ROTATE_S, str(screwToRasOrientation[1]))
+  def setTranslationParameters(self, translation):
+    parameterNode = self.getParameterNode()
+    for name, value in zip((self.TRANSLATE_R, self.TRANSLATE_A, self.TRANSLATE_S), translation):
+      parameterNode.SetParameter(name, str(value))
 
   def moveScrewIn(self, distance):
     """
@@ -709,27 +825,24 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     parameterNode = self.getParameterNode()
     # Get the transform node from the parameter node
     screwToRasTransformNode = parameterNode.GetNodeReference(self.SCREW_TO_RAS_TRANSFORM)
-    # Get the transform from the transform node
-    screwToRasTransform = screwToRasTransformNode.GetTransformToParent()
-    # Find distance in terms of R and S
-    Translation_Screw = [0, 0, distance]
-    # Rotate Translation_Screw to the parent frame
-    Translation_RAS = screwToRasTransform.TransformVector(Translation_Screw)
-    # Add Translation_RAS to the current translation
-    parameterNode.SetParameter(self.TRANSLATE_R, str(float(parameterNode.GetParameter(self.TRANSLATE_R)) + Translation_RAS[0]))
-    parameterNode.SetParameter(self.TRANSLATE_A, str(float(parameterNode.GetParameter(self.TRANSLATE_A)) + Translation_RAS[1]))
-    parameterNode.SetParameter(self.TRANSLATE_S, str(float(parameterNode.GetParameter(self.TRANSLATE_S)) + Translation_RAS[2]))
+    # Add the distance along the screw axis, rotated to the parent frame, to the current translation
+    self.setTranslationParameters(pose.moveAlongAxis(self.getTranslationParameters(),
+      slicer.util.arrayFromTransformMatrix(screwToRasTransformNode), distance))
     # Update transform from Parameter Node
     self.updateTransformFromParameterNode()
 
-  def saveResults(self):
+  def saveResults(self, progressCallback=None):
     ''' 
     Save the results to a file:
-    - The scene as a .mrb file
-
+    - The plan as .plan.json and .plan.npz files
+    - The scene as a .mrb file (compressed in the background with SaveSceneInBackground: progressCallback is called as in saveSceneInBackground)
+    Raise RuntimeError, before writing anything, if the scene must be saved while the previous scene is still being saved.
     '''
     # Get the parameter node
     parameterNode = self.getParameterNode()
+    saveScene = parameterNode.GetParameter(self.SAVE_SCENE) != "false"
+    if saveScene and self.isSceneSaving():
+      raise RuntimeError("The previous scene is still being saved: {0}".format(self.sceneArchiveWriter.archivePath))
 
     # FILENAME FORMAT = [Date]_ScrewPlanner_[userID]_[patientID].mrb
     # Get the date in format MMMDD
@@ -752,30 +865,45 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     # # Save the ScrewToRasTransform to saveDirectory with fileName
     # slicer.util.saveNode(screwToRasTransformNode, os.path.join(saveDirectory, fileName))
 
-    # Save the current scene to saveDirectory with fileName
-    slicer.util.saveScene(os.path.join(saveDirectory, fileName))
+    # Save the plan (a few kilobytes) next to the scene file, then the current scene (the CT and every model) to saveDirectory with fileName
+    self.setInteractiveLevelOfDetail(False)  # models at full detail
+    referenceNodes = (parameterNode.GetNodeReference(self.CURRENT_INPUT_VOLUME), parameterNode.GetNodeReference(self.SPINE_MODEL),
+      slicer.mrmlScene.GetFirstNodeByName("Spine_T"))
+    planJsonPath, _ = self.savePlan(os.path.join(saveDirectory, fileName), referenceNodes, {"module": "Desktop_Planner", "patientID": patientID, "userID": userID,
+      "date": date, "scene": fileName if saveScene else None})
+    logging.info("Plan saved to: {0}".format(planJsonPath))
+    logging.info("Planned screws ({0}):\n{1}".format(len(self.screwRegistry), self.screwRegistry.summary()))
+    if saveScene and parameterNode.GetParameter(self.SAVE_SCENE_IN_BACKGROUND) == "true":
+      self.saveSceneInBackground(os.path.join(saveDirectory, fileName), progressCallback)
+    elif saveScene:
+      slicer.util.saveScene(os.path.join(saveDirectory, fileName))
 
   def LoadScrewModel(self, screwFileNameWOExt, transformName):
     """
     Load the screw "screwFileNameWOExt" model from the specified directory and apply the transform "transformName" to it
     """
-    t90Node = slicer.util.getFirstNodeByName("RotationT")
-    t90NodeName = t90Node.GetName()
+    t90Node = self.getRotationTransformNode()
 
     screwName = transformName.split("_")[0]
-    previousScrew = slicer.util.getFirstNodeByName(screwName)
-    if (previousScrew is not None):
-      slicer.mrmlScene.RemoveNode(previousScrew)
+    screwNumber = screws.parseScrewNumber(transformName)
+    previousScrew = self.screwRegistry.get(screwNumber)
+    if (previousScrew is not None and previousScrew.model is not None):
+      slicer.mrmlScene.RemoveNode(previousScrew.model)
     screwFileName = screwFileNameWOExt + ".obj"
-    screwNode = self.LoadModelFromFile(screwFileName, [0,0.7251529,0.945098], True)
+    screwColor = [0,0.7251529,0.945098]
+    screwNode = self.LoadModelFromFile(screwFileName, screwColor, True)
     rotationT = vtk.vtkTransform()
     rotationT.RotateX(-90)
     rotationT.RotateZ(180)
     t90Node.SetAndObserveTransformToParent(rotationT) 
-    self.ApplyTransformToObject(screwNode, t90NodeName)
+    screwNode.SetAndObserveTransformNodeID(t90Node.GetID())
     screwNode.HardenTransform()
-    self.ApplyTransformToObject(screwNode, transformName)
+    screwNode.SetAndObserveTransformNodeID(self.getOrCreateScrewTransform(screwNumber).GetID())
     screwNode.SetName(screwName)
+    screwNode.SetAttribute(screws.MODEL_NAME_ATTRIBUTE, screwFileName)
+    screwNode.SetAttribute(screws.MODEL_COLOR_ATTRIBUTE, screws.formatColor(screwColor))
+    self.screwRegistry.addNode(screwNode)  # renamed after it was added to the scene
+    self.journalScrew(screwNumber)
     # set model slice visibility on
     screwNode.GetModelDisplayNode().SetSliceIntersectionVisibility(True)
     return screwNode
@@ -790,7 +918,7 @@ class Desktop_PlannerLogic(ScriptedLoadableModuleLogic):
     try:
       node = slicer.util.getNode(modelFileName)
     except:
-        node = slicer.util.loadModel(os.path.join(modelFilePath, modelFileName))
+        node = self.addModelFromFile(os.path.join(modelFilePath, modelFileName))
         node.GetModelDisplayNode().SetColor(colorRGB_array)
         node.GetModelDisplayNode().SetVisibility(visibility_bool)
         #print (modelFileName + ' model loaded')
@@ -0,0 +1,43 @@
+"""
+Helpers shared by the AR_Planner and Desktop_Planner modules.
+Everything in this package only depends on the Python standard library and NumPy,
+so it can be used (and timed) outside of 3D Slicer, except plannerlogic: the Slicer-side
+logic shared by both modules, which is only imported by them.
+
+Submodules are imported on first use, so importing the package is immediate and NumPy is
+only loaded by the submodules that need it (pose and screws only use the standard library;
+windowing and reslice import NumPy when their functions are first called).
+
+The Reload button of a Slicer module only executes the module file again: the modules call
+reloadSubmodules first, so that edits to this package are picked up too.
+"""
+import importlib
+import sys
+
+__all__ = [
+  "benchmarking", "decimation", "framehash", "imagecodec", "intensitystatistics", "latency", "meshcache", "objfile",
+  "openigtlink", "phantoms", "planexport", "planjournal", "plannerlogic", "pose", "pyramid", "reslice", "reslicequality",
+  "scenearchive", "scheduling", "screws", "sessionlog", "windowing", "workers",
+]
+
+
+def __getattr__(name):
+  if name in __all__:
+    return importlib.import_module("." + name, __name__)  # also sets it as an attribute of the package
+  raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def reloadSubmodules():
+  """
+  Reload the submodules imported so far and return their names. The submodules that other submodules import
+  (objfile, screws, windowing) are reloaded first, and plannerlogic, which imports most of them, last.
+  """
+  reloadOrder = sorted(__all__, key=lambda name: (name == "plannerlogic", name not in ("objfile", "screws", "windowing")))
+  reloadedNames = [name for name in reloadOrder if "{0}.{1}".format(__name__, name) in sys.modules]
+  for name in reloadedNames:
+    importlib.reload(sys.modules["{0}.{1}".format(__name__, name)])
+  return reloadedNames
+
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,84 @@
+"""
+Timing of the hot paths and machine-readable (JSON) benchmark reports.
+"""
+import json
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+REPORT_FORMAT_VERSION = 1
+
+
+def timeCall(function, repeats=5, warmup=1, setup=None, clock=time.perf_counter):
+  """
+  Call function() warmup + repeats times and return the statistics of the timed (non-warmup) calls, in seconds.
+  setup(), if given, is called (untimed) before every call, e.g. to restore data modified in place.
+  """
+  durations = []
+  for index in range(warmup + repeats):
+    if setup is not None:
+      setup()
+    startTime = clock()
+    function()
+    duration = clock() - startTime
+    if index >= warmup:
+      durations.append(duration)
+  return {
+    "repeats": len(durations),
+    "min": min(durations),
+    "median": statistics.median(durations),
+    "mean": statistics.fmean(durations),
+    "max": max(durations),
+  }
+
+
+def formatResult(name, result):
+  """
+  One line summary of a timeCall result, e.g. for a console.
+  """
+  return "{0:<40} median {1:10.6f} s  (min {2:.6f} s, {3} runs)".format(name, result["median"], result["min"], result["repeats"])
+
+
+class BenchmarkReport:
+  """
+  Collects benchmark results with the parameters and environment of the run, and writes them as JSON.
+  resultCallback(name, result), if given, is called after each run (e.g. to show the progress).
+  """
+
+  def __init__(self, parameters=None, resultCallback=None):
+    self.parameters = dict(parameters or {})
+    self.resultCallback = resultCallback
+    self.environment = {
+      "python": sys.version.split()[0],
+      "numpy": np.__version__,
+      "platform": platform.platform(),
+      "processor": platform.processor() or platform.machine(),
+    }
+    self.results = {}
+
+  def run(self, name, function, repeats=5, warmup=1, setup=None, **details):
+    """
+    Time function and record the result under name. Extra keyword arguments are stored with the result.
+    """
+    result = timeCall(function, repeats, warmup, setup)
+    result.update(details)
+    self.results[name] = result
+    if self.resultCallback is not None:
+      self.resultCallback(name, result)
+    return result
+
+  def toDict(self):
+    return {
+      "formatVersion": REPORT_FORMAT_VERSION,
+      "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+      "environment": self.environment,
+      "parameters": self.parameters,
+      "results": self.results,
+    }
+
+  def write(self, path):
+    with open(path, "w") as reportFile:
+      json.dump(self.toDict(), reportFile, indent=2)
@@ -0,0 +1,111 @@
+"""
+Level-of-detail (LOD) chains of triangle meshes, to render large models (e.g. a whole-spine model of 500k+ triangles)
+with a coarse mesh while the camera moves and in the slice intersections, and at full detail once the view is idle.
+
+Meshes are simplified by vertex clustering: the vertices are snapped to a regular grid, the vertices of each grid cell
+are merged into their mean, and the triangles that collapse are dropped. It is a single vectorized pass over the mesh,
+so the LOD chain of a large model is built in about a second, once per model file. The grid cell size is searched for each level to
+reach the requested fraction of the triangles.
+"""
+import numpy as np
+
+LEVEL_RATIOS = (1.0, 0.25, 0.05)  # Fraction of the triangles of the full mesh kept by each level
+INTERACTIVE_TRIANGLE_BUDGET = 150000  # Triangles of a model rendered while the camera moves
+INTERSECTION_TRIANGLE_BUDGET = 30000  # Triangles of a model cut by the slice views
+
+
+def _combineColumns(rows):
+  """
+  One int64 key per row of a (N, 3) array of non-negative integers (rows are equal if their keys are), which is much
+  faster to sort than the rows themselves. Falls back to the rows if the keys could overflow.
+  """
+  sizes = rows.max(axis=0) + 1 if len(rows) else np.ones(3, np.int64)
+  if np.prod(sizes.astype(np.float64)) >= 2.0**62:
+    return np.unique(rows, axis=0, return_inverse=True)[1].ravel()
+  return (rows[:, 0] * sizes[1] + rows[:, 1]) * sizes[2] + rows[:, 2]
+
+
+def clusterVertices(vertices, faces, cellSize):
+  """
+  Simplify a mesh by merging the vertices that fall in the same cell of a grid of cellSize millimeters.
+  Return the (vertices, faces) of the simplified mesh, without collapsed or duplicated triangles.
+  The mesh is returned unchanged if cellSize is not a positive number.
+  """
+  vertices = np.asarray(vertices, dtype=np.float64)
+  faces = np.asarray(faces, dtype=np.int64)
+  if not len(faces) or not np.isfinite(cellSize) or cellSize <= 0:
+    return vertices.astype(np.float32), faces.astype(np.int32)
+  cells = np.floor((vertices - vertices.min(axis=0)) / cellSize).astype(np.int64)
+  _, clusterOfVertex, clusterSizes = np.unique(_combineColumns(cells), return_inverse=True, return_counts=True)
+  clusterOfVertex = clusterOfVertex.ravel()
+  clusteredVertices = np.stack([np.bincount(clusterOfVertex, weights=vertices[:, axis], minlength=len(clusterSizes))
+    for axis in range(3)], axis=1) / clusterSizes[:, np.newaxis]
+
+  clusteredFaces = clusterOfVertex[faces]
+  isKept = ((clusteredFaces[:, 0] != clusteredFaces[:, 1]) & (clusteredFaces[:, 1] != clusteredFaces[:, 2])
+    & (clusteredFaces[:, 2] != clusteredFaces[:, 0]))
+  clusteredFaces = clusteredFaces[isKept]
+  # Triangles of the same three clusters (whatever their orientation) are drawn once
+  _, firstFaces = np.unique(_combineColumns(np.sort(clusteredFaces, axis=1)), return_index=True)
+  clusteredFaces = clusteredFaces[np.sort(firstFaces)]
+
+  usedClusters, compactFaces = np.unique(clusteredFaces, return_inverse=True)
+  return clusteredVertices[usedClusters].astype(np.float32), compactFaces.reshape(-1, 3).astype(np.int32)
+
+
+def meanEdgeLength(vertices, faces):
+  vertices = np.asarray(vertices, dtype=np.float64)
+  faces = np.asarray(faces)
+  if not len(faces):
+    return 0.0
+  return float(np.mean(np.linalg.norm(vertices[faces] - vertices[np.roll(faces, 1, axis=1)], axis=2)))
+
+
+def decimate(vertices, faces, ratio, tolerance=0.2, maxIterations=8):
+  """
+  Simplify a mesh to about ratio times its number of triangles (within tolerance, relative).
+  The grid cell size starts at the mean edge length scaled for the ratio (the triangle count of a surface decreases with
+  the square of the cell size), then it is corrected from the triangle count obtained. A degenerate mesh (e.g. all the
+  vertices at the same point, so a mean edge length of 0) is returned unchanged.
+  """
+  vertices = np.asarray(vertices)
+  faces = np.asarray(faces)
+  if ratio >= 1.0 or not len(faces):
+    return vertices.astype(np.float32), faces.astype(np.int32)
+  targetCount = max(ratio * len(faces), 1.0)
+  cellSize = meanEdgeLength(vertices, faces) / np.sqrt(ratio)
+  if not np.isfinite(cellSize) or cellSize <= 0:
+    return vertices.astype(np.float32), faces.astype(np.int32)
+  best = None
+  for _ in range(maxIterations):
+    decimated = clusterVertices(vertices, faces, cellSize)
+    faceCount = max(len(decimated[1]), 1)
+    if best is None or abs(faceCount - targetCount) < abs(len(best[1]) - targetCount):
+      best = decimated
+    if abs(faceCount - targetCount) <= tolerance * targetCount:
+      break
+    cellSize *= np.clip(np.sqrt(faceCount / targetCount), 0.5, 2.0)
+  return best
+
+
+def levelsOfDetail(vertices, faces, ratios=LEVEL_RATIOS):
+  """
+  Return the (vertices, faces) of each level, from the full mesh to the coarsest one. Each level is decimated from the
+  previous one, which is faster than decimating the full mesh each time.
+  """
+  levels = []
+  for ratio in ratios:
+    previousVertices, previousFaces = levels[-1] if levels else (vertices, faces)
+    previousRatio = ratios[len(levels) - 1] if levels else 1.0
+    levels.append(decimate(previousVertices, previousFaces, ratio / previousRatio))
+  return levels
+
+
+def chooseLevel(triangleCounts, triangleBudget):
+  """
+  Index of the most detailed level within the triangle budget, or of the coarsest level if none is.
+  """
+  for level, triangleCount in enumerate(triangleCounts):
+    if triangleCount <= triangleBudget:
+      return level
+  return len(triangleCounts) - 1
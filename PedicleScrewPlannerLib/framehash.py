@@ -0,0 +1,61 @@
+"""
+Cheap fingerprints of output frames, to avoid publishing (and sending over the network) a frame
+identical to the previous one, e.g. while the image plane is still or moves by less than a voxel.
+"""
+import hashlib
+
+import numpy as np
+
+
+def frameDigest(frame):
+  """
+  64-bit BLAKE2b digest of the pixels, shape and scalar type of a frame.
+  """
+  frame = np.ascontiguousarray(frame)
+  digest = hashlib.blake2b(digest_size=8)
+  digest.update(str((frame.shape, frame.dtype.str)).encode("ascii"))
+  digest.update(frame.view(np.uint8).reshape(-1))
+  return digest.digest()
+
+
+class FrameDeduplicator:
+  """
+  Remembers the digest of the last published frame and tells whether a new frame is identical to it.
+
+  Counters: checkedCount (frames checked), suppressedCount (identical frames) and publishedCount.
+  """
+
+  def __init__(self):
+    self._lastDigest = None
+    self.resetStatistics()
+
+  def resetStatistics(self):
+    self.checkedCount = 0
+    self.suppressedCount = 0
+    self.publishedCount = 0
+
+  def reset(self):
+    """
+    Forget the last frame, so that the next frame is published whatever its content.
+    """
+    self._lastDigest = None
+
+  def isDuplicate(self, frame):
+    """
+    Return True if frame is identical to the last published frame. Otherwise remember it as the last published frame.
+    """
+    self.checkedCount += 1
+    digest = frameDigest(frame)
+    if digest == self._lastDigest:
+      self.suppressedCount += 1
+      return True
+    self._lastDigest = digest
+    self.publishedCount += 1
+    return False
+
+  def statistics(self):
+    return {
+      "checkedCount": self.checkedCount,
+      "suppressedCount": self.suppressedCount,
+      "publishedCount": self.publishedCount,
+    }
@@ -0,0 +1,220 @@
+"""
+Lossless compression of the CT_reslice frames streamed to HoloLens.
+
+Each frame is encoded into a self-describing packet: a fixed header (see PACKET_HEADER) followed by
+the compressed pixels. In delta modes the pixels are first replaced by their byte-wise difference
+(modulo 256) with the previous frame, which is mostly zeros while the image plane moves slowly.
+A key frame (no delta) is sent regularly so that a receiver can start decoding, or recover, at any time.
+
+Packet header (little endian):
+  magic (4 bytes), format version (uint8), codec (uint8), flags (uint8), reserved (uint8),
+  dtype (4 ASCII bytes, numpy dtype.str), rows (uint32), columns (uint32),
+  sequence (uint32), reference sequence (uint32), raw length (uint32), CRC-32 of the raw pixels (uint32),
+  compressed length (uint32)
+
+To travel in an OpenIGTLink IMAGE message (whose sizes are 16-bit), a packet is laid out as a 2D image of
+PACKET_IMAGE_COLUMNS bytes per row (packetToImage), padded with zeros after the compressed data.
+"""
+import struct
+import time
+import zlib
+
+import numpy as np
+
+try:
+  import lz4.frame as lz4frame
+except ImportError:
+  lz4frame = None
+
+PACKET_MAGIC = b"CTRF"
+PACKET_VERSION = 1
+PACKET_HEADER = struct.Struct("<4sBBBx4sIIIIIII")
+PACKET_IMAGE_COLUMNS = 1024
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+
+FLAG_DELTA = 1
+
+# Transport mode name: (codec, delta)
+TRANSPORT_MODES = {
+  "raw": (CODEC_RAW, False),
+  "zlib": (CODEC_ZLIB, False),
+  "delta-zlib": (CODEC_ZLIB, True),
+}
+if lz4frame is not None:
+  TRANSPORT_MODES["lz4"] = (CODEC_LZ4, False)
+  TRANSPORT_MODES["delta-lz4"] = (CODEC_LZ4, True)
+
+
+def _compress(codec, data, compressionLevel):
+  if codec == CODEC_ZLIB:
+    return zlib.compress(data, compressionLevel)
+  if codec == CODEC_LZ4:
+    return lz4frame.compress(data, compression_level=compressionLevel)
+  return bytes(data)
+
+
+def _decompress(codec, data):
+  if codec == CODEC_ZLIB:
+    return zlib.decompress(data)
+  if codec == CODEC_LZ4:
+    if lz4frame is None:
+      raise ValueError("Packet compressed with LZ4, but the lz4 package is not installed")
+    return lz4frame.decompress(data)
+  if codec == CODEC_RAW:
+    return bytes(data)
+  raise ValueError("Unknown codec: {0}".format(codec))
+
+
+def packetToImage(packet, columns=PACKET_IMAGE_COLUMNS):
+  """
+  Lay out a packet as a (rows, columns) uint8 array, padded with zeros. A single row is used for short packets.
+  """
+  columns = min(columns, len(packet))
+  rows = -(-len(packet) // columns)
+  image = np.zeros(rows * columns, dtype=np.uint8)
+  image[:len(packet)] = np.frombuffer(packet, dtype=np.uint8)
+  return image.reshape(rows, columns)
+
+
+class FrameEncoder:
+  """
+  Encodes successive 2D frames into packets and keeps per-frame and cumulative statistics.
+  """
+
+  def __init__(self, mode="zlib", compressionLevel=1, keyFrameInterval=30, clock=time.perf_counter):
+    if mode not in TRANSPORT_MODES:
+      raise ValueError("Unknown or unavailable transport mode: {0}".format(mode))
+    self.mode = mode
+    self.codec, self.delta = TRANSPORT_MODES[mode]
+    self.compressionLevel = compressionLevel
+    self.keyFrameInterval = max(1, int(keyFrameInterval))
+    self.clock = clock
+    self.sequence = 0
+    self._previousFrame = None
+    self._framesSinceKeyFrame = 0
+    self.lastFrameStatistics = None
+    self.resetStatistics()
+
+  def resetStatistics(self):
+    self.frameCount = 0
+    self.totalRawBytes = 0
+    self.totalEncodedBytes = 0
+    self.totalEncodeTime = 0.0
+
+  def requestKeyFrame(self):
+    """
+    Make the next frame a key frame (e.g. when a receiver connects).
+    """
+    self._previousFrame = None
+
+  def encode(self, frame):
+    """
+    Encode a 2D array into a packet (bytes).
+    """
+    startTime = self.clock()
+    frame = np.ascontiguousarray(frame)
+    if frame.ndim != 2:
+      raise ValueError("Only 2D frames can be encoded, got shape {0}".format(frame.shape))
+    rawBytes = frame.view(np.uint8).reshape(-1)
+    keyFrame = (not self.delta or self._previousFrame is None or self._previousFrame.shape != frame.shape
+      or self._previousFrame.dtype != frame.dtype or self._framesSinceKeyFrame >= self.keyFrameInterval)
+
+    self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+    referenceSequence = 0
+    flags = 0
+    if keyFrame:
+      payload = rawBytes
+      self._framesSinceKeyFrame = 0
+    else:
+      payload = np.subtract(rawBytes, self._previousFrame.view(np.uint8).reshape(-1), dtype=np.uint8)
+      referenceSequence = (self.sequence - 1) & 0xFFFFFFFF
+      flags |= FLAG_DELTA
+      self._framesSinceKeyFrame += 1
+    if self.delta:
+      self._previousFrame = frame.copy()
+
+    compressed = _compress(self.codec, payload, self.compressionLevel)
+    header = PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, self.codec, flags, frame.dtype.str.encode("ascii").ljust(4),
+      frame.shape[0], frame.shape[1], self.sequence, referenceSequence, rawBytes.nbytes, zlib.crc32(rawBytes), len(compressed))
+    packet = header + compressed
+
+    encodeTime = self.clock() - startTime
+    self.frameCount += 1
+    self.totalRawBytes += rawBytes.nbytes
+    self.totalEncodedBytes += len(packet)
+    self.totalEncodeTime += encodeTime
+    self.lastFrameStatistics = {
+      "sequence": self.sequence,
+      "keyFrame": keyFrame,
+      "rawBytes": rawBytes.nbytes,
+      "encodedBytes": len(packet),
+      "compressionRatio": rawBytes.nbytes / len(packet),
+      "encodeTime": encodeTime,
+    }
+    return packet
+
+  def statistics(self):
+    """
+    Return the cumulative counters as a dictionary.
+    """
+    return {
+      "mode": self.mode,
+      "frameCount": self.frameCount,
+      "rawBytes": self.totalRawBytes,
+      "encodedBytes": self.totalEncodedBytes,
+      "compressionRatio": self.totalRawBytes / self.totalEncodedBytes if self.totalEncodedBytes else 0.0,
+      "meanEncodeTime": self.totalEncodeTime / self.frameCount if self.frameCount else 0.0,
+    }
+
+
+class FrameDecoder:
+  """
+  Decodes the packets of a FrameEncoder back into frames, verifying their checksum.
+  Delta packets can only be decoded after the frame they refer to; until then decode() returns None.
+  """
+
+  def __init__(self):
+    self._previousFrame = None
+    self._previousSequence = None
+    self.decodedCount = 0
+    self.skippedCount = 0
+
+  def decode(self, packet):
+    """
+    Decode a packet (bytes-like, or the uint8 array of packetToImage). Return the frame, or None if it is a delta packet whose reference was not received.
+    Raise ValueError if the packet is malformed or its checksum does not match.
+    """
+    if isinstance(packet, np.ndarray):
+      packet = np.ascontiguousarray(packet).reshape(-1)
+    packet = memoryview(packet).cast("B")
+    if len(packet) < PACKET_HEADER.size:
+      raise ValueError("Packet too short: {0} bytes".format(len(packet)))
+    (magic, version, codec, flags, dtypeString, rows, columns, sequence, referenceSequence, rawLength,
+      checksum, compressedLength) = PACKET_HEADER.unpack_from(packet)
+    if magic != PACKET_MAGIC or version != PACKET_VERSION:
+      raise ValueError("Not a compressed frame packet (magic {0!r}, version {1})".format(magic, version))
+    dtype = np.dtype(dtypeString.decode("ascii").strip())
+
+    if flags & FLAG_DELTA and (self._previousFrame is None or referenceSequence != self._previousSequence):
+      self.skippedCount += 1
+      return None
+
+    if len(packet) < PACKET_HEADER.size + compressedLength:
+      raise ValueError("Packet {0} truncated: {1} bytes".format(sequence, len(packet)))
+    payload = _decompress(codec, packet[PACKET_HEADER.size:PACKET_HEADER.size + compressedLength])
+    if len(payload) != rawLength or rawLength != rows * columns * dtype.itemsize:
+      raise ValueError("Packet {0}: decoded {1} bytes, expected {2}".format(sequence, len(payload), rawLength))
+    rawBytes = np.frombuffer(payload, dtype=np.uint8)
+    if flags & FLAG_DELTA:
+      rawBytes = np.add(rawBytes, self._previousFrame.view(np.uint8).reshape(-1), dtype=np.uint8)
+    if zlib.crc32(rawBytes) != checksum:
+      raise ValueError("Packet {0}: checksum mismatch".format(sequence))
+
+    frame = rawBytes.view(dtype).reshape(rows, columns).copy()
+    self._previousFrame = frame
+    self._previousSequence = sequence
+    self.decodedCount += 1
+    return frame
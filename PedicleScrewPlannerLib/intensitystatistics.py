@@ -0,0 +1,136 @@
+"""
+Intensity statistics (range, histogram, percentiles) of CT volumes, computed in slabs and cached per volume.
+
+8 and 16 bit integer volumes are counted in a single pass with one bin per possible value,
+so their minimum, maximum and percentiles are exact. Other scalar types use a first pass for
+the range and a second one for a fixed-size histogram.
+"""
+import collections
+
+import numpy as np
+
+from . import windowing
+
+DEFAULT_NUMBER_OF_BINS = 4096
+
+
+class IntensityStatistics:
+  """
+  Minimum, maximum and histogram of the voxel intensities of a volume.
+  histogram[i] counts the voxels in [binEdges[i], binEdges[i+1]).
+  """
+
+  def __init__(self, minimum, maximum, histogram, binEdges):
+    self.minimum = minimum
+    self.maximum = maximum
+    self.histogram = histogram
+    self.binEdges = binEdges
+    self._cumulativeHistogram = np.cumsum(histogram)
+
+  @property
+  def numberOfVoxels(self):
+    return int(self._cumulativeHistogram[-1]) if len(self._cumulativeHistogram) else 0
+
+  def percentile(self, percent):
+    """
+    Intensity below which the given percentage of voxels fall (linearly interpolated within the bin).
+    """
+    if self.numberOfVoxels == 0:
+      return self.minimum
+    target = min(max(float(percent), 0.0), 100.0) / 100.0 * self.numberOfVoxels
+    binIndex = int(np.searchsorted(self._cumulativeHistogram, target, side='left'))
+    binIndex = min(binIndex, len(self.histogram) - 1)
+    countBefore = self._cumulativeHistogram[binIndex - 1] if binIndex > 0 else 0
+    countInBin = self.histogram[binIndex]
+    fraction = (target - countBefore) / countInBin if countInBin else 0.0
+    value = self.binEdges[binIndex] + fraction * (self.binEdges[binIndex + 1] - self.binEdges[binIndex])
+    return float(min(max(value, self.minimum), self.maximum))
+
+  def windowLevelFromPercentiles(self, lowerPercent, upperPercent):
+    """
+    Return the (window, level) pair that spans the intensities between the two percentiles.
+    """
+    lower = self.percentile(lowerPercent)
+    upper = self.percentile(upperPercent)
+    window = max(upper - lower, 1.0)
+    return window, (lower + upper) / 2.0
+
+
+def computeIntensityStatistics(imageArray, numberOfBins=DEFAULT_NUMBER_OF_BINS, slabBytes=windowing.DEFAULT_SLAB_BYTES):
+  """
+  Compute the IntensityStatistics of imageArray, processing it one slab at a time.
+  numberOfBins is only used for scalar types that cannot be counted value by value.
+  """
+  if imageArray.ndim < 2:
+    imageArray = imageArray.reshape(1, -1)
+  step = windowing.slabSize(imageArray.shape, imageArray.dtype.itemsize, slabBytes)
+  slabs = [imageArray[start:start + step] for start in range(0, imageArray.shape[0], step)]
+
+  if windowing.supportsLookupTable(imageArray.dtype):
+    # One bin per value, indexed like the window/level lookup tables
+    indexDtype = windowing.lookupTableIndexType(imageArray.dtype)
+    counts = np.zeros(2 ** (8 * imageArray.dtype.itemsize), dtype=np.int64)
+    for slab in slabs:
+      counts += np.bincount(slab.view(indexDtype).ravel(), minlength=len(counts))
+    values = np.arange(len(counts), dtype=np.int64).astype(indexDtype).view(imageArray.dtype).astype(np.int64)
+    order = np.argsort(values)
+    values = values[order]
+    counts = counts[order]
+    present = np.flatnonzero(counts)
+    if len(present) == 0:
+      return IntensityStatistics(0, 0, np.zeros(1, dtype=np.int64), np.array([0.0, 1.0]))
+    first, last = present[0], present[-1]
+    histogram = counts[first:last + 1]
+    binEdges = np.arange(values[first], values[last] + 2, dtype=np.float64)
+    return IntensityStatistics(int(values[first]), int(values[last]), histogram, binEdges)
+
+  minimum = min(float(slab.min()) for slab in slabs)
+  maximum = max(float(slab.max()) for slab in slabs)
+  upperEdge = maximum if maximum > minimum else minimum + 1.0
+  histogram = np.zeros(int(numberOfBins), dtype=np.int64)
+  for slab in slabs:
+    histogram += np.histogram(slab, bins=int(numberOfBins), range=(minimum, upperEdge))[0]
+  binEdges = np.linspace(minimum, upperEdge, int(numberOfBins) + 1)
+  if np.issubdtype(imageArray.dtype, np.integer):
+    minimum, maximum = int(minimum), int(maximum)
+  return IntensityStatistics(minimum, maximum, histogram, binEdges)
+
+
+class IntensityStatisticsCache:
+  """
+  Least recently used cache of IntensityStatistics.
+  Entries are identified by a key (such as the volume node ID) and the modified time of the voxels:
+  statistics are only recomputed if the voxels changed since they were cached.
+  """
+
+  def __init__(self, maximumNumberOfVolumes=8):
+    self.maximumNumberOfVolumes = maximumNumberOfVolumes
+    self._entries = collections.OrderedDict()
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, modifiedTime, getImageArray):
+    """
+    Return the statistics of the volume identified by key.
+    getImageArray is only called (to compute the statistics) if there is no valid entry.
+    """
+    entry = self._entries.get(key)
+    if entry is not None and entry[0] == modifiedTime:
+      self._entries.move_to_end(key)
+      return entry[1]
+    statistics = computeIntensityStatistics(getImageArray())
+    self._entries[key] = (modifiedTime, statistics)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.maximumNumberOfVolumes:
+      self._entries.popitem(last=False)
+    return statistics
+
+  def invalidate(self, key=None):
+    """
+    Remove the entry of key, or all entries if key is None.
+    """
+    if key is None:
+      self._entries.clear()
+    else:
+      self._entries.pop(key, None)
@@ -0,0 +1,139 @@
+"""
+End-to-end latency instrumentation of the AR image stream, from a HoloLens pose to the image sent back.
+
+Each frame gets a timeline: the time of each stage it went through (see STAGES), all measured with the
+same clock. Poses that arrive before the frame is scheduled are coalesced into it, and the frame keeps
+the arrival time of the oldest one, so the latencies are those of the first pose the frame answers.
+The last completed timelines are kept in a rolling window to compute percentiles and export CSV files.
+"""
+import collections
+import csv
+import time
+
+import numpy as np
+
+RECEIVE = "receive"  # pose received (TRANSFORM applied to Image_T)
+SCHEDULE = "schedule"  # reslice update started by the scheduler
+RESLICE_START = "resliceStart"
+RESLICE_END = "resliceEnd"
+PUBLISH = "publish"  # frame written into CT_reslice
+SEND = "send"  # Modified event processed (the connector pushes the image)
+STAGES = (RECEIVE, SCHEDULE, RESLICE_START, RESLICE_END, PUBLISH, SEND)
+
+# Reported intervals: (name, from stage, to stage)
+INTERVALS = (
+  ("queue", RECEIVE, SCHEDULE),
+  ("dispatch", SCHEDULE, RESLICE_START),
+  ("reslice", RESLICE_START, RESLICE_END),
+  ("output", RESLICE_END, PUBLISH),
+  ("push", PUBLISH, SEND),
+  ("total", RECEIVE, SEND),
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyTracker:
+  """
+  Collects frame timelines and computes rolling latency percentiles.
+
+  A frame timeline is a dictionary {stage: time}. Call markReceived() when a pose arrives,
+  beginFrame() when the update runs, mark(timeline, stage) at each stage and finishFrame(timeline)
+  once it is sent. Frames that are not sent (e.g. suppressed duplicates) are discarded with dropFrame().
+  """
+
+  def __init__(self, windowSize=500, clock=time.perf_counter):
+    self.clock = clock
+    self.timelines = collections.deque(maxlen=windowSize)
+    self._pendingReceiveTime = None
+    self.completedCount = 0
+    self.droppedCount = 0
+
+  def reset(self):
+    self.timelines.clear()
+    self._pendingReceiveTime = None
+    self.completedCount = 0
+    self.droppedCount = 0
+
+  def markReceived(self):
+    """
+    Record the arrival of a pose. Only the oldest pose not yet answered by a frame is kept.
+    """
+    if self._pendingReceiveTime is None:
+      self._pendingReceiveTime = self.clock()
+
+  def beginFrame(self):
+    """
+    Start the timeline of a frame (schedule stage), attached to the pending pose if any.
+    Frames not triggered by a pose (e.g. contrast changes) have no receive stage.
+    """
+    timeline = {SCHEDULE: self.clock()}
+    if self._pendingReceiveTime is not None:
+      timeline[RECEIVE] = self._pendingReceiveTime
+      self._pendingReceiveTime = None
+    return timeline
+
+  def mark(self, timeline, stage):
+    if timeline is not None:
+      timeline[stage] = self.clock()
+
+  def finishFrame(self, timeline):
+    """
+    Mark the send stage and add the timeline to the rolling window.
+    """
+    if timeline is None:
+      return
+    self.mark(timeline, SEND)
+    self.timelines.append(timeline)
+    self.completedCount += 1
+
+  def dropFrame(self, timeline):
+    if timeline is not None:
+      self.droppedCount += 1
+
+  def intervals(self, name):
+    """
+    Durations (in seconds) of an interval over the frames of the rolling window that went through both its stages.
+    """
+    _, startStage, endStage = next(interval for interval in INTERVALS if interval[0] == name)
+    return np.array([timeline[endStage] - timeline[startStage] for timeline in self.timelines
+      if startStage in timeline and endStage in timeline])
+
+  def summary(self):
+    """
+    Return {interval name: {"count": n, "p50": seconds, "p95": seconds, "p99": seconds}} over the rolling window.
+    """
+    summary = {}
+    for name, _, _ in INTERVALS:
+      durations = self.intervals(name)
+      statistics = {"count": len(durations)}
+      for percentile in PERCENTILES:
+        statistics["p{0}".format(percentile)] = float(np.percentile(durations, percentile)) if len(durations) else float("nan")
+      summary[name] = statistics
+    return summary
+
+  def summaryText(self):
+    """
+    Multi-line table of the percentiles in milliseconds, for display.
+    """
+    lines = ["{0:<9}{1:>7}{2:>9}{3:>9}{4:>9}".format("ms", "frames", "p50", "p95", "p99")]
+    for name, statistics in self.summary().items():
+      lines.append("{0:<9}{1:>7}{2:>9.1f}{3:>9.1f}{4:>9.1f}".format(name, statistics["count"],
+        statistics["p50"] * 1000, statistics["p95"] * 1000, statistics["p99"] * 1000))
+    return "\n".join(lines)
+
+  def exportCsv(self, path):
+    """
+    Write one row per frame of the rolling window: the time of each stage (seconds, relative to the first stage
+    of the frame, empty if the frame did not go through it) and the duration of each interval.
+    """
+    with open(path, "w", newline="") as csvFile:
+      writer = csv.writer(csvFile)
+      writer.writerow(["frame", "startTime"] + list(STAGES) + [name for name, _, _ in INTERVALS])
+      for index, timeline in enumerate(self.timelines):
+        startTime = min(timeline.values())
+        row = [index, "{0:.6f}".format(startTime)]
+        row += ["{0:.6f}".format(timeline[stage] - startTime) if stage in timeline else "" for stage in STAGES]
+        row += ["{0:.6f}".format(timeline[endStage] - timeline[startStage])
+          if startStage in timeline and endStage in timeline else "" for _, startStage, endStage in INTERVALS]
+        writer.writerow(row)
@@ -0,0 +1,99 @@
+"""
+In-process cache of meshes read from files, shared by the AR_Planner and Desktop_Planner modules.
+
+A plan uses many screws but only a few distinct screw files, so each file is read once and its mesh is
+kept in memory. Entries are keyed by file path and checked against the modification time and size of the
+file, so an edited file is read again. The least recently used meshes are evicted above a memory bound.
+The cached meshes are shared: callers must not modify them in place (e.g. give each model a shallow copy).
+"""
+import collections
+import os
+import threading
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def fileStamp(path):
+  """
+  Return (modification time in ns, size) of a file, which changes whenever the file is rewritten.
+  """
+  status = os.stat(path)
+  return (status.st_mtime_ns, status.st_size)
+
+
+def estimateSize(mesh):
+  """
+  Memory used by a mesh, in bytes: a NumPy array, a VTK data object, or a tuple or list of them.
+  """
+  if hasattr(mesh, "nbytes"):
+    return int(mesh.nbytes)
+  if hasattr(mesh, "GetActualMemorySize"):
+    return int(mesh.GetActualMemorySize()) * 1024
+  if isinstance(mesh, (tuple, list)):
+    return sum(estimateSize(item) for item in mesh)
+  return 0
+
+
+class MeshCache:
+  """
+  LRU cache of the meshes read from files, bounded by the total estimated size of the meshes.
+  """
+
+  def __init__(self, maxBytes=DEFAULT_MAX_BYTES, sizeOf=estimateSize):
+    self.maxBytes = maxBytes
+    self.sizeOf = sizeOf
+    self._entries = collections.OrderedDict()  # key: (stamp, mesh, size), least recently used first
+    self._lock = threading.RLock()
+    self.totalBytes = 0
+    self.hitCount = 0
+    self.missCount = 0
+    self.evictedCount = 0
+
+  def get(self, path, read, variant=None):
+    """
+    Return the mesh of a file, calling read(path) only if the file is not cached or changed since it was read.
+    variant distinguishes several meshes derived from the same file (e.g. decimation levels).
+    """
+    key = (os.path.normcase(os.path.abspath(path)), variant)
+    stamp = fileStamp(path)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[0] == stamp:
+        self._entries.move_to_end(key)
+        self.hitCount += 1
+        return entry[1]
+      self.missCount += 1
+    mesh = read(path)
+    with self._lock:
+      self._remove(key)
+      size = self.sizeOf(mesh)
+      self._entries[key] = (stamp, mesh, size)
+      self.totalBytes += size
+      while self.totalBytes > self.maxBytes and len(self._entries) > 1:
+        self._remove(next(iter(self._entries)))
+        self.evictedCount += 1
+    return mesh
+
+  def _remove(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self.totalBytes -= entry[2]
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.totalBytes = 0
+
+  def statistics(self):
+    with self._lock:
+      return {
+        "entryCount": len(self._entries),
+        "totalBytes": self.totalBytes,
+        "hitCount": self.hitCount,
+        "missCount": self.missCount,
+        "evictedCount": self.evictedCount,
+      }
+
+
+# Cache shared by every module of the Slicer session (the package is imported once per process)
+sharedMeshCache = MeshCache()
@@ -0,0 +1,234 @@
+"""
+Wavefront .obj files (the format of the spine and screw models used by both modules).
+
+readObj parses the text with NumPy operations on the whole file instead of line by line. loadObj keeps a
+binary copy of each parsed mesh next to the .obj file (MESH_CACHE_EXTENSION): a JSON header padded to
+MESH_CACHE_HEADER_SIZE bytes, then the float32 vertices and the int32 faces, which are memory-mapped
+by later loads. The copy is used while the .obj file keeps the same modification time and size, or
+the same content hash.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+MESH_CACHE_MAGIC = b"PSPMESH1"
+MESH_CACHE_HEADER_SIZE = 4096
+MESH_CACHE_EXTENSION = ".meshcache"
+
+_SPACE_PATTERN = re.compile(rb"SPACE=(RAS|LPS)")
+_IS_SEPARATOR = np.zeros(256, dtype=bool)  # lookup table of the whitespace characters
+_IS_SEPARATOR[list(b" \t\r\n")] = True
+
+
+def writeObj(path, vertices, faces, comment=None):
+  """
+  Write a triangle mesh: vertices is an (N, 3) float array, faces an (M, 3) array of 0-based vertex indices.
+  """
+  vertices = np.asarray(vertices, dtype=np.float64)
+  faces = np.asarray(faces, dtype=np.int64)
+  with open(path, "w") as objFile:
+    if comment:
+      objFile.write("# {0}\n".format(comment))
+    np.savetxt(objFile, vertices, fmt="v %.6f %.6f %.6f")
+    np.savetxt(objFile, faces + 1, fmt="f %d %d %d")
+
+
+def _linesOfType(characters, lineStarts, keyword):
+  """
+  Characters of the lines that start with the keyword (e.g. b"v") followed by a space or tab, with the keyword blanked out,
+  the start of each of these lines in the returned characters, and which lines were selected. Spaces and tabs before
+  the keyword are allowed.
+  """
+  lastCharacter = len(characters) - 1
+  # First character of each line that is not a space or tab (the line end for a blank line)
+  nonBlankPositions = np.append(np.flatnonzero(~np.isin(characters, (ord(" "), ord("\t")))), lastCharacter)
+  keywordStarts = nonBlankPositions[np.searchsorted(nonBlankPositions, lineStarts)]
+  isSelected = np.isin(characters[np.minimum(keywordStarts + len(keyword), lastCharacter)], (ord(" "), ord("\t")))
+  for offset, keywordCharacter in enumerate(keyword):
+    isSelected &= characters[np.minimum(keywordStarts + offset, lastCharacter)] == keywordCharacter
+  lineLengths = np.diff(np.append(lineStarts, len(characters)))
+  selectedCharacters = characters[np.repeat(isSelected, lineLengths)]
+  selectedLineStarts = np.cumsum(lineLengths[isSelected]) - lineLengths[isSelected]
+  selectedKeywordStarts = selectedLineStarts + (keywordStarts - lineStarts)[isSelected]
+  for offset in range(len(keyword)):
+    selectedCharacters[selectedKeywordStarts + offset] = ord(" ")
+  return selectedCharacters, selectedLineStarts, isSelected
+
+
+def _tokenCounts(isSeparator, lineStarts):
+  """
+  Number of tokens on each line, given which characters are separators and where the lines start.
+  """
+  if not len(lineStarts):
+    return np.zeros(0, np.int64)
+  isTokenStart = ~isSeparator
+  isTokenStart[1:] &= isSeparator[:-1]
+  return np.add.reduceat(isTokenStart, lineStarts, dtype=np.int64)
+
+
+def _parseNumbers(characters, dtype):
+  if not len(characters):
+    return np.zeros(0, dtype=dtype)
+  return np.fromstring(characters.tobytes().decode("ascii"), dtype=dtype, sep=" ")
+
+
+def _firstTokens(values, counts, tokenCount):
+  """
+  The first tokenCount values of each line, given the values of all the lines one after the other and the number of values of each line.
+  """
+  if np.all(counts == tokenCount):
+    return values.reshape(-1, tokenCount)
+  starts = np.cumsum(counts) - counts
+  return values[starts[:, np.newaxis] + np.arange(tokenCount)]
+
+
+def _triangulate(indices, counts):
+  """
+  Split polygons (indices of all the polygons one after the other, counts of vertices of each) into triangle fans.
+  """
+  if np.all(counts == 3):
+    return indices.reshape(-1, 3)
+  firstIndices = np.cumsum(counts) - counts
+  firstIndices, counts = firstIndices[counts >= 3], counts[counts >= 3]
+  trianglesPerPolygon = counts - 2
+  polygonOfTriangle = np.repeat(np.arange(len(counts)), trianglesPerPolygon)
+  triangleInPolygon = np.arange(trianglesPerPolygon.sum()) - np.repeat(np.cumsum(trianglesPerPolygon) - trianglesPerPolygon, trianglesPerPolygon)
+  first = firstIndices[polygonOfTriangle]
+  return np.stack([indices[first], indices[first + triangleInPolygon + 1], indices[first + triangleInPolygon + 2]], axis=1)
+
+
+def readObj(path):
+  """
+  Read the vertices ((N, 3) float32) and triangles ((M, 3) int32, 0-based) of a .obj file.
+  The lines are classified and parsed on the whole character array at once, without a Python loop over the lines.
+  Polygons are split into triangle fans; texture coordinates, normals, groups and materials are ignored.
+  Negative (relative) indices are resolved against the vertices defined before the face, as in the format specification.
+  """
+  characters = np.fromfile(path, dtype=np.uint8)
+  if not len(characters):
+    return np.zeros((0, 3), np.float32), np.zeros((0, 3), np.int32)
+  lineStarts = np.concatenate(([0], np.flatnonzero(characters[:-1] == ord("\n")) + 1))
+
+  vertexCharacters, vertexLineStarts, isVertexLine = _linesOfType(characters, lineStarts, b"v")
+  vertexCounts = _tokenCounts(_IS_SEPARATOR[vertexCharacters], vertexLineStarts)
+  vertices = _firstTokens(_parseNumbers(vertexCharacters, np.float32), vertexCounts, 3)
+
+  faceCharacters, faceLineStarts, isFaceLine = _linesOfType(characters, lineStarts, b"f")
+  isSeparator = _IS_SEPARATOR[faceCharacters]
+  slashPositions = np.flatnonzero(faceCharacters == ord("/"))
+  if len(slashPositions):
+    # Blank out the texture and normal indices of "v/vt/vn" (from a slash to the next separator)
+    positions = np.arange(len(faceCharacters))
+    lastSlash = np.full(len(faceCharacters), -1)
+    lastSlash[slashPositions] = slashPositions
+    lastSeparator = np.where(isSeparator, positions, -1)
+    isSuffix = np.maximum.accumulate(lastSlash) > np.maximum.accumulate(lastSeparator)
+    faceCharacters[isSuffix] = ord(" ")
+    isSeparator |= isSuffix
+  indices = _parseNumbers(faceCharacters, np.int64)
+  faceCounts = _tokenCounts(isSeparator, faceLineStarts)
+  isRelative = indices < 0
+  if isRelative.any():
+    verticesBeforeFace = np.searchsorted(np.flatnonzero(isVertexLine), np.flatnonzero(isFaceLine))
+    indices[isRelative] += np.repeat(verticesBeforeFace, faceCounts)[isRelative]
+  indices[~isRelative] -= 1
+  faces = _triangulate(indices, faceCounts)
+  if faces.size and (faces.min() < 0 or faces.max() >= len(vertices)):
+    raise ValueError("{0}: face vertex index out of range".format(path))
+  return np.ascontiguousarray(vertices), faces.astype(np.int32)
+
+
+def objCoordinateSystem(path, headerSize=1024):
+  """
+  Return "RAS" or "LPS" if the comments at the beginning of the file specify it (e.g. "# SPACE=RAS", as written by 3D Slicer), else None.
+  """
+  with open(path, "rb") as objFile:
+    match = _SPACE_PATTERN.search(objFile.read(headerSize))
+  return match.group(1).decode("ascii") if match else None
+
+
+def fileHash(path, chunkSize=2**20):
+  digest = hashlib.blake2b(digest_size=16)
+  with open(path, "rb") as sourceFile:
+    for chunk in iter(lambda: sourceFile.read(chunkSize), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def meshCachePath(path):
+  return path + MESH_CACHE_EXTENSION
+
+
+def _readMeshCacheHeader(cachePath):
+  with open(cachePath, "rb") as cacheFile:
+    encodedHeader = cacheFile.read(MESH_CACHE_HEADER_SIZE)
+  if not encodedHeader.startswith(MESH_CACHE_MAGIC) or len(encodedHeader) < MESH_CACHE_HEADER_SIZE:
+    raise ValueError("Not a mesh cache file: {0}".format(cachePath))
+  return json.loads(encodedHeader[len(MESH_CACHE_MAGIC):].decode("utf-8"))
+
+
+def _encodeMeshCacheHeader(header):
+  return (MESH_CACHE_MAGIC + json.dumps(header).encode("utf-8")).ljust(MESH_CACHE_HEADER_SIZE, b" ")
+
+
+def writeMeshCache(cachePath, vertices, faces, sourceStamp, sourceHash):
+  """
+  Write a mesh cache file (atomically, so a concurrent reader never sees a partial file).
+  """
+  header = {"sourceStamp": list(sourceStamp), "sourceHash": sourceHash, "vertexCount": len(vertices), "faceCount": len(faces)}
+  temporaryPath = "{0}.{1}.tmp".format(cachePath, os.getpid())
+  with open(temporaryPath, "wb") as cacheFile:
+    cacheFile.write(_encodeMeshCacheHeader(header))
+    cacheFile.write(np.ascontiguousarray(vertices, dtype="<f4").tobytes())
+    cacheFile.write(np.ascontiguousarray(faces, dtype="<i4").tobytes())
+  os.replace(temporaryPath, cachePath)
+
+
+def readMeshCache(cachePath):
+  """
+  Memory-map the (vertices, faces) of a mesh cache file (read-only arrays).
+  """
+  header = _readMeshCacheHeader(cachePath)
+  vertexCount, faceCount = header["vertexCount"], header["faceCount"]
+  vertices = np.memmap(cachePath, dtype="<f4", mode="r", offset=MESH_CACHE_HEADER_SIZE, shape=(vertexCount, 3)) if vertexCount else np.zeros((0, 3), np.float32)
+  faces = np.memmap(cachePath, dtype="<i4", mode="r", offset=MESH_CACHE_HEADER_SIZE + vertexCount * 12, shape=(faceCount, 3)) if faceCount else np.zeros((0, 3), np.int32)
+  return vertices, faces
+
+
+def loadObj(path, useCache=True):
+  """
+  Return the (vertices, faces) of a .obj file, from its mesh cache if it is up to date, else by parsing it (and writing the cache).
+  The cache is up to date if the .obj file has the modification time and size it had when the cache was written, or else the same content hash.
+  If the cache cannot be written (e.g. read-only folder), the file is parsed at every load.
+  """
+  if not useCache:
+    return readObj(path)
+  cachePath = meshCachePath(path)
+  status = os.stat(path)
+  sourceStamp = [status.st_mtime_ns, status.st_size]
+  sourceHash = None
+  if os.path.exists(cachePath):
+    try:
+      header = _readMeshCacheHeader(cachePath)
+      if header["sourceStamp"] != sourceStamp:
+        sourceHash = fileHash(path)
+        if header["sourceHash"] == sourceHash:
+          # Same content (e.g. file copied or touched): only update the stamp
+          header["sourceStamp"] = sourceStamp
+          with open(cachePath, "r+b") as cacheFile:
+            cacheFile.write(_encodeMeshCacheHeader(header))
+      if header["sourceStamp"] == sourceStamp:
+        return readMeshCache(cachePath)
+    except (OSError, ValueError, KeyError) as error:
+      logging.warning("Ignoring mesh cache {0}: {1}".format(cachePath, error))
+
+  vertices, faces = readObj(path)
+  try:
+    writeMeshCache(cachePath, vertices, faces, sourceStamp, sourceHash or fileHash(path))
+  except OSError as error:
+    logging.warning("Could not write mesh cache {0}: {1}".format(cachePath, error))
+  return vertices, faces
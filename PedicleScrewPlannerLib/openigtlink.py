@@ -0,0 +1,200 @@
+"""
+Minimal OpenIGTLink message framing (header, version 2 extended header and metadata, IMAGE and TRANSFORM
+bodies), so that Python tools can talk to the 3D Slicer IGTLConnector without the OpenIGTLink library.
+
+See https://github.com/openigtlink/OpenIGTLink/blob/master/Documents/Protocol/index.md
+Messages are built the same way as in the Unity application (AR_Planner-Unity, SendMessageToServer.cs).
+"""
+import struct
+
+import numpy as np
+
+HEADER = struct.Struct(">H12s20sQQQ")  # version, type, device name, timestamp, body size, CRC
+MAX_DEVICE_NAME_LENGTH = 20  # Longer device names are cut on the wire, so they never match on the receiving side
+EXTENDED_HEADER = struct.Struct(">HHII")  # extended header size, metadata header size, metadata size, message ID
+IMAGE_HEADER = struct.Struct(">HBBBB3H12f3H3H")
+METADATA_ENTRY_HEADER = struct.Struct(">HHI")  # key size, value encoding, value size
+US_ASCII_ENCODING = 3
+
+# IMAGE scalar type codes
+SCALAR_TYPES = {
+  2: np.int8, 3: np.uint8, 4: np.int16, 5: np.uint16, 6: np.int32, 7: np.uint32, 10: np.float32, 11: np.float64,
+}
+
+_CRC64_POLYNOMIAL = 0x42F0E1EBA9EA3693
+
+
+def _crc64Table():
+  table = []
+  for byte in range(256):
+    crc = byte << 56
+    for _ in range(8):
+      crc = ((crc << 1) ^ _CRC64_POLYNOMIAL) if crc & (1 << 63) else (crc << 1)
+    table.append(crc & 0xFFFFFFFFFFFFFFFF)
+  return table
+
+
+_CRC64_TABLE = _crc64Table()
+
+
+def crc64(data):
+  """
+  CRC-64 (ECMA-182) used in the OpenIGTLink header.
+  """
+  crc = 0
+  for byte in bytes(data):
+    crc = _CRC64_TABLE[((crc >> 56) ^ byte) & 0xFF] ^ ((crc << 8) & 0xFFFFFFFFFFFFFFFF)
+  return crc
+
+
+class Message:
+  """
+  A received or outgoing OpenIGTLink message: type, device name, timestamp, content bytes and metadata dictionary.
+  """
+
+  def __init__(self, messageType, deviceName, content, metadata=None, timestamp=0, version=2):
+    self.messageType = messageType
+    self.deviceName = deviceName
+    self.content = content
+    self.metadata = metadata or {}
+    self.timestamp = timestamp
+    self.version = version
+
+  def __repr__(self):
+    return "Message({0}, {1}, {2} bytes)".format(self.messageType, self.deviceName, len(self.content))
+
+
+def _fixedString(text, size):
+  return text.encode("ascii")[:size].ljust(size, b"\0")
+
+
+def checkDeviceName(deviceName):
+  """
+  Return deviceName if it fits in the device name field of the header, else raise ValueError.
+  """
+  if len(deviceName.encode("ascii")) > MAX_DEVICE_NAME_LENGTH:
+    raise ValueError("OpenIGTLink device name longer than {0} characters: {1}".format(MAX_DEVICE_NAME_LENGTH, deviceName))
+  return deviceName
+
+
+def packMessage(message, computeCrc=True):
+  """
+  Serialize a Message into bytes (header + body).
+  """
+  body = bytes(message.content)
+  if message.version >= 2:
+    keys = [str(key).encode("ascii") for key in message.metadata]
+    values = [str(value).encode("ascii") for value in message.metadata.values()]
+    metadataHeader = struct.pack(">H", len(keys)) + b"".join(
+      METADATA_ENTRY_HEADER.pack(len(key), US_ASCII_ENCODING, len(value)) for key, value in zip(keys, values))
+    metadata = b"".join(key + value for key, value in zip(keys, values))
+    extendedHeader = EXTENDED_HEADER.pack(EXTENDED_HEADER.size, len(metadataHeader), len(metadata), 0)
+    body = extendedHeader + body + metadataHeader + metadata
+  header = HEADER.pack(message.version, _fixedString(message.messageType, 12), _fixedString(checkDeviceName(message.deviceName), MAX_DEVICE_NAME_LENGTH),
+    message.timestamp, len(body), crc64(body) if computeCrc else 0)
+  return header + body
+
+
+def unpackHeader(headerBytes):
+  """
+  Return (version, messageType, deviceName, timestamp, bodySize, crc) of a 58-byte header.
+  """
+  version, messageType, deviceName, timestamp, bodySize, crc = HEADER.unpack(headerBytes)
+  return (version, messageType.rstrip(b"\0").decode("ascii"), deviceName.rstrip(b"\0").decode("ascii"),
+    timestamp, bodySize, crc)
+
+
+def unpackBody(version, messageType, deviceName, body, timestamp=0):
+  """
+  Split a message body into content and metadata (version 2 messages), and return a Message.
+  """
+  body = memoryview(body)
+  metadata = {}
+  if version >= 2:
+    extendedHeaderSize, metadataHeaderSize, metadataSize, _ = EXTENDED_HEADER.unpack_from(body)
+    contentEnd = len(body) - metadataHeaderSize - metadataSize
+    content = body[extendedHeaderSize:contentEnd]
+    if metadataHeaderSize >= 2:
+      entryCount = struct.unpack_from(">H", body, contentEnd)[0]
+      entries = [METADATA_ENTRY_HEADER.unpack_from(body, contentEnd + 2 + index * METADATA_ENTRY_HEADER.size)
+        for index in range(entryCount)]
+      offset = contentEnd + metadataHeaderSize
+      for keySize, _, valueSize in entries:
+        key = bytes(body[offset:offset + keySize]).decode("ascii")
+        value = bytes(body[offset + keySize:offset + keySize + valueSize]).decode("ascii", errors="replace")
+        metadata[key] = value
+        offset += keySize + valueSize
+  else:
+    content = body
+  return Message(messageType, deviceName, bytes(content), metadata, timestamp, version)
+
+
+def _receiveExactly(connection, size):
+  data = bytearray(size)
+  view = memoryview(data)
+  received = 0
+  while received < size:
+    count = connection.recv_into(view[received:], size - received)
+    if count == 0:
+      raise ConnectionError("Connection closed by the server")
+    received += count
+  return data
+
+
+def receiveMessage(connection):
+  """
+  Read one message from a connected socket.
+  """
+  version, messageType, deviceName, timestamp, bodySize, _ = unpackHeader(_receiveExactly(connection, HEADER.size))
+  return unpackBody(version, messageType, deviceName, _receiveExactly(connection, bodySize), timestamp)
+
+
+def sendMessage(connection, message):
+  connection.sendall(packMessage(message))
+
+
+def packTransformContent(matrix):
+  """
+  TRANSFORM content of a 4x4 matrix: the 3x4 upper part, column by column, as big endian float32.
+  """
+  matrix = np.asarray(matrix, dtype=np.float64)
+  return matrix[:3, :4].T.astype(">f4").tobytes()
+
+
+def unpackTransformContent(content):
+  matrix = np.eye(4)
+  matrix[:3, :4] = np.frombuffer(bytes(content[:48]), dtype=">f4").reshape(4, 3).T
+  return matrix
+
+
+def packImageContent(imageArray, ijkToRasMatrix=None):
+  """
+  IMAGE content of a KJI (or JI, or I) array (single component, RAS coordinates, little endian pixels).
+  """
+  imageArray = np.ascontiguousarray(imageArray)
+  imageArray = imageArray.reshape((1,) * (3 - imageArray.ndim) + imageArray.shape)
+  scalarType = {np.dtype(dtype): code for code, dtype in SCALAR_TYPES.items()}[imageArray.dtype.newbyteorder("=")]
+  matrix = np.eye(4) if ijkToRasMatrix is None else np.asarray(ijkToRasMatrix, dtype=np.float64)
+  size = imageArray.shape[::-1]
+  center = matrix[:3, :3] @ ((np.array(size) - 1) / 2.0) + matrix[:3, 3]
+  header = IMAGE_HEADER.pack(1, 1, scalarType, 2, 1, *size, *matrix[:3, :3].T.ravel(), *center,
+    0, 0, 0, *size)
+  return header + imageArray.astype(imageArray.dtype.newbyteorder("<"), copy=False).tobytes()
+
+
+def unpackImageContent(content):
+  """
+  Return (KJI array, IJK to RAS 4x4 matrix) of an IMAGE content. Multi-component images get a last component axis.
+  """
+  fields = IMAGE_HEADER.unpack_from(content)
+  _, components, scalarType, endian, _ = fields[:5]
+  size = fields[5:8]
+  normals = np.array(fields[8:17]).reshape(3, 3).T  # columns: i, j and k axes scaled by the spacing
+  center = np.array(fields[17:20])
+  dtype = np.dtype(SCALAR_TYPES[scalarType]).newbyteorder(">" if endian == 1 else "<")
+  shape = (size[2], size[1], size[0]) + ((components,) if components > 1 else ())
+  imageArray = np.frombuffer(bytes(content[IMAGE_HEADER.size:]), dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+  matrix = np.eye(4)
+  matrix[:3, :3] = normals
+  matrix[:3, 3] = center - normals @ ((np.array(size) - 1) / 2.0)
+  return imageArray, matrix
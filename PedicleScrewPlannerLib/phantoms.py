@@ -0,0 +1,152 @@
+"""
+Deterministic synthetic data for benchmarks: a CT-like volume of a spine, spine-like meshes and screw models.
+
+The shapes only need to be plausible (sizes, intensities, number of triangles), not anatomically correct.
+The same parameters and seed always give the same data, so that benchmark runs can be compared.
+"""
+import math
+import os
+
+import numpy as np
+
+from . import objfile
+
+AIR = -1000
+SOFT_TISSUE = 40
+CANCELLOUS_BONE = 300
+CORTICAL_BONE = 1200
+
+
+def vertebraCenters(numberOfVertebrae, extentS, margin=0.1):
+  """
+  Superior coordinates (mm) of the vertebral body centers, evenly distributed along extentS.
+  """
+  step = extentS * (1.0 - 2 * margin) / numberOfVertebrae
+  return [extentS * margin + step * (index + 0.5) for index in range(numberOfVertebrae)], step
+
+
+def syntheticCtVolume(shape=(128, 256, 256), spacing=(0.8, 0.8, 1.0), numberOfVertebrae=5, seed=0, dtype=np.int16):
+  """
+  CT-like KJI volume (Hounsfield units) of a body containing a stack of vertebrae.
+
+  :param shape: (slices, rows, columns)
+  :param spacing: IJK voxel spacing in mm
+  :return: volume array. Voxel (k, j, i) is at (i, j, k) * spacing in RAS-like coordinates.
+  """
+  random = np.random.default_rng(seed)
+  volume = np.empty(shape, dtype=dtype)
+  columns = np.arange(shape[2]) * spacing[0]
+  rows = np.arange(shape[1]) * spacing[1]
+  x = columns[np.newaxis, :] - columns[-1] / 2
+  y = rows[:, np.newaxis] - rows[-1] * 0.45
+  centers, step = vertebraCenters(numberOfVertebrae, (shape[0] - 1) * spacing[2])
+  bodyRadius = min(columns[-1], rows[-1]) * 0.12
+  bodyHeight = step * 0.75
+
+  body = (x / (columns[-1] * 0.42)) ** 2 + (y / (rows[-1] * 0.4)) ** 2 <= 1.0
+  bodyRadial = np.hypot(x, y)
+  canal = np.hypot(x, y - bodyRadius * 1.6) <= bodyRadius * 0.45
+  posteriorArch = (np.abs(np.hypot(x, y - bodyRadius * 1.6) - bodyRadius * 0.7) <= bodyRadius * 0.25) & (y > bodyRadius)
+  spinousProcess = (np.abs(x) <= bodyRadius * 0.15) & (y > bodyRadius * 2.2) & (y < bodyRadius * 3.4)
+  for k in range(shape[0]):
+    s = k * spacing[2]
+    sliceArray = np.where(body, SOFT_TISSUE, AIR).astype(np.float32)
+    for center in centers:
+      distance = abs(s - center)
+      if distance <= bodyHeight / 2:
+        cortical = (bodyRadial <= bodyRadius) & ((bodyRadial >= bodyRadius * 0.85) | (distance >= bodyHeight / 2 - 1.5))
+        sliceArray[bodyRadial <= bodyRadius] = CANCELLOUS_BONE
+        sliceArray[cortical] = CORTICAL_BONE
+        if distance <= bodyHeight / 3:
+          sliceArray[posteriorArch | spinousProcess] = CORTICAL_BONE
+          sliceArray[canal] = SOFT_TISSUE
+    sliceArray += random.normal(0.0, 20.0, sliceArray.shape).astype(np.float32)
+    volume[k] = np.clip(np.rint(sliceArray), np.iinfo(dtype).min, np.iinfo(dtype).max) if np.issubdtype(dtype, np.integer) else sliceArray
+  return volume
+
+
+def cylinderMesh(radius, height, resolution=24, center=(0.0, 0.0, 0.0), axis=2, tipLength=0.0):
+  """
+  Closed cylinder along the given axis (0, 1 or 2), optionally ending with a cone of length tipLength.
+  Return (vertices, faces).
+  """
+  angles = np.linspace(0.0, 2 * math.pi, resolution, endpoint=False)
+  ring = np.stack([radius * np.cos(angles), radius * np.sin(angles)], axis=1)
+  bottom = np.column_stack([ring, np.full(resolution, -height / 2)])
+  top = np.column_stack([ring, np.full(resolution, height / 2)])
+  endPoints = np.array([[0.0, 0.0, -height / 2 - tipLength], [0.0, 0.0, height / 2]])
+  vertices = np.vstack([bottom, top, endPoints])
+  index = np.arange(resolution)
+  nextIndex = (index + 1) % resolution
+  bottomCenter, topCenter = 2 * resolution, 2 * resolution + 1
+  faces = np.vstack([
+    np.column_stack([index, nextIndex, resolution + nextIndex]),
+    np.column_stack([index, resolution + nextIndex, resolution + index]),
+    np.column_stack([np.full(resolution, bottomCenter), nextIndex, index]),
+    np.column_stack([np.full(resolution, topCenter), resolution + index, resolution + nextIndex]),
+  ])
+  vertices = np.roll(vertices, axis - 2, axis=1) + np.asarray(center, dtype=np.float64)
+  return vertices, faces
+
+
+def mergeMeshes(meshes):
+  """
+  Concatenate (vertices, faces) meshes into one mesh.
+  """
+  vertices = []
+  faces = []
+  offset = 0
+  for meshVertices, meshFaces in meshes:
+    vertices.append(meshVertices)
+    faces.append(meshFaces + offset)
+    offset += len(meshVertices)
+  return np.vstack(vertices), np.vstack(faces)
+
+
+def spineMesh(numberOfVertebrae=5, extentS=128.0, bodyRadius=20.0, resolution=64):
+  """
+  Spine-like mesh: for each vertebra a body, two pedicles and a spinous process.
+  The triangle count grows with the square of resolution, like the detail of a segmented model.
+  """
+  centers, step = vertebraCenters(numberOfVertebrae, extentS)
+  meshes = []
+  for center in centers:
+    for ringIndex in range(max(1, resolution // 16)):
+      # Stacked slabs to reach a realistic number of triangles
+      slabHeight = step * 0.75 / max(1, resolution // 16)
+      slabCenter = center - step * 0.375 + slabHeight * (ringIndex + 0.5)
+      meshes.append(cylinderMesh(bodyRadius, slabHeight, resolution, (0.0, 0.0, slabCenter)))
+    for side in (-1, 1):
+      meshes.append(cylinderMesh(bodyRadius * 0.25, bodyRadius * 1.2, resolution // 2, (side * bodyRadius * 0.6, bodyRadius * 1.3, center), axis=1))
+    meshes.append(cylinderMesh(bodyRadius * 0.15, bodyRadius * 1.5, resolution // 4, (0.0, bodyRadius * 2.8, center), axis=1))
+  return mergeMeshes(meshes)
+
+
+def screwMesh(diameter, length, resolution=32):
+  """
+  Screw-like mesh along the Z axis: a shaft of the given diameter ending in a conical tip.
+  """
+  tipLength = diameter
+  return cylinderMesh(diameter / 2.0, length - tipLength, resolution, (0.0, 0.0, tipLength / 2.0), tipLength=tipLength)
+
+
+def screwFileName(diameter, length):
+  """
+  Name of a screw model file, as sent by the HoloLens application (e.g. "D5L45.obj").
+  """
+  return "D{0:g}L{1:g}.obj".format(diameter, length)
+
+
+def writeScrewModels(directory, diameters=(4.5, 5, 5.5, 6, 6.5, 7), lengths=(35, 40, 45, 50, 55), resolution=32):
+  """
+  Write a screw model for every diameter/length combination. Return the file names.
+  """
+  os.makedirs(directory, exist_ok=True)
+  fileNames = []
+  for diameter in diameters:
+    for length in lengths:
+      fileName = screwFileName(diameter, length)
+      vertices, faces = screwMesh(diameter, length, resolution)
+      objfile.writeObj(os.path.join(directory, fileName), vertices, faces, "Synthetic screw D{0:g} L{1:g}".format(diameter, length))
+      fileNames.append(fileName)
+  return fileNames
@@ -0,0 +1,132 @@
+"""
+Plan-only export of a planning trial: what was planned, without the data it was planned on.
+
+A plan is two small files next to each other: <name>.plan.json describes the screws (number, transform name, model file,
+diameter and length, color) and the digests of the CT volume and models the plan refers to; <name>.plan.npz holds the
+matrices (screw numbers, Screw-N_T matrices to their parent and to world, Spine_T). Writing a plan takes milliseconds and
+a few kilobytes, where a .mrb scene re-compresses the CT and every mesh. The digests tell which data a plan belongs to:
+the same CT or model loaded again gives the same digest.
+"""
+import collections
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from . import screws
+
+PLAN_VERSION = 1
+PLAN_EXTENSION = ".plan.json"
+PLAN_ARRAYS_EXTENSION = ".plan.npz"
+
+# A screw of the plan: number, model file name, (r, g, b) color, 4x4 matrix to its parent and to world
+PlannedScrew = collections.namedtuple("PlannedScrew", ["number", "modelName", "color", "matrix", "matrixToWorld"])
+
+
+def arrayDigest(*arrays):
+  """
+  Hexadecimal digest of the type, shape and content of arrays (e.g. the voxels of a volume, or the points and triangles of a mesh).
+  """
+  digest = hashlib.blake2b(digest_size=16)
+  for array in arrays:
+    array = np.ascontiguousarray(array)
+    digest.update("{0}{1}".format(array.dtype.str, array.shape).encode("ascii"))
+    digest.update(memoryview(array).cast("B"))
+  return digest.hexdigest()
+
+
+class DigestCache:
+  """
+  Least recently used cache of array digests, identified by a key (such as the node ID) and the modified time of the data:
+  the digest of a large CT is only computed again if its voxels changed.
+  """
+
+  def __init__(self, maximumNumberOfEntries=64):
+    self.maximumNumberOfEntries = maximumNumberOfEntries
+    self._entries = collections.OrderedDict()
+
+  def get(self, key, modifiedTime, getArrays):
+    """
+    Return the digest of the arrays returned by getArrays(), which is only called if there is no valid entry.
+    """
+    entry = self._entries.get(key)
+    if entry is not None and entry[0] == modifiedTime:
+      self._entries.move_to_end(key)
+      return entry[1]
+    digest = arrayDigest(*getArrays())
+    self._entries[key] = (modifiedTime, digest)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.maximumNumberOfEntries:
+      self._entries.popitem(last=False)
+    return digest
+
+
+def planPaths(basePath):
+  """
+  Return the (.plan.json, .plan.npz) paths of a plan, given its path without extension (or the path of the .mrb it goes with).
+  """
+  if basePath.lower().endswith(".mrb"):
+    basePath = basePath[:-len(".mrb")]
+  return basePath + PLAN_EXTENSION, basePath + PLAN_ARRAYS_EXTENSION
+
+
+def _replaceAtomically(path, write):
+  temporaryPath = "{0}.{1}.tmp".format(path, os.getpid())
+  with open(temporaryPath, "wb") as temporaryFile:
+    write(temporaryFile)
+  os.replace(temporaryPath, path)
+
+
+def writePlan(basePath, plannedScrews, spineMatrix=None, digests=None, description=None):
+  """
+  Write a plan and return its (.plan.json, .plan.npz) paths.
+  digests: {"ct": ..., "spineModel": ..., ...} digests of the data the plan refers to (see arrayDigest).
+  description: other information about the trial (patient and user IDs, date, scene file...).
+  The arrays are written first, so a plan document always refers to complete arrays.
+  """
+  plannedScrews = sorted(plannedScrews, key=lambda plannedScrew: plannedScrew.number)
+  jsonPath, arraysPath = planPaths(basePath)
+  arrays = {
+    "screwNumbers": np.array([plannedScrew.number for plannedScrew in plannedScrews], dtype=np.int32),
+    "screwMatrices": np.array([plannedScrew.matrix for plannedScrew in plannedScrews], dtype=np.float64).reshape(-1, 4, 4),
+    "screwMatricesToWorld": np.array([plannedScrew.matrixToWorld for plannedScrew in plannedScrews], dtype=np.float64).reshape(-1, 4, 4),
+  }
+  if spineMatrix is not None:
+    arrays["spineMatrix"] = np.asarray(spineMatrix, dtype=np.float64).reshape(4, 4)
+  _replaceAtomically(arraysPath, lambda arraysFile: np.savez(arraysFile, **arrays))
+
+  document = {
+    "version": PLAN_VERSION,
+    "description": dict(description or {}),
+    "digests": dict(digests or {}),
+    "arrays": os.path.basename(arraysPath),
+    "screws": [],
+  }
+  for plannedScrew in plannedScrews:
+    size = screws.parseScrewSize(plannedScrew.modelName)
+    document["screws"].append({
+      "number": plannedScrew.number,
+      "transform": screws.screwTransformName(plannedScrew.number),
+      "modelName": plannedScrew.modelName,
+      "diameter": size[0] if size else None,
+      "length": size[1] if size else None,
+      "color": list(plannedScrew.color) if plannedScrew.color is not None else None,
+    })
+  encodedDocument = json.dumps(document, indent=1).encode("utf-8")
+  _replaceAtomically(jsonPath, lambda jsonFile: jsonFile.write(encodedDocument))
+  return jsonPath, arraysPath
+
+
+def readPlan(path):
+  """
+  Return the (document, arrays) of a plan, given its .plan.json path (or its path without extension).
+  """
+  jsonPath = path if path.endswith(PLAN_EXTENSION) else planPaths(path)[0]
+  with open(jsonPath, "r", encoding="utf-8") as jsonFile:
+    document = json.load(jsonFile)
+  if document.get("version") != PLAN_VERSION:
+    raise ValueError("Unsupported plan version {0}: {1}".format(document.get("version"), jsonPath))
+  with np.load(os.path.join(os.path.dirname(jsonPath), document["arrays"]), allow_pickle=False) as arraysFile:
+    arrays = {name: arraysFile[name] for name in arraysFile.files}
+  return document, arrays
@@ -0,0 +1,336 @@
+"""
+Append-only journal of the plan edits of a session, to restore the plan after a crash without saving the scene.
+
+Every screw edit is appended as a small binary record: SPEC (screw model file and color, when a screw model is loaded),
+TRANSFORM (3x4 float32 matrix of Screw-N_T) and REMOVE. A cleanly ended session ends with a CLOSE record, so a journal
+without it belongs to a session that crashed. Each record carries its length and a CRC32, so replay stops at a record
+torn by the crash and keeps everything before it.
+
+PlanJournal buffers the records and a background thread writes them in batches, fsyncing at most once per flush
+interval. Consecutive TRANSFORM records of a screw that are not written yet are coalesced into the latest one, and a
+matrix equal to the last one written is skipped, so a screw streamed from HoloLens at 60 Hz costs at most one record
+(67 bytes) per flush interval while it moves, and nothing while it stays still.
+
+While its session runs, a journal has a lock file next to it (JOURNAL_LOCK_EXTENSION) that the session keeps locked
+(fcntl.flock on POSIX, msvcrt.locking on Windows). The operating system releases the lock when the process ends, even
+if it crashes, so a journal whose lock file can be locked is not being written anymore.
+"""
+import collections
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+  import msvcrt
+except ImportError:  # POSIX
+  msvcrt = None
+  import fcntl
+
+JOURNAL_MAGIC = b"PSPJRN01"
+JOURNAL_EXTENSION = ".pspjournal"
+JOURNAL_LOCK_EXTENSION = ".lock"
+
+SPEC, TRANSFORM, REMOVE, CLOSE = 1, 2, 3, 4
+_RECORD_HEADER = struct.Struct("<HBId")  # record length (header, payload and CRC), type, screw number, time
+_CRC = struct.Struct("<I")
+_TRANSFORM_PAYLOAD = struct.Struct("<12f")
+_SPEC_PAYLOAD = struct.Struct("<3fB")  # color, then model file name (length, UTF-8 bytes)
+
+# State of a screw after replay: number, model file name and (r, g, b) color (None if no SPEC), 4x4 matrix (None if no TRANSFORM)
+JournalScrew = collections.namedtuple("JournalScrew", ["number", "modelName", "color", "matrix"])
+
+# Result of a replay: the header dictionary, the screws by number, the number of valid records, the size of the valid
+# part of the file, and whether the session was closed cleanly
+JournalReplay = collections.namedtuple("JournalReplay", ["header", "screws", "recordCount", "validSize", "closed"])
+
+
+def _packRecord(recordType, screwNumber, payload=b"", recordTime=None):
+  header = _RECORD_HEADER.pack(_RECORD_HEADER.size + len(payload) + _CRC.size, recordType, screwNumber,
+    time.time() if recordTime is None else recordTime)
+  return header + payload + _CRC.pack(zlib.crc32(header + payload))
+
+
+def _packSpec(modelName, color):
+  encodedName = (modelName or "").encode("utf-8")[:255]
+  return _SPEC_PAYLOAD.pack(*(tuple(color) if color is not None else (-1.0, -1.0, -1.0)), len(encodedName)) + encodedName
+
+
+def _transformRows(matrix):
+  return np.asarray(matrix, dtype=np.float32).reshape(4, 4)[:3].copy()
+
+
+def _writeHeader(journalFile, description):
+  encodedHeader = json.dumps(dict(description or {}, pid=os.getpid())).encode("utf-8")
+  journalFile.write(JOURNAL_MAGIC + _CRC.pack(len(encodedHeader)) + encodedHeader)
+
+
+def journalLockPath(path):
+  return path + JOURNAL_LOCK_EXTENSION
+
+
+def _tryLock(lockFile):
+  """
+  Lock an open file without waiting. Return False if another open file (of this or another process) holds the lock.
+  """
+  try:
+    if msvcrt is not None:
+      lockFile.seek(0)
+      msvcrt.locking(lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+      fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return True
+  except OSError:
+    return False
+
+
+def _unlock(lockFile):
+  if msvcrt is not None:
+    lockFile.seek(0)
+    msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+  else:
+    fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+
+
+def _removeLockFile(path):
+  try:
+    os.remove(journalLockPath(path))
+  except FileNotFoundError:
+    pass
+  except OSError as error:  # e.g. open by a process checking it, on Windows
+    logging.warning("Could not delete plan journal lock {0}: {1}".format(journalLockPath(path), error))
+
+
+def _readHeader(data, path):
+  if not data.startswith(JOURNAL_MAGIC) or len(data) < len(JOURNAL_MAGIC) + _CRC.size:
+    raise ValueError("Not a plan journal: {0}".format(path))
+  headerLength = _CRC.unpack_from(data, len(JOURNAL_MAGIC))[0]
+  headerEnd = len(JOURNAL_MAGIC) + _CRC.size + headerLength
+  return json.loads(data[len(JOURNAL_MAGIC) + _CRC.size:headerEnd].decode("utf-8")), headerEnd
+
+
+class PlanJournal:
+  """
+  Journal of the session being planned. The record methods only buffer the record, so they can be called from the main
+  thread for every transform update; the records reach the disk within flushInterval seconds.
+  """
+
+  def __init__(self, path, description=None, flushInterval=1.0):
+    self.path = path
+    self.flushInterval = flushInterval
+    self.writtenCount = 0
+    self.skippedCount = 0  # TRANSFORM records coalesced or equal to the last matrix written
+    self.syncCount = 0
+    self._pending = []  # [record type, screw number, payload, time]
+    self._pendingTransforms = {}  # index in _pending of the TRANSFORM record not written yet, by screw number
+    self._lastTransforms = {}  # last matrix recorded, by screw number
+    self._condition = threading.Condition()
+    self._stopRequested = False
+    self._lockFile = open(journalLockPath(path), "wb")
+    if not _tryLock(self._lockFile):
+      logging.warning("Could not lock {0}: the journal may be replayed while this session runs".format(journalLockPath(path)))
+    self._file = open(path, "wb")
+    _writeHeader(self._file, description)
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self._thread = threading.Thread(target=self._run, name="PlanJournal", daemon=True)
+    self._thread.start()
+
+  def _append(self, recordType, screwNumber, payload):
+    with self._condition:
+      self._pending.append([recordType, screwNumber, payload, time.time()])
+      self._pendingTransforms.pop(screwNumber, None)  # later transforms must stay after this record
+      self._condition.notify()
+
+  def recordSpec(self, screwNumber, modelName, color):
+    self._append(SPEC, screwNumber, _packSpec(modelName, color))
+
+  def recordRemove(self, screwNumber):
+    self._lastTransforms.pop(screwNumber, None)
+    self._append(REMOVE, screwNumber, b"")
+
+  def recordTransform(self, screwNumber, matrix):
+    rows = _transformRows(matrix)
+    lastRows = self._lastTransforms.get(screwNumber)
+    if lastRows is not None and np.array_equal(rows, lastRows):
+      self.skippedCount += 1
+      return
+    self._lastTransforms[screwNumber] = rows
+    payload = _TRANSFORM_PAYLOAD.pack(*rows.ravel())
+    with self._condition:
+      pendingIndex = self._pendingTransforms.get(screwNumber)
+      if pendingIndex is not None:
+        self._pending[pendingIndex][2:] = [payload, time.time()]
+        self.skippedCount += 1
+        return
+      self._pendingTransforms[screwNumber] = len(self._pending)
+      self._pending.append([TRANSFORM, screwNumber, payload, time.time()])
+      self._condition.notify()
+
+  def close(self):
+    """
+    Write the buffered records and a CLOSE record (the session ended cleanly), then close the file and delete its lock file.
+    """
+    if self._thread is None:
+      return
+    with self._condition:
+      self._stopRequested = True
+      self._condition.notify()
+    self._thread.join()
+    self._thread = None
+    self._file.close()
+    try:
+      _unlock(self._lockFile)
+    except OSError:
+      pass  # not locked
+    self._lockFile.close()
+    _removeLockFile(self.path)
+
+  def _takePending(self):
+    with self._condition:
+      pending, self._pending = self._pending, []
+      self._pendingTransforms = {}
+      return pending
+
+  def _write(self, records):
+    try:
+      self._file.write(b"".join(_packRecord(*record) for record in records))
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self.writtenCount += len(records)
+      self.syncCount += 1
+    except (OSError, ValueError) as error:
+      logging.error("Failed to write {0} records to {1}: {2}".format(len(records), self.path, error))
+
+  def _run(self):
+    while True:
+      with self._condition:
+        while not self._pending and not self._stopRequested:
+          self._condition.wait()
+        stopRequested = self._stopRequested
+      records = self._takePending()
+      if stopRequested:
+        self._write(records + [[CLOSE, 0, b"", time.time()]])
+        return
+      self._write(records)
+      # Bound the fsync rate: records arriving meanwhile are written (and coalesced) together
+      with self._condition:
+        self._condition.wait_for(lambda: self._stopRequested, self.flushInterval)
+
+
+def replayJournal(path):
+  """
+  Read a journal and return the JournalReplay of its valid records (up to the first torn or corrupted one).
+  """
+  with open(path, "rb") as journalFile:
+    data = journalFile.read()
+  header, offset = _readHeader(data, path)
+  screwStates = {}
+  recordCount = 0
+  closed = False
+  while offset + _RECORD_HEADER.size + _CRC.size <= len(data):
+    recordLength, recordType, screwNumber, _ = _RECORD_HEADER.unpack_from(data, offset)
+    recordEnd = offset + recordLength
+    if recordLength < _RECORD_HEADER.size + _CRC.size or recordEnd > len(data):
+      break
+    payloadEnd = recordEnd - _CRC.size
+    if _CRC.unpack_from(data, payloadEnd)[0] != zlib.crc32(data[offset:payloadEnd]):
+      break
+    payload = data[offset + _RECORD_HEADER.size:payloadEnd]
+    if recordType == SPEC:
+      red, green, blue, nameLength = _SPEC_PAYLOAD.unpack_from(payload)
+      modelName = payload[_SPEC_PAYLOAD.size:_SPEC_PAYLOAD.size + nameLength].decode("utf-8") or None
+      state = screwStates.get(screwNumber, JournalScrew(screwNumber, None, None, None))
+      screwStates[screwNumber] = state._replace(modelName=modelName, color=(red, green, blue) if red >= 0 else None)
+    elif recordType == TRANSFORM:
+      matrix = np.eye(4)
+      matrix[:3] = np.array(_TRANSFORM_PAYLOAD.unpack(payload), dtype=np.float64).reshape(3, 4)
+      state = screwStates.get(screwNumber, JournalScrew(screwNumber, None, None, None))
+      screwStates[screwNumber] = state._replace(matrix=matrix)
+    elif recordType == REMOVE:
+      screwStates.pop(screwNumber, None)
+    elif recordType == CLOSE:
+      closed = True
+    recordCount += 1
+    offset = recordEnd
+  return JournalReplay(header, dict(sorted(screwStates.items())), recordCount, offset, closed)
+
+
+def closeJournal(path):
+  """
+  Mark a journal of a crashed session as handled: drop its torn tail, if any, append a CLOSE record and delete its
+  stale lock file.
+  """
+  replay = replayJournal(path)
+  _removeLockFile(path)
+  if replay.closed:
+    return replay
+  with open(path, "r+b") as journalFile:
+    journalFile.truncate(replay.validSize)
+    journalFile.seek(replay.validSize)
+    journalFile.write(_packRecord(CLOSE, 0))
+    journalFile.flush()
+    os.fsync(journalFile.fileno())
+  return replay
+
+
+def journalPaths(directory):
+  """
+  Journals of a directory, most recent first.
+  """
+  return sorted(glob.glob(os.path.join(directory, "*" + JOURNAL_EXTENSION)), key=os.path.getmtime, reverse=True)
+
+
+def isJournalActive(path):
+  """
+  Return True if the journal is still being written by a running session (this process or another one), that is if
+  its lock file is locked.
+  """
+  try:
+    lockFile = open(journalLockPath(path), "r+b")
+  except FileNotFoundError:
+    return False  # closed cleanly, or handled by closeJournal
+  except OSError:
+    return True  # e.g. being deleted
+  with lockFile:
+    if not _tryLock(lockFile):
+      return True
+    _unlock(lockFile)
+  return False
+
+
+def findUnfinishedJournals(directory):
+  """
+  Journals of a directory whose session did not end cleanly (and is not running anymore), most recent first.
+  """
+  unfinishedPaths = []
+  for path in journalPaths(directory):
+    try:
+      replay = replayJournal(path)
+      if not replay.closed and not isJournalActive(path):
+        unfinishedPaths.append(path)
+    except (OSError, ValueError) as error:
+      logging.warning("Ignoring plan journal {0}: {1}".format(path, error))
+  return unfinishedPaths
+
+
+def pruneJournals(directory, keepCount=20):
+  """
+  Delete the oldest journals of a directory (and their lock files), keeping the keepCount most recent ones and the
+  journals of running sessions.
+  """
+  for path in journalPaths(directory)[keepCount:]:
+    if isJournalActive(path):
+      continue
+    try:
+      os.remove(path)
+    except OSError as error:
+      logging.warning("Could not delete plan journal {0}: {1}".format(path, error))
+      continue
+    _removeLockFile(path)
@@ -0,0 +1,458 @@
+"""
+Slicer-side logic shared by the AR_Planner and Desktop_Planner module logic classes.
+
+This is the only module of the package that needs 3D Slicer (slicer, vtk and qt). It is not imported by the other
+submodules, and the package imports its submodules on first use, so the package can still be used outside 3D Slicer.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import qt
+import vtk
+import vtk.util.numpy_support
+
+import slicer
+
+from . import decimation, meshcache, objfile, planexport, planjournal, scenearchive, screws
+
+
+class PlannerLogicMixin:
+  """
+  Methods shared by the logic classes of both modules, to combine with ScriptedLoadableModuleLogic and VTKObservationMixin:
+  class Desktop_PlannerLogic(ScriptedLoadableModuleLogic, VTKObservationMixin, PlannerLogicMixin)
+  The __init__ of the logic class calls PlannerLogicMixin.__init__ after the other two.
+  """
+  LOD_IDLE_DELAY_MS = 300  # Models are shown at full detail again once the cameras are still for this long
+  SAVE_SCENE = "SaveScene"  # "true": save the full scene (.mrb) next to the plan-only export
+  SAVE_SCENE_IN_BACKGROUND = "SaveSceneInBackground"  # "true": compress the .mrb on a worker thread instead of blocking the GUI
+  SCENE_COMPRESSION_LEVEL = "SceneCompressionLevel"  # Zip compression level of the .mrb saved in the background, 0 (stored) to 9 (smallest)
+  SCENE_SAVE_PROGRESS_INTERVAL_MS = 200  # How often the progress of a background save is reported
+  PLAN_JOURNAL_FLUSH_INTERVAL = 1.0  # Seconds: the screw edits reach the plan journal on disk within this delay
+
+  def __init__(self):
+    self.planJournal = None  # Journal of the screw edits of this session (crash recovery), created by the first edit
+    self.modelLevelsOfDetail = {}  # vtkPolyData of each level of detail of the models shown with levels of detail, by model node ID
+    self.modelLevelOfDetail = {}  # Level shown by each of these models
+    self.levelOfDetailIntersectionModels = {}  # Coarse copy of each of these models that shows its slice intersections
+    self.levelOfDetailCameras = {}  # Last pose of each camera node observed for the levels of detail, by camera node ID
+    self.levelOfDetailTimer = qt.QTimer()
+    self.levelOfDetailTimer.setSingleShot(True)
+    self.levelOfDetailTimer.connect('timeout()', self.onLevelOfDetailTimerTimeout)
+    self.dataDigests = planexport.DigestCache()  # Digests of the CT and models referred to by the saved plans, by node ID
+    self.sceneArchiveWriter = None  # Compresses the scene saved in the background into the .mrb
+    self.sceneSaveProgressCallback = None
+    self.sceneSaveTimer = qt.QTimer()
+    self.sceneSaveTimer.setInterval(self.SCENE_SAVE_PROGRESS_INTERVAL_MS)
+    self.sceneSaveTimer.connect('timeout()', self.onSceneSaveTimerTimeout)
+    self.screwRegistry = screws.ScrewRegistry()  # Screw models and transforms of the scene, by screw number
+    self.observeScrewRegistry()
+
+  def observeScrewRegistry(self):
+    """
+    Index the screws of the scene, then keep the screw registry up to date with the nodes added to and removed from the scene.
+    """
+    self.rebuildScrewRegistry()
+    self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedToScrewRegistry)
+    self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeRemovedEvent, self.onNodeRemovedFromScrewRegistry)
+    self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndImportEvent, self.rebuildScrewRegistry)
+    self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.rebuildScrewRegistry)
+
+  def rebuildScrewRegistry(self, caller=None, event=None):
+    self.screwRegistry.rebuild(slicer.util.getNodesByClass("vtkMRMLModelNode") + slicer.util.getNodesByClass("vtkMRMLLinearTransformNode"))
+    for screwNumber in self.screwRegistry.numbers():
+      self.journalScrew(screwNumber)  # e.g. screws of a loaded scene
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAddedToScrewRegistry(self, caller, event, node):
+    if isinstance(node, (slicer.vtkMRMLModelNode, slicer.vtkMRMLLinearTransformNode)):
+      screwNumber = self.screwRegistry.addNode(node)
+      if screwNumber is not None and isinstance(node, slicer.vtkMRMLLinearTransformNode):
+        self.observePlanJournalTransform(node)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemovedFromScrewRegistry(self, caller, event, node):
+    if isinstance(node, (slicer.vtkMRMLModelNode, slicer.vtkMRMLLinearTransformNode)):
+      screwNumber = self.screwRegistry.removeNode(node)
+      if isinstance(node, slicer.vtkMRMLLinearTransformNode):
+        self.removeObserver(node, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onPlanJournalTransformModified)
+      if screwNumber is not None and screwNumber not in self.screwRegistry and self.planJournal is not None:
+        self.planJournal.recordRemove(screwNumber)
+
+  def getOrCreateScrewTransform(self, screwNumber):
+    """
+    Screw-N_T transform of screw N, found in the screw registry. An identity transform is only created if the registry has none.
+    """
+    screwEntry = self.screwRegistry.get(screwNumber)
+    if screwEntry is not None and screwEntry.transform is not None:
+      return screwEntry.transform
+    return slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", screws.screwTransformName(screwNumber))  # registered by onNodeAddedToScrewRegistry
+
+  def readModelPolyData(self, modelFilePath):
+    """
+    Read the mesh of a model file the same way as slicer.util.loadModel (including the LPS to RAS conversion), without adding it to the scene.
+    .obj files are read by objfile.loadObj, which parses the text with NumPy and keeps a memory-mapped binary copy next to the file
+    (<file>.obj.meshcache), so only the first load of a model file parses it; other formats are read by a model storage node.
+    """
+    if os.path.splitext(modelFilePath)[1].lower() == ".obj":
+      vertices, faces = objfile.loadObj(modelFilePath)
+      return self.polyDataFromTriangles(vertices, faces, objfile.objCoordinateSystem(modelFilePath) != "RAS")
+    storageNode = slicer.vtkMRMLModelStorageNode()
+    storageNode.SetFileName(modelFilePath)
+    modelNode = slicer.vtkMRMLModelNode()
+    if not storageNode.ReadData(modelNode):
+      raise RuntimeError("Failed to read model file: {0}".format(modelFilePath))
+    return modelNode.GetPolyData()
+
+  def addModelFromFile(self, modelFilePath):
+    """
+    Add a model node showing a model file, named after the file like slicer.util.loadModel does.
+    The file is read once per Slicer session (meshcache.sharedMeshCache, shared by both modules); the models of the same file share its geometry
+    through shallow copies. HardenTransform replaces the geometry of a model, so it does not modify the cached mesh.
+    """
+    polyData = vtk.vtkPolyData()
+    polyData.ShallowCopy(meshcache.sharedMeshCache.get(modelFilePath, self.readModelPolyData))
+    modelNode = slicer.modules.models.logic().AddModel(polyData)
+    modelNode.SetName(os.path.splitext(os.path.basename(modelFilePath))[0])
+    return modelNode
+
+  def polyDataFromTriangles(self, vertices, faces, convertFromLPS=True):
+    """
+    Build a triangle mesh with normals from (N, 3) vertices and (M, 3) 0-based faces. Model files are in LPS unless their header says RAS,
+    and the scene is in RAS: convertFromLPS flips the first two coordinates.
+    """
+    points = np.array(vertices, dtype=np.float32)
+    if convertFromLPS:
+      points[:, :2] *= -1
+    pointArray = vtk.vtkPoints()
+    pointArray.SetData(vtk.util.numpy_support.numpy_to_vtk(points, deep=True))
+    cellArray = vtk.vtkCellArray()
+    offsets = np.arange(0, 3 * len(faces) + 1, 3, dtype=np.int64)
+    connectivity = np.ascontiguousarray(faces, dtype=np.int64).ravel()
+    cellArray.SetData(vtk.util.numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=True),
+      vtk.util.numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=True))
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(pointArray)
+    polyData.SetPolys(cellArray)
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(polyData)
+    normals.SplittingOff()
+    normals.Update()
+    return normals.GetOutput()
+
+  def buildLevelsOfDetail(self, modelFilePath):
+    """
+    Return the meshes of the levels of detail of a model file (decimation.LEVEL_RATIOS of its triangles), from the full mesh to the coarsest.
+    """
+    fullPolyData = meshcache.sharedMeshCache.get(modelFilePath, self.readModelPolyData)
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(fullPolyData)
+    triangleFilter.Update()
+    triangles = triangleFilter.GetOutput()
+    vertices = vtk.util.numpy_support.vtk_to_numpy(triangles.GetPoints().GetData())
+    faces = vtk.util.numpy_support.vtk_to_numpy(triangles.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    levels = decimation.levelsOfDetail(vertices, faces)
+    return [fullPolyData] + [self.polyDataFromTriangles(levelVertices, levelFaces, convertFromLPS=False) for levelVertices, levelFaces in levels[1:]]
+
+  def showModelWithLevelsOfDetail(self, modelNode, modelFilePath):
+    """
+    Render a large model (e.g. the spine) with a coarse mesh while a camera moves and at full detail once the cameras are still for LOD_IDLE_DELAY_MS.
+    Its slice intersections are drawn from a coarse copy of the model (hidden, not saved with the scene) that follows its parent transform.
+    The levels are built once per model file and kept in meshcache.sharedMeshCache with the model mesh.
+    """
+    if modelNode.GetID() in self.modelLevelsOfDetail:
+      return
+    levels = []
+    for levelPolyData in meshcache.sharedMeshCache.get(modelFilePath, self.buildLevelsOfDetail, variant="levelsOfDetail"):
+      polyData = vtk.vtkPolyData()
+      polyData.ShallowCopy(levelPolyData)
+      levels.append(polyData)
+    self.modelLevelsOfDetail[modelNode.GetID()] = levels
+    self.modelLevelOfDetail[modelNode.GetID()] = 0
+    modelNode.SetAndObservePolyData(levels[0])
+    triangleCounts = [polyData.GetNumberOfPolys() for polyData in levels]
+    logging.info("Levels of detail of {0}: {1} triangles".format(modelNode.GetName(), triangleCounts))
+
+    intersectionLevel = decimation.chooseLevel(triangleCounts, decimation.INTERSECTION_TRIANGLE_BUDGET)
+    if intersectionLevel > 0:
+      intersectionNode = slicer.modules.models.logic().AddModel(levels[intersectionLevel])
+      intersectionNode.SetName(slicer.mrmlScene.GenerateUniqueName(modelNode.GetName() + "_SliceIntersection"))
+      intersectionNode.SetHideFromEditors(True)
+      intersectionNode.SetSaveWithScene(False)
+      intersectionNode.SetAndObserveTransformNodeID(modelNode.GetTransformNodeID())
+      intersectionNode.GetModelDisplayNode().SetColor(modelNode.GetModelDisplayNode().GetColor())
+      intersectionNode.GetModelDisplayNode().SetVisibility3D(False)
+      intersectionNode.GetModelDisplayNode().SetVisibility2D(True)
+      modelNode.GetModelDisplayNode().SetVisibility2D(False)
+      self.levelOfDetailIntersectionModels[modelNode.GetID()] = intersectionNode
+      self.addObserver(modelNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onLevelOfDetailModelTransformModified)
+
+    if not self.hasObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedForLevelsOfDetail):
+      self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedForLevelsOfDetail)
+      self.addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeRemovedEvent, self.onNodeRemovedForLevelsOfDetail)
+      self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.resetLevelsOfDetail)
+      for cameraNode in slicer.util.getNodesByClass("vtkMRMLCameraNode"):
+        self.observeCameraForLevelsOfDetail(cameraNode)
+
+  def observeCameraForLevelsOfDetail(self, cameraNode):
+    if cameraNode.GetID() in self.levelOfDetailCameras:
+      return
+    self.levelOfDetailCameras[cameraNode.GetID()] = None # camera pose, unknown yet
+    self.addObserver(cameraNode, vtk.vtkCommand.ModifiedEvent, self.onCameraModifiedForLevelsOfDetail)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAddedForLevelsOfDetail(self, caller, event, node):
+    if isinstance(node, slicer.vtkMRMLCameraNode):
+      self.observeCameraForLevelsOfDetail(node)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemovedForLevelsOfDetail(self, caller, event, node):
+    if isinstance(node, slicer.vtkMRMLCameraNode):
+      self.removeObserver(node, vtk.vtkCommand.ModifiedEvent, self.onCameraModifiedForLevelsOfDetail)
+      self.levelOfDetailCameras.pop(node.GetID(), None)
+    elif node.GetID() in self.modelLevelsOfDetail:
+      self.removeObserver(node, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onLevelOfDetailModelTransformModified)
+      del self.modelLevelsOfDetail[node.GetID()]
+      del self.modelLevelOfDetail[node.GetID()]
+      intersectionNode = self.levelOfDetailIntersectionModels.pop(node.GetID(), None)
+      if intersectionNode is not None and intersectionNode.GetScene() is not None:
+        slicer.mrmlScene.RemoveNode(intersectionNode)
+
+  def resetLevelsOfDetail(self, caller=None, event=None):
+    """
+    Forget the models shown with levels of detail and stop observing the cameras (e.g. when the scene is closed).
+    """
+    self.levelOfDetailTimer.stop()
+    self.removeObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAddedForLevelsOfDetail)
+    self.removeObserver(slicer.mrmlScene, slicer.mrmlScene.NodeRemovedEvent, self.onNodeRemovedForLevelsOfDetail)
+    self.removeObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.resetLevelsOfDetail)
+    for cameraID in self.levelOfDetailCameras:
+      cameraNode = slicer.mrmlScene.GetNodeByID(cameraID)
+      if cameraNode is not None:
+        self.removeObserver(cameraNode, vtk.vtkCommand.ModifiedEvent, self.onCameraModifiedForLevelsOfDetail)
+    for modelID in self.modelLevelsOfDetail:
+      modelNode = slicer.mrmlScene.GetNodeByID(modelID)
+      if modelNode is not None:
+        self.removeObserver(modelNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onLevelOfDetailModelTransformModified)
+    self.levelOfDetailCameras = {}
+    self.modelLevelsOfDetail = {}
+    self.modelLevelOfDetail = {}
+    self.levelOfDetailIntersectionModels = {}
+
+  def onCameraModifiedForLevelsOfDetail(self, caller, event):
+    """
+    Switch to the interactive levels while a camera moves. The camera is also modified when its clipping range is updated at each render,
+    so only changes of its pose and zoom count as motion.
+    """
+    cameraPose = caller.GetPosition() + caller.GetFocalPoint() + caller.GetViewUp() + (caller.GetViewAngle(), caller.GetParallelScale())
+    if self.levelOfDetailCameras.get(caller.GetID()) == cameraPose:
+      return
+    isFirstPose = self.levelOfDetailCameras.get(caller.GetID()) is None
+    self.levelOfDetailCameras[caller.GetID()] = cameraPose
+    if isFirstPose:
+      return
+    self.setInteractiveLevelOfDetail(True)
+    self.levelOfDetailTimer.start(self.LOD_IDLE_DELAY_MS)
+
+  def onLevelOfDetailTimerTimeout(self):
+    self.setInteractiveLevelOfDetail(False)
+
+  def setInteractiveLevelOfDetail(self, interactive):
+    """
+    Show the models with levels of detail at the interactive level (decimation.INTERACTIVE_TRIANGLE_BUDGET), or at full detail.
+    """
+    for modelID, levels in self.modelLevelsOfDetail.items():
+      level = decimation.chooseLevel([polyData.GetNumberOfPolys() for polyData in levels], decimation.INTERACTIVE_TRIANGLE_BUDGET) if interactive else 0
+      modelNode = slicer.mrmlScene.GetNodeByID(modelID)
+      if modelNode is None or self.modelLevelOfDetail[modelID] == level:
+        continue
+      modelNode.SetAndObservePolyData(levels[level])
+      self.modelLevelOfDetail[modelID] = level
+
+  def onLevelOfDetailModelTransformModified(self, caller, event):
+    intersectionNode = self.levelOfDetailIntersectionModels.get(caller.GetID())
+    if intersectionNode is not None and intersectionNode.GetTransformNodeID() != caller.GetTransformNodeID():
+      intersectionNode.SetAndObserveTransformNodeID(caller.GetTransformNodeID())
+
+  def getNodeDigest(self, node):
+    """
+    Digest of the voxels of a volume or of the mesh of a model (see planexport.arrayDigest), or None. It is cached until the data is modified,
+    so the CT is only read once however many plans are saved.
+    """
+    if node is None:
+      return None
+    if isinstance(node, slicer.vtkMRMLVolumeNode):
+      imageData = node.GetImageData()
+      if imageData is None:
+        return None
+      return self.dataDigests.get(node.GetID(), imageData.GetMTime(), lambda: (slicer.util.arrayFromVolume(node),))
+    polyData = node.GetPolyData()
+    if polyData is None or polyData.GetPoints() is None:
+      return None
+    return self.dataDigests.get(node.GetID(), polyData.GetMTime(), lambda: (
+      vtk.util.numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()),
+      vtk.util.numpy_support.vtk_to_numpy(polyData.GetPolys().GetConnectivityArray())))
+
+  def savePlan(self, basePath, referenceNodes, description=None):
+    """
+    Write the plan-only export of the screws of the scene next to basePath (see planexport): <basePath>.plan.json with the screw numbers, model files,
+    sizes and colors and the digests of the CT, spine and screw models, and <basePath>.plan.npz with the Screw-N_T (and Spine_T, if any) matrices.
+    referenceNodes: (CT volume, spine model, Spine_T transform) nodes that the plan refers to, each of them None if missing.
+    Return the paths of both files.
+    """
+    plannedScrews = []
+    screwModelDigests = {}
+    for screwEntry in self.screwRegistry:
+      if screwEntry.transform is None:
+        continue
+      plannedScrews.append(planexport.PlannedScrew(screwEntry.number, screwEntry.modelName, screwEntry.color,
+        slicer.util.arrayFromTransformMatrix(screwEntry.transform), slicer.util.arrayFromTransformMatrix(screwEntry.transform, toWorld=True)))
+      if screwEntry.model is not None and screwEntry.modelName not in screwModelDigests:
+        screwModelDigests[screwEntry.modelName] = self.getNodeDigest(screwEntry.model)
+    volumeNode, spineModelNode, spineTransform = referenceNodes
+    digests = {
+      "ct": self.getNodeDigest(volumeNode),
+      "spineModel": self.getNodeDigest(spineModelNode),
+      "screwModels": screwModelDigests,
+    }
+    spineMatrix = slicer.util.arrayFromTransformMatrix(spineTransform) if spineTransform is not None else None
+    return planexport.writePlan(basePath, plannedScrews, spineMatrix, digests, description)
+
+  def isSceneSaving(self):
+    return self.sceneArchiveWriter is not None
+
+  def saveSceneInBackground(self, sceneSaveFilename, progressCallback=None):
+    """
+    Save the scene as a .mrb without blocking: the scene bundle (.mrml file and data files) is written uncompressed to a temporary folder,
+    which only takes a moment, then a worker thread compresses it into the .mrb (see scenearchive), with the SceneCompressionLevel zip level.
+    progressCallback(archiveWriter) is called every SCENE_SAVE_PROGRESS_INTERVAL_MS until the .mrb is written (archiveWriter.finished).
+    """
+    if self.isSceneSaving():
+      raise RuntimeError("The previous scene is still being saved: {0}".format(self.sceneArchiveWriter.archivePath))
+    bundleRoot = tempfile.mkdtemp(prefix=self.moduleName + "-")
+    bundleDirectory = os.path.join(bundleRoot, os.path.splitext(os.path.basename(sceneSaveFilename))[0])
+    os.makedirs(bundleDirectory)
+    scene = slicer.mrmlScene
+    sceneURL, sceneRootDirectory = scene.GetURL(), scene.GetRootDirectory()
+    for storableNode in slicer.util.getNodesByClass("vtkMRMLStorableNode"):
+      if storableNode.GetSaveWithScene() and storableNode.GetStorageNode() is None:
+        storableNode.AddDefaultStorageNode()
+    storageNodeCompressions = [(storageNode, storageNode.GetUseCompression()) for storageNode in slicer.util.getNodesByClass("vtkMRMLStorageNode")]
+    try:
+      for storageNode, _ in storageNodeCompressions:
+        storageNode.SetUseCompression(False) # compressed once, into the archive
+      if not slicer.app.applicationLogic().SaveSceneToSlicerDataBundleDirectory(bundleDirectory, None):
+        raise RuntimeError("Failed to write the scene to {0}".format(bundleDirectory))
+    except Exception:
+      shutil.rmtree(bundleRoot, ignore_errors=True)
+      raise
+    finally:
+      for storageNode, useCompression in storageNodeCompressions:
+        storageNode.SetUseCompression(useCompression)
+      scene.SetURL(sceneURL)
+      scene.SetRootDirectory(sceneRootDirectory)
+    compressionLevel = int(self.getParameterNode().GetParameter(self.SCENE_COMPRESSION_LEVEL))
+    self.sceneArchiveWriter = scenearchive.ArchiveWriter(bundleRoot, sceneSaveFilename, compressionLevel, removeSource=True, name="SceneArchiveWriter")
+    self.sceneSaveProgressCallback = progressCallback
+    self.sceneSaveTimer.start()
+
+  def onSceneSaveTimerTimeout(self):
+    archiveWriter = self.sceneArchiveWriter
+    if archiveWriter is None:
+      self.sceneSaveTimer.stop()
+      return
+    if archiveWriter.finished:
+      self.sceneSaveTimer.stop()
+      self.sceneArchiveWriter = None
+      if archiveWriter.error is None:
+        logging.info("Scene saved to: {0} ({1} bytes, {2:.1f} s in background)".format(archiveWriter.archivePath, archiveWriter.archiveBytes, archiveWriter.elapsedTime))
+      else:
+        logging.error("Scene saving failed: {0}".format(archiveWriter.error))
+    if self.sceneSaveProgressCallback is not None:
+      self.sceneSaveProgressCallback(archiveWriter)
+
+  def waitForSceneSave(self):
+    """
+    Wait until the scene being saved in the background is written (e.g. before Slicer exits).
+    """
+    if self.sceneArchiveWriter is not None:
+      self.sceneArchiveWriter.wait()
+      self.onSceneSaveTimerTimeout()
+
+  def getPlanJournalDirectory(self):
+    return os.path.join(slicer.app.cachePath, self.moduleName, "PlanJournal")
+
+  def getPlanJournal(self):
+    """
+    Journal of the screw edits of this session, created on first use. Journals of old sessions beyond the last 20 are deleted.
+    """
+    if self.planJournal is None:
+      journalDirectory = self.getPlanJournalDirectory()
+      os.makedirs(journalDirectory, exist_ok=True)
+      planjournal.pruneJournals(journalDirectory)
+      journalPath = os.path.join(journalDirectory, "{0}_{1}{2}".format(time.strftime("%Y%m%d_%H%M%S"), os.getpid(), planjournal.JOURNAL_EXTENSION))
+      self.planJournal = planjournal.PlanJournal(journalPath, {"module": self.moduleName, "startTime": time.strftime("%Y-%m-%d %H:%M:%S")},
+        self.PLAN_JOURNAL_FLUSH_INTERVAL)
+    return self.planJournal
+
+  def stopPlanJournal(self):
+    """
+    Close the journal of this session: it ended cleanly, so its screws will not be offered for recovery.
+    """
+    if self.planJournal is not None:
+      self.planJournal.close()
+      self.planJournal = None
+
+  def journalScrew(self, screwNumber):
+    """
+    Record the model file, color and transform of a screw in the plan journal, and follow its transform from now on.
+    """
+    entry = self.screwRegistry.get(screwNumber)
+    if entry is None:
+      return
+    if entry.modelName:
+      self.getPlanJournal().recordSpec(screwNumber, entry.modelName, entry.color)
+    if entry.transform is not None:
+      self.observePlanJournalTransform(entry.transform)
+
+  def observePlanJournalTransform(self, transformNode):
+    if not self.hasObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onPlanJournalTransformModified):
+      self.addObserver(transformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onPlanJournalTransformModified)
+    self.onPlanJournalTransformModified(transformNode, None)
+
+  def onPlanJournalTransformModified(self, caller, event):
+    """
+    Record the new matrix of a screw transform (to its parent), e.g. moved by the Desktop_Planner buttons or streamed from HoloLens
+    for every pose: the journal coalesces the records and skips the unchanged matrices.
+    """
+    screwNumber = screws.parseScrewNumber(caller.GetName())
+    if screwNumber is not None:
+      self.getPlanJournal().recordTransform(screwNumber, slicer.util.arrayFromTransformMatrix(caller))
+
+  def findPlanToRecover(self):
+    """
+    Return the planjournal.JournalReplay of the most recent session that did not end cleanly and had screws, or None.
+    The journals of all the sessions that did not end cleanly are closed, so they are offered only once.
+    """
+    journalDirectory = self.getPlanJournalDirectory()
+    if not os.path.isdir(journalDirectory):
+      return None
+    journalReplay = None
+    for journalPath in planjournal.findUnfinishedJournals(journalDirectory):
+      replay = planjournal.closeJournal(journalPath)
+      if journalReplay is None and replay.screws:
+        journalReplay = replay
+    return journalReplay
+
+
+  def restorePlan(self, journalReplay, restoreScrew):
+    """
+    Recreate the screws of a plan journal and return the restored screw numbers.
+    restoreScrew(journalScrew) recreates a screw (planjournal.JournalScrew) in the scene and returns True if it was restored.
+    """
+    restoredNumbers = [journalScrew.number for journalScrew in journalReplay.screws.values() if restoreScrew(journalScrew)]
+    logging.info("Restored {0} screws from {1}".format(len(restoredNumbers), journalReplay.header))
+    return restoredNumbers
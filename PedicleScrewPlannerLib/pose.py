@@ -0,0 +1,40 @@
+"""
+Pose model of the translate/rotate controls: a pose is a translation (R, A, S in millimeters) followed by a rotation
+about X, then about the rotated Y axis (in degrees), like vtkTransform Translate, RotateX, RotateY. It is how the
+Desktop_Planner sliders and buttons place the selected screw, and how AR_Planner places the initial image slice.
+
+Only the standard library is used, so this module imports in a few milliseconds. Matrices are 4x4 nested lists;
+functions that take a matrix also accept NumPy arrays (e.g. slicer.util.arrayFromTransformMatrix).
+"""
+import math
+
+
+def poseMatrix(translation, rotationX, rotationY):
+  """
+  4x4 matrix of the pose: translation, then rotationX degrees about X, then rotationY degrees about the rotated Y axis.
+  """
+  cosX, sinX = math.cos(math.radians(rotationX)), math.sin(math.radians(rotationX))
+  cosY, sinY = math.cos(math.radians(rotationY)), math.sin(math.radians(rotationY))
+  return [
+    [cosY, 0.0, sinY, float(translation[0])],
+    [sinX * sinY, cosX, -sinX * cosY, float(translation[1])],
+    [-cosX * sinY, sinX, cosX * cosY, float(translation[2])],
+    [0.0, 0.0, 0.0, 1.0],
+  ]
+
+
+def poseFromMatrix(matrix):
+  """
+  (translation, rotationX, rotationY) of a matrix, the inverse of poseMatrix (angles in (-180, 180]). A rotation about Z,
+  which poseMatrix does not make, is not represented: the angles are then only an approximation.
+  """
+  rotationX = math.degrees(math.atan2(matrix[2][1], matrix[1][1]))
+  rotationY = math.degrees(math.atan2(matrix[0][2], matrix[0][0]))
+  return [float(matrix[row][3]) for row in range(3)], rotationX, rotationY
+
+
+def moveAlongAxis(translation, matrix, distance, axis=2):
+  """
+  Translation moved by distance millimeters along an axis of the pose matrix (2: Z, the axis of a screw, "in-out").
+  """
+  return [float(translation[row]) + float(matrix[row][axis]) * distance for row in range(3)]
@@ -0,0 +1,87 @@
+"""
+Multi-resolution (mip-map style) pyramid of a volume, for reslicing at coarse output spacings.
+
+Level L is the volume downsampled by 2^L along every axis with a 2x2x2 box filter. Sampling
+a 1 mm/pixel reslice from the level whose voxels are closest to 1 mm reads far less memory than
+sampling the full resolution volume, and the box filter also avoids aliasing.
+"""
+import numpy as np
+
+from . import windowing
+
+
+def downsample2(imageArray, slabBytes=windowing.DEFAULT_SLAB_BYTES):
+  """
+  Downsample a KJI volume array by 2 along every axis (mean of 2x2x2 blocks), one slab at a time.
+  An odd last row, column or slice is dropped. The result keeps the scalar type of the input.
+  """
+  outputShape = tuple(size // 2 for size in imageArray.shape)
+  if min(outputShape) < 1:
+    raise ValueError("Volume of shape {0} is too small to be downsampled".format(imageArray.shape))
+  out = np.empty(outputShape, dtype=imageArray.dtype)
+  rows, columns = 2 * outputShape[1], 2 * outputShape[2]
+  step = windowing.slabSize((2,) + imageArray.shape[1:], 4, slabBytes)
+  for start in range(0, outputShape[0], step):
+    stop = min(start + step, outputShape[0])
+    slab = imageArray[2 * start:2 * stop, :rows, :columns].astype(np.float32)
+    blocks = slab.reshape(stop - start, 2, outputShape[1], 2, outputShape[2], 2)
+    mean = blocks.mean(axis=(1, 3, 5))
+    if np.issubdtype(out.dtype, np.integer):
+      np.rint(mean, out=mean)
+    out[start:stop] = mean
+  return out
+
+
+def levelFromBaseIjkMatrix(level):
+  """
+  4x4 matrix that maps IJK coordinates of the full resolution volume to IJK coordinates of a pyramid level.
+  Voxel i of level L is the mean of base voxels [f*i, f*i + f - 1] with f = 2^L, so it is centered at f*i + (f-1)/2.
+  """
+  factor = 2 ** level
+  matrix = np.eye(4)
+  matrix[:3, :3] /= factor
+  matrix[:3, 3] = -(factor - 1) / 2.0 / factor
+  return matrix
+
+
+class VolumePyramid:
+  """
+  Full resolution volume array and its downsampled levels.
+  """
+
+  def __init__(self, imageArray, spacing, numberOfLevels=3):
+    """
+    :param imageArray: KJI array of the full resolution volume (level 0, not copied)
+    :param spacing: IJK voxel spacing of the volume in mm
+    :param numberOfLevels: number of downsampled levels to build (2x, 4x, 8x...).
+      Fewer levels are built if the volume becomes too small.
+    """
+    self.spacing = np.asarray(spacing, dtype=np.float64)
+    self.levels = [imageArray]
+    for _ in range(int(numberOfLevels)):
+      if min(self.levels[-1].shape) < 4:
+        break
+      self.levels.append(downsample2(self.levels[-1]))
+
+  @property
+  def numberOfLevels(self):
+    return len(self.levels)
+
+  def levelSpacing(self, level):
+    return self.spacing * 2 ** level
+
+  def selectLevel(self, sampleSpacing):
+    """
+    Coarsest level whose voxels are not larger than the reslice sample spacing (in mm) along any axis.
+    """
+    selectedLevel = 0
+    for level in range(1, self.numberOfLevels):
+      if self.levelSpacing(level).max() <= sampleSpacing:
+        selectedLevel = level
+    return selectedLevel
+
+  def nbytes(self):
+    """
+    Memory used by the downsampled levels (level 0 is not owned by the pyramid).
+    """
+    return sum(levelArray.nbytes for levelArray in self.levels[1:])
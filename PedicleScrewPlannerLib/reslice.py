@@ -0,0 +1,123 @@
+"""
+Oblique reslicing of a volume array with NumPy only (no VTK), for batch exports, precomputation and tests.
+
+The conventions follow vtkImageReslice with an input of unit spacing and zero origin (the IJK space of
+the volume): output pixel (i, j) of a plane is the point origin + spacing * (extent[0] + i, extent[2] + j, 0)
+of the slice, which is mapped to IJK coordinates by the plane's ijkFromSlice 4x4 matrix and sampled there.
+Points more than half a voxel outside the volume get the background value; points within that border are sampled at
+the nearest edge of the volume, like vtkImageReslice with Border on (its default).
+NumPy is imported by the functions that use it, so that importing this module is immediate.
+"""
+from . import windowing
+
+INTERPOLATION_MODES = ("nearest", "linear")
+
+
+def outputShape(outputExtent):
+  """
+  (rows, columns) of a plane with the given VTK extent [iMin, iMax, jMin, jMax, 0, 0].
+  """
+  return outputExtent[3] - outputExtent[2] + 1, outputExtent[1] - outputExtent[0] + 1
+
+
+def slicePoints(outputExtent, outputSpacing, outputOrigin=(0.0, 0.0, 0.0)):
+  """
+  Homogeneous slice coordinates of the pixels of a plane, as a (4, rows * columns) array (row-major pixel order).
+  """
+  import numpy as np
+  rows, columns = outputShape(outputExtent)
+  x = outputOrigin[0] + outputSpacing[0] * np.arange(outputExtent[0], outputExtent[1] + 1, dtype=np.float64)
+  y = outputOrigin[1] + outputSpacing[1] * np.arange(outputExtent[2], outputExtent[3] + 1, dtype=np.float64)
+  points = np.empty((4, rows, columns))
+  points[0] = x[np.newaxis, :]
+  points[1] = y[:, np.newaxis]
+  points[2] = outputOrigin[2]
+  points[3] = 1.0
+  return points.reshape(4, -1)
+
+
+def _sampleNearest(imageArray, ijk):
+  import numpy as np
+  index = np.floor(ijk + 0.5).astype(np.intp)
+  for axis in range(3):
+    np.clip(index[axis], 0, imageArray.shape[2 - axis] - 1, out=index[axis])
+  return imageArray[index[2], index[1], index[0]].astype(np.float64)
+
+
+def _sampleLinear(imageArray, ijk):
+  import numpy as np
+  base = []
+  fraction = []
+  for axis in range(3):
+    size = imageArray.shape[2 - axis]
+    coordinate = np.clip(ijk[axis], 0, size - 1)
+    axisBase = np.minimum(np.floor(coordinate), max(size - 2, 0)).astype(np.intp)
+    base.append(axisBase)
+    fraction.append(coordinate - axisBase if size > 1 else np.zeros_like(coordinate))
+  i0, j0, k0 = base
+  fi, fj, fk = fraction
+  # Neighbour offsets are 0 along axes of size 1
+  di, dj, dk = (1 if imageArray.shape[2 - axis] > 1 else 0 for axis in range(3))
+  values = np.zeros(ijk.shape[1])
+  for offsetK, weightK in ((0, 1.0 - fk), (dk, fk)):
+    for offsetJ, weightJ in ((0, 1.0 - fj), (dj, fj)):
+      for offsetI, weightI in ((0, 1.0 - fi), (di, fi)):
+        values += weightK * weightJ * weightI * imageArray[k0 + offsetK, j0 + offsetJ, i0 + offsetI]
+  return values
+
+
+def resliceVolume(imageArray, ijkFromSliceMatrices, outputExtent, outputSpacing, outputOrigin=(0.0, 0.0, 0.0),
+    interpolation="linear", backgroundValue=0, outputType=None, out=None, slabBytes=windowing.DEFAULT_SLAB_BYTES):
+  """
+  Sample N oblique planes of a volume in one call.
+
+  :param imageArray: KJI volume array
+  :param ijkFromSliceMatrices: 4x4 matrix or (N, 4, 4) stack of matrices from slice to IJK coordinates
+  :param outputExtent: VTK extent of the planes [iMin, iMax, jMin, jMax, 0, 0]
+  :param outputSpacing: pixel spacing of the planes (x, y[, z]) in slice coordinates
+  :param outputOrigin: origin of the planes in slice coordinates
+  :param interpolation: "nearest" or "linear" (trilinear)
+  :param backgroundValue: value of the pixels that fall outside the volume
+  :param outputType: scalar type of the result (default: the type of the volume). Integer types are rounded and clamped.
+  :param out: optional (N, rows, columns) array to write into
+  :return: (N, rows, columns) array, or (rows, columns) if a single matrix was given
+  """
+  import numpy as np
+  if interpolation not in INTERPOLATION_MODES:
+    raise ValueError("Unknown interpolation mode: {0}".format(interpolation))
+  matrices = np.asarray(ijkFromSliceMatrices, dtype=np.float64)
+  singlePlane = matrices.ndim == 2
+  matrices = matrices.reshape(-1, 4, 4)
+  rows, columns = outputShape(outputExtent)
+  if out is None:
+    out = np.empty((len(matrices), rows, columns), dtype=outputType or imageArray.dtype)
+  elif out.shape != (len(matrices), rows, columns):
+    raise ValueError("Output array of shape {0} does not match {1}".format(out.shape, (len(matrices), rows, columns)))
+
+  points = slicePoints(outputExtent, outputSpacing, outputOrigin)
+  upperBounds = np.array(imageArray.shape[::-1], dtype=np.float64)[:, np.newaxis] - 1.0
+  tolerance = 0.5  # as vtkImageReslice with Border on: the half voxel around the volume is sampled (clamped to the edge)
+  sample = _sampleLinear if interpolation == "linear" else _sampleNearest
+  if np.issubdtype(out.dtype, np.integer):
+    typeInfo = np.iinfo(out.dtype)
+  else:
+    typeInfo = None
+
+  # Around 20 float64 temporaries per pixel: several planes are sampled together if they fit in a slab
+  pixelsPerChunk = max(columns, slabBytes // (20 * 8))
+  planesPerChunk = max(1, pixelsPerChunk // points.shape[1])
+  pixelsPerChunk = min(pixelsPerChunk, points.shape[1])
+  flatOut = out.reshape(len(matrices), -1)
+  for firstPlane in range(0, len(matrices), planesPerChunk):
+    lastPlane = min(firstPlane + planesPerChunk, len(matrices))
+    for start in range(0, points.shape[1], pixelsPerChunk):
+      stop = min(start + pixelsPerChunk, points.shape[1])
+      ijk = (matrices[firstPlane:lastPlane, :3] @ points[:, start:stop]).transpose(1, 0, 2).reshape(3, -1)
+      valid = np.all((ijk >= -tolerance) & (ijk <= upperBounds + tolerance), axis=0)
+      values = sample(imageArray, ijk)
+      values[~valid] = backgroundValue
+      if typeInfo is not None:
+        np.floor(values + 0.5, out=values)
+        np.clip(values, typeInfo.min, typeInfo.max, out=values)
+      flatOut[firstPlane:lastPlane, start:stop] = values.reshape(lastPlane - firstPlane, stop - start)
+  return out[0] if singlePlane else out
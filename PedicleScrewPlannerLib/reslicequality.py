@@ -0,0 +1,118 @@
+"""
+Adaptive quality of the CT reslice: coarse and fast while the image plane moves, refined once it settles.
+
+The output image always has the same size. In interactive quality it is sampled on a coarser grid
+(spacing multiplied by interactiveFactor) and upsampled with nearest neighbour to the output size.
+"""
+import math
+import time
+
+import numpy as np
+
+INTERACTIVE = "interactive"
+REFINED = "refined"
+
+INTERPOLATION_MODES = ("nearest", "linear", "cubic")
+
+
+def poseSpeed(previousMatrix, matrix, elapsedTime):
+  """
+  Return the (translation speed in mm/s, rotation speed in deg/s) between two 4x4 poses.
+  """
+  previousMatrix = np.asarray(previousMatrix, dtype=np.float64)
+  matrix = np.asarray(matrix, dtype=np.float64)
+  elapsedTime = max(float(elapsedTime), 1e-6)
+  translation = np.linalg.norm(matrix[:3, 3] - previousMatrix[:3, 3])
+  relativeRotation = previousMatrix[:3, :3].T @ matrix[:3, :3]
+  cosAngle = np.clip((np.trace(relativeRotation) - 1.0) / 2.0, -1.0, 1.0)
+  angle = math.degrees(math.acos(cosAngle))
+  return translation / elapsedTime, angle / elapsedTime
+
+
+def upsampleNearest(image, out):
+  """
+  Copy image into the larger array out, repeating each pixel along the last two axes (nearest neighbour).
+  Pixels that do not fit in out are cropped.
+  """
+  if image.shape == out.shape:
+    np.copyto(out, image, casting='unsafe')
+    return out
+  rowFactor = -(-out.shape[-2] // image.shape[-2])
+  columnFactor = -(-out.shape[-1] // image.shape[-1])
+  upsampled = np.repeat(np.repeat(image, rowFactor, axis=-2), columnFactor, axis=-1)
+  np.copyto(out, upsampled[..., :out.shape[-2], :out.shape[-1]], casting='unsafe')
+  return out
+
+
+class ResliceQualityPolicy:
+  """
+  Chooses the reslice quality from the motion of the image plane and provides the matching output geometry.
+
+  The plane is considered moving if its translation or rotation speed exceeds the thresholds.
+  Interactive quality is used while it moves and during settleTime seconds after the last motion.
+  """
+
+  def __init__(self, outputSize=(100, 100), spacing=1.0, interactiveFactor=1, interactiveInterpolation="linear",
+      refinedInterpolation="linear", translationSpeedThreshold=2.0, rotationSpeedThreshold=2.0, settleTime=0.2,
+      clock=time.perf_counter):
+    self.outputSize = tuple(int(size) for size in outputSize)
+    self.spacing = float(spacing)
+    self.interactiveFactor = max(1, int(interactiveFactor))
+    self.interactiveInterpolation = interactiveInterpolation
+    self.refinedInterpolation = refinedInterpolation
+    self.translationSpeedThreshold = translationSpeedThreshold
+    self.rotationSpeedThreshold = rotationSpeedThreshold
+    self.settleTime = settleTime
+    self.clock = clock
+    self._lastPose = None
+    self._lastPoseTime = None
+    self._lastMotionTime = None
+    for interpolation in (interactiveInterpolation, refinedInterpolation):
+      if interpolation not in INTERPOLATION_MODES:
+        raise ValueError("Unknown interpolation mode: {0}".format(interpolation))
+
+  def update(self, sliceToRasMatrix):
+    """
+    Record a new pose of the image plane. Return True if the plane is moving.
+    """
+    now = self.clock()
+    moving = False
+    if self._lastPose is not None:
+      translationSpeed, rotationSpeed = poseSpeed(self._lastPose, sliceToRasMatrix, now - self._lastPoseTime)
+      moving = translationSpeed > self.translationSpeedThreshold or rotationSpeed > self.rotationSpeedThreshold
+    if moving:
+      self._lastMotionTime = now
+    self._lastPose = np.array(sliceToRasMatrix, dtype=np.float64)
+    self._lastPoseTime = now
+    return moving
+
+  def timeUntilSettled(self):
+    """
+    Seconds until the plane is considered still (0 if it already is).
+    """
+    if self._lastMotionTime is None:
+      return 0.0
+    return max(0.0, self._lastMotionTime + self.settleTime - self.clock())
+
+  def quality(self):
+    """
+    Current reslice quality: INTERACTIVE or REFINED.
+    """
+    return INTERACTIVE if self.timeUntilSettled() > 0 else REFINED
+
+  def isRefinementNeeded(self):
+    """
+    Return True if the refined quality differs from the interactive one (otherwise no refinement pass is needed).
+    """
+    return self.interactiveFactor > 1 or self.interactiveInterpolation != self.refinedInterpolation
+
+  def outputGeometry(self, quality):
+    """
+    Return the (outputExtent, outputSpacing, interpolation) of the reslice for the given quality.
+    """
+    factor = self.interactiveFactor if quality == INTERACTIVE else 1
+    interpolation = self.interactiveInterpolation if quality == INTERACTIVE else self.refinedInterpolation
+    columns = -(-self.outputSize[0] // factor)
+    rows = -(-self.outputSize[1] // factor)
+    spacing = self.spacing * factor
+    return [0, columns - 1, 0, rows - 1, 0, 0], [spacing, spacing, 1.0], interpolation
@@ -0,0 +1,95 @@
+"""
+Background writing of scene archives (.mrb).
+
+A .mrb file is a zip archive of a scene bundle directory (the .mrml file and a Data folder). Writing the files of the
+bundle uncompressed is fast; compressing them is what takes seconds for a CT. ArchiveWriter zips a directory on a worker
+thread (zlib releases the GIL while it compresses, so the main thread keeps running) and reports its progress.
+The archive is written to a temporary file and renamed once complete, so a partial .mrb never exists.
+"""
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+CHUNK_SIZE = 2**20
+
+
+class ArchiveWriter:
+  """
+  Zips the files of sourceDirectory into archivePath on a worker thread, with paths relative to sourceDirectory.
+  compressionLevel: 0 (stored, fastest) to 9 (smallest). removeSource: delete sourceDirectory once done (or failed).
+  Poll progress, finished and error from the main thread, or wait().
+  """
+
+  def __init__(self, sourceDirectory, archivePath, compressionLevel=1, removeSource=False, name="ArchiveWriter"):
+    self.sourceDirectory = sourceDirectory
+    self.archivePath = archivePath
+    self.compressionLevel = min(max(int(compressionLevel), 0), 9)
+    self.removeSource = removeSource
+    self.totalBytes = 0
+    self.writtenBytes = 0
+    self.archiveBytes = 0
+    self.error = None
+    self.startTime = time.monotonic()
+    self.endTime = None
+    self._finished = threading.Event()
+    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+    self._thread.start()
+
+  @property
+  def finished(self):
+    return self._finished.is_set()
+
+  @property
+  def progress(self):
+    """
+    Fraction of the bytes of the source files written to the archive, in [0, 1].
+    """
+    if self.finished:
+      return 1.0
+    return self.writtenBytes / self.totalBytes if self.totalBytes else 0.0
+
+  @property
+  def elapsedTime(self):
+    return (self.endTime if self.endTime is not None else time.monotonic()) - self.startTime
+
+  def wait(self, timeout=None):
+    """
+    Wait until the archive is written. Return True if it is (successfully or not), False on timeout.
+    """
+    return self._finished.wait(timeout)
+
+  def _sourceFiles(self):
+    sourceFiles = []
+    for directory, directoryNames, fileNames in os.walk(self.sourceDirectory):
+      directoryNames.sort()
+      for fileName in sorted(fileNames):
+        path = os.path.join(directory, fileName)
+        sourceFiles.append((path, os.path.relpath(path, self.sourceDirectory).replace(os.sep, "/")))
+    return sourceFiles
+
+  def _run(self):
+    temporaryPath = "{0}.{1}.tmp".format(self.archivePath, os.getpid())
+    try:
+      sourceFiles = self._sourceFiles()
+      self.totalBytes = sum(os.path.getsize(path) for path, _ in sourceFiles)
+      compression = zipfile.ZIP_DEFLATED if self.compressionLevel > 0 else zipfile.ZIP_STORED
+      with zipfile.ZipFile(temporaryPath, "w", compression, compresslevel=self.compressionLevel or None) as archive:
+        for path, archiveName in sourceFiles:
+          # Opened by name, the entry takes the compression and compression level of the archive
+          with open(path, "rb") as sourceFile, archive.open(archiveName, "w", force_zip64=True) as archiveFile:
+            for chunk in iter(lambda: sourceFile.read(CHUNK_SIZE), b""):
+              archiveFile.write(chunk)
+              self.writtenBytes += len(chunk)
+      os.replace(temporaryPath, self.archivePath)
+      self.archiveBytes = os.path.getsize(self.archivePath)
+    except Exception as error:
+      self.error = error
+      if os.path.exists(temporaryPath):
+        os.remove(temporaryPath)
+    finally:
+      if self.removeSource:
+        shutil.rmtree(self.sourceDirectory, ignore_errors=True)
+      self.endTime = time.monotonic()
+      self._finished.set()
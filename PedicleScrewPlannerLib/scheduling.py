@@ -0,0 +1,112 @@
+"""
+Rate-limited scheduling of updates driven by incoming events (e.g. HoloLens plane poses).
+
+Events only mark an update as pending. Many events arriving before the update runs are coalesced
+into a single update, which reads the latest state when it runs. Updates never run more often than
+the target rate, so the work done per second (and the latency) is bounded whatever the event rate is.
+The scheduler does not own a timer: the caller runs runPending() after the delay returned by request()
+(for instance with a single-shot qt.QTimer).
+"""
+import time
+
+
+class CoalescingScheduler:
+  """
+  Coalesces update requests and runs the update callback at most targetRate times per second.
+
+  Counters:
+  - requestCount: number of update requests
+  - runCount: number of times the callback was run
+  - coalescedCount: requests merged into an update that was already pending
+  - droppedCount: pending updates discarded without running (cancel() or callback errors)
+  """
+
+  def __init__(self, callback, targetRate=30.0, clock=time.perf_counter):
+    self.callback = callback
+    self.clock = clock
+    self.targetRate = targetRate
+    self.pending = False
+    self._lastRunTime = None
+    self.resetStatistics()
+
+  @property
+  def targetRate(self):
+    return self._targetRate
+
+  @targetRate.setter
+  def targetRate(self, rate):
+    """
+    Maximum number of updates per second. Zero or a negative rate means no limit.
+    """
+    self._targetRate = float(rate)
+    self.minimumInterval = 1.0 / self._targetRate if self._targetRate > 0 else 0.0
+
+  def resetStatistics(self):
+    self.requestCount = 0
+    self.runCount = 0
+    self.coalescedCount = 0
+    self.droppedCount = 0
+    self.lastRunDuration = 0.0
+    self.totalRunDuration = 0.0
+
+  def delay(self):
+    """
+    Seconds to wait before the next update is allowed to run.
+    """
+    if self._lastRunTime is None:
+      return 0.0
+    return max(0.0, self._lastRunTime + self.minimumInterval - self.clock())
+
+  def request(self):
+    """
+    Request an update.
+    Return the delay (in seconds) after which runPending() must be called,
+    or None if an update was already pending (and the request was coalesced into it).
+    """
+    self.requestCount += 1
+    if self.pending:
+      self.coalescedCount += 1
+      return None
+    self.pending = True
+    return self.delay()
+
+  def runPending(self):
+    """
+    Run the pending update, if any. Return True if the callback was run.
+    """
+    if not self.pending:
+      return False
+    self.pending = False
+    startTime = self.clock()
+    self._lastRunTime = startTime
+    try:
+      self.callback()
+    except Exception:
+      self.droppedCount += 1
+      raise
+    self.runCount += 1
+    self.lastRunDuration = self.clock() - startTime
+    self.totalRunDuration += self.lastRunDuration
+    return True
+
+  def cancel(self):
+    """
+    Discard the pending update.
+    """
+    if self.pending:
+      self.pending = False
+      self.droppedCount += 1
+
+  def statistics(self):
+    """
+    Return the counters as a dictionary.
+    """
+    return {
+      "targetRate": self.targetRate,
+      "requestCount": self.requestCount,
+      "runCount": self.runCount,
+      "coalescedCount": self.coalescedCount,
+      "droppedCount": self.droppedCount,
+      "lastRunDuration": self.lastRunDuration,
+      "meanRunDuration": self.totalRunDuration / self.runCount if self.runCount else 0.0,
+    }
@@ -0,0 +1,225 @@
+"""
+Screw naming and metadata conventions shared by the HoloLens application and both planner modules.
+
+A screw N is the model "Screw-N" placed by the transform "Screw-N_T". HoloLens sends with every screw
+transform the metadata ModelNumber (N), ModelName (model file, e.g. "D5L45.obj": diameter 5 mm,
+length 45 mm) and ModelColor ("r,g,b" in [0,1]), and with Image_T the number of screws (NumOfScrews).
+"""
+import collections
+import itertools
+import re
+
+SCREW_PREFIX = "Screw"
+MODEL_NAME_ATTRIBUTE = "ScrewModelName"  # Model file a screw model was loaded from
+MODEL_COLOR_ATTRIBUTE = "ScrewModelColor"  # "r,g,b" color of a screw model
+_SCREW_NAME_PATTERN = re.compile(r"^Screw-(\d+)(?:_T)?$")
+_SCREW_FILE_PATTERN = re.compile(r"^D(\d+(?:\.\d+)?)L(\d+(?:\.\d+)?)(?:\.obj)?$", re.IGNORECASE)
+
+# What a screw should look like: its number, model file name and color
+ScrewSpec = collections.namedtuple("ScrewSpec", ["number", "modelName", "color"])
+
+# Changes to go from the current screws to the desired ones (lists of ScrewSpec, and screw numbers for removed)
+ScrewDiff = collections.namedtuple("ScrewDiff", ["added", "modelChanged", "colorChanged", "removed"])
+
+
+def screwModelName(screwNumber):
+  return "{0}-{1}".format(SCREW_PREFIX, screwNumber)
+
+
+def screwTransformName(screwNumber):
+  return "{0}-{1}_T".format(SCREW_PREFIX, screwNumber)
+
+
+def parseScrewNumber(nodeName):
+  """
+  Return N for "Screw-N" or "Screw-N_T", None for any other name.
+  """
+  match = _SCREW_NAME_PATTERN.match(nodeName or "")
+  return int(match.group(1)) if match else None
+
+
+def parseScrewSize(modelName):
+  """
+  Return (diameter, length) in millimeters of a screw model file name such as "D5L45.obj", or None.
+  """
+  match = _SCREW_FILE_PATTERN.match(modelName or "")
+  return (float(match.group(1)), float(match.group(2))) if match else None
+
+
+def parseColor(colorText):
+  """
+  Parse a "r,g,b" color into a tuple of floats.
+  """
+  return tuple(float(component) for component in colorText.split(","))
+
+
+def formatColor(color):
+  return ",".join(str(float(component)) for component in color)
+
+
+def screwSpecFromMetadata(metadata):
+  """
+  ScrewSpec of a screw transform from its OpenIGTLink metadata (ModelNumber, ModelName, ModelColor),
+  given as a dictionary without the "OpenIGTLink." prefix.
+  """
+  return ScrewSpec(int(metadata["ModelNumber"]), metadata["ModelName"], parseColor(metadata["ModelColor"]))
+
+
+def diffScrews(currentScrews, desiredScrews):
+  """
+  Compare two {screw number: ScrewSpec} dictionaries and return the ScrewDiff that turns the current screws into the desired ones.
+  Screws whose model file changed must be reloaded, screws whose color only changed can be recolored in place.
+  """
+  added, modelChanged, colorChanged = [], [], []
+  for number, desiredScrew in sorted(desiredScrews.items()):
+    currentScrew = currentScrews.get(number)
+    if currentScrew is None:
+      added.append(desiredScrew)
+    elif currentScrew.modelName != desiredScrew.modelName:
+      modelChanged.append(desiredScrew)
+    elif currentScrew.color != desiredScrew.color:
+      colorChanged.append(desiredScrew)
+  removed = sorted(number for number in currentScrews if number not in desiredScrews)
+  return ScrewDiff(added, modelChanged, colorChanged, removed)
+
+
+def parseScrewNodeName(nodeName):
+  """
+  Return (N, True) for a screw transform "Screw-N_T", (N, False) for a screw model "Screw-N", None for any other name.
+  """
+  screwNumber = parseScrewNumber(nodeName)
+  if screwNumber is None:
+    return None
+  return screwNumber, nodeName.endswith("_T")
+
+
+class ScrewEntry:
+  """
+  The model and transform nodes of screw N. Its model file, size and color are read from the node attributes:
+  ScrewModelName/ScrewModelColor of the model (set when it is loaded), else the OpenIGTLink metadata of the transform.
+  """
+
+  MODEL_NAME_ATTRIBUTES = (MODEL_NAME_ATTRIBUTE, "OpenIGTLink.ModelName")
+  MODEL_COLOR_ATTRIBUTES = (MODEL_COLOR_ATTRIBUTE, "OpenIGTLink.ModelColor")
+
+  def __init__(self, number):
+    self.number = number
+    self.model = None
+    self.transform = None
+
+  def _attribute(self, attributeNames):
+    for node, attributeName in zip((self.model, self.transform), attributeNames):
+      value = node.GetAttribute(attributeName) if node is not None else None
+      if value:
+        return value
+    return None
+
+  @property
+  def modelName(self):
+    return self._attribute(self.MODEL_NAME_ATTRIBUTES)
+
+  @property
+  def size(self):
+    """
+    (diameter, length) in millimeters, or None if unknown.
+    """
+    return parseScrewSize(self.modelName)
+
+  @property
+  def color(self):
+    colorText = self._attribute(self.MODEL_COLOR_ATTRIBUTES)
+    return parseColor(colorText) if colorText else None
+
+  def spec(self):
+    return ScrewSpec(self.number, self.modelName, self.color)
+
+  def __repr__(self):
+    return "ScrewEntry({0}, model={1}, transform={2})".format(self.number, self.model is not None, self.transform is not None)
+
+
+class ScrewRegistry:
+  """
+  Index of the screws of a scene by number, so that screws are found without scanning the scene by name.
+  Nodes are duck-typed (GetName, GetAttribute): the planner modules add and remove the Slicer nodes from
+  scene observers, and register the models they rename into screws.
+  """
+
+  def __init__(self):
+    self._entries = {}
+
+  def clear(self):
+    self._entries.clear()
+
+  def rebuild(self, nodes):
+    self.clear()
+    for node in nodes:
+      self.addNode(node)
+
+  def addNode(self, node):
+    """
+    Index a screw model or transform node. Return its screw number, or None if it is not a screw node.
+    """
+    parsedName = parseScrewNodeName(node.GetName())
+    if parsedName is None:
+      return None
+    screwNumber, isTransform = parsedName
+    entry = self._entries.get(screwNumber)
+    if entry is None:
+      entry = self._entries[screwNumber] = ScrewEntry(screwNumber)
+    if isTransform:
+      entry.transform = node
+    else:
+      entry.model = node
+    return screwNumber
+
+  def removeNode(self, node):
+    """
+    Remove a node from the index (a screw without model nor transform is removed).
+    The entry is found from the node name, or by a search if the node was renamed since it was added.
+    """
+    parsedName = parseScrewNodeName(node.GetName())
+    candidates = [(parsedName[0], self._entries[parsedName[0]])] if parsedName and parsedName[0] in self._entries else []
+    for screwNumber, entry in itertools.chain(candidates, self._entries.items()):
+      if entry.model is node:
+        entry.model = None
+      elif entry.transform is node:
+        entry.transform = None
+      else:
+        continue
+      if entry.model is None and entry.transform is None:
+        del self._entries[screwNumber]
+      return screwNumber
+    return None
+
+  def get(self, screwNumber):
+    return self._entries.get(screwNumber)
+
+  def __contains__(self, screwNumber):
+    return screwNumber in self._entries
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __iter__(self):
+    """
+    Iterate over the screw entries by increasing number.
+    """
+    return iter([self._entries[screwNumber] for screwNumber in sorted(self._entries)])
+
+  def numbers(self):
+    return sorted(self._entries)
+
+  def models(self):
+    return {entry.number: entry.model for entry in self if entry.model is not None}
+
+  def transforms(self):
+    return {entry.number: entry.transform for entry in self if entry.transform is not None}
+
+  def nextNumber(self):
+    return max(self._entries, default=0) + 1
+
+  def summary(self):
+    """
+    One line per screw: number, model file and color, e.g. for logs.
+    """
+    return "\n".join("{0}: {1} {2}".format(screwModelName(entry.number), entry.modelName, entry.color) for entry in self)
@@ -0,0 +1,201 @@
+"""
+Compact binary recording of an AR planning session: the transforms received from HoloLens and the slices sent back.
+
+A log is a header of LOG_HEADER_SIZE bytes followed by fixed-size records, so it can be opened with
+numpy.memmap (openLog) and analysed or replayed without parsing and without loading it in memory.
+The header holds LOG_MAGIC and a JSON description of the record dtype, padded with spaces.
+Records are appended by a background thread; a log cut short (e.g. by a crash) is readable up to its
+last complete record.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+LOG_MAGIC = b"PSPLOG01"
+LOG_HEADER_SIZE = 4096
+LOG_EXTENSION = ".psplog"
+
+# Inbound transform: reception time (seconds since the epoch), node name, 4x4 matrix
+TRANSFORM_RECORD = np.dtype([("time", "<f8"), ("name", "S24"), ("matrix", "<f4", (4, 4))])
+MAX_TRANSFORM_NAME_LENGTH = TRANSFORM_RECORD["name"].itemsize
+
+
+def encodeTransformName(name):
+  """
+  Bytes of a transform name for the name field of the transform records. Raise ValueError if the name does not fit:
+  cut, it could not be told apart from other names.
+  """
+  encodedName = name.encode("ascii", "replace")
+  if len(encodedName) > MAX_TRANSFORM_NAME_LENGTH:
+    raise ValueError("Transform name longer than {0} characters: {1}".format(MAX_TRANSFORM_NAME_LENGTH, name))
+  return encodedName
+
+
+def sliceRecordDtype(shape, dtype):
+  """
+  Outbound slice record: send time (seconds since the epoch), frame sequence number, pixels.
+  """
+  return np.dtype([("time", "<f8"), ("sequence", "<u8"), ("pixels", np.dtype(dtype).newbyteorder("<"), tuple(shape))])
+
+
+def _writeHeader(logFile, recordDtype, description):
+  header = dict(description or {}, recordDtype=recordDtype.descr)
+  encodedHeader = LOG_MAGIC + json.dumps(header).encode("utf-8")
+  if len(encodedHeader) > LOG_HEADER_SIZE:
+    raise ValueError("Log header too long: {0} bytes".format(len(encodedHeader)))
+  logFile.write(encodedHeader.ljust(LOG_HEADER_SIZE, b" "))
+
+
+def readLogHeader(path):
+  """
+  Return the header dictionary of a log, with its record dtype as a numpy dtype.
+  """
+  with open(path, "rb") as logFile:
+    encodedHeader = logFile.read(LOG_HEADER_SIZE)
+  if not encodedHeader.startswith(LOG_MAGIC) or len(encodedHeader) < LOG_HEADER_SIZE:
+    raise ValueError("Not a session log: {0}".format(path))
+  header = json.loads(encodedHeader[len(LOG_MAGIC):].decode("utf-8"))
+  header["recordDtype"] = np.dtype([tuple(field) if len(field) == 2 else (field[0], field[1], tuple(field[2]))
+    for field in header["recordDtype"]])
+  return header
+
+
+def openLog(path):
+  """
+  Map the complete records of a log read-only (numpy.memmap of structured records; an empty array if there are none).
+  """
+  recordDtype = readLogHeader(path)["recordDtype"]
+  recordCount = (os.path.getsize(path) - LOG_HEADER_SIZE) // recordDtype.itemsize
+  if recordCount == 0:
+    return np.zeros(0, dtype=recordDtype)
+  return np.memmap(path, dtype=recordDtype, mode="r", offset=LOG_HEADER_SIZE, shape=(recordCount,))
+
+
+class LogWriter:
+  """
+  Appends records to a log from a background thread. append() only queues the record, so it can be
+  called from the main thread; records are written in batches. If the queue is full the record is
+  dropped (droppedCount) rather than blocking the caller.
+  """
+
+  def __init__(self, path, recordDtype, description=None, flushInterval=1.0, maxQueueSize=10000):
+    self.path = path
+    self.recordDtype = np.dtype(recordDtype)
+    self.flushInterval = flushInterval
+    self.writtenCount = 0
+    self.droppedCount = 0
+    self._queue = queue.Queue(maxQueueSize)
+    self._file = open(path, "wb")
+    _writeHeader(self._file, self.recordDtype, description)
+    self._thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+    self._thread.start()
+
+  def append(self, record):
+    """
+    Queue a record (tuple of the fields of recordDtype). Return False if it was dropped.
+    """
+    try:
+      self._queue.put_nowait(record)
+      return True
+    except queue.Full:
+      self.droppedCount += 1
+      return False
+
+  def close(self):
+    """
+    Write the queued records and close the file.
+    """
+    if self._thread is None:
+      return
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+    self._file.close()
+
+  def _run(self):
+    lastFlushTime = time.monotonic()
+    stopRequested = False
+    while not stopRequested:
+      try:
+        batch = [self._queue.get(timeout=self.flushInterval)]
+      except queue.Empty:
+        batch = []
+      while True:
+        try:
+          batch.append(self._queue.get_nowait())
+        except queue.Empty:
+          break
+      if None in batch:
+        stopRequested = True
+        batch = [record for record in batch if record is not None]
+      if batch:
+        try:
+          self._file.write(np.array(batch, dtype=self.recordDtype).tobytes())
+          self.writtenCount += len(batch)
+        except (OSError, ValueError) as error:
+          logging.error("Failed to write {0} records to {1}: {2}".format(len(batch), self.path, error))
+      if stopRequested or time.monotonic() - lastFlushTime >= self.flushInterval:
+        self._file.flush()
+        lastFlushTime = time.monotonic()
+
+
+class SessionRecorder:
+  """
+  Records a session into a directory: transforms.psplog, and with recordSlices, slices-<n>.psplog
+  (a new slice log is started whenever the slice shape or type changes).
+  """
+
+  TRANSFORM_LOG_NAME = "transforms" + LOG_EXTENSION
+
+  def __init__(self, directory, recordSlices=False, clock=time.time):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    self.recordSlices = recordSlices
+    self.clock = clock
+    self.sliceSequence = 0
+    self.transformWriter = LogWriter(os.path.join(directory, self.TRANSFORM_LOG_NAME), TRANSFORM_RECORD,
+      {"content": "transforms"})
+    self.sliceWriters = []
+
+  def recordTransform(self, name, matrix, timestamp=None):
+    """
+    Record a transform. Raise ValueError if its name is longer than MAX_TRANSFORM_NAME_LENGTH.
+    """
+    encodedName = encodeTransformName(name)
+    timestamp = self.clock() if timestamp is None else timestamp
+    return self.transformWriter.append((timestamp, encodedName, np.asarray(matrix, dtype=np.float32)))
+
+  def recordSlice(self, sliceArray, timestamp=None):
+    """
+    Record a copy of an outbound slice (ignored unless recordSlices).
+    """
+    if not self.recordSlices:
+      return False
+    timestamp = self.clock() if timestamp is None else timestamp
+    sliceArray = np.asarray(sliceArray)
+    writer = self.sliceWriters[-1] if self.sliceWriters else None
+    if writer is None or writer.recordDtype["pixels"].shape != sliceArray.shape or writer.recordDtype["pixels"].base != sliceArray.dtype.newbyteorder("<"):
+      if writer is not None:
+        writer.close()
+      writer = LogWriter(os.path.join(self.directory, "slices-{0}{1}".format(len(self.sliceWriters), LOG_EXTENSION)),
+        sliceRecordDtype(sliceArray.shape, sliceArray.dtype), {"content": "slices"}, maxQueueSize=256)
+      self.sliceWriters.append(writer)
+    self.sliceSequence += 1
+    return writer.append((timestamp, self.sliceSequence, sliceArray.copy()))
+
+  def statistics(self):
+    writers = [self.transformWriter] + self.sliceWriters
+    return {
+      "transformCount": self.transformWriter.writtenCount,
+      "sliceCount": sum(writer.writtenCount for writer in self.sliceWriters),
+      "droppedCount": sum(writer.droppedCount for writer in writers),
+    }
+
+  def close(self):
+    for writer in [self.transformWriter] + self.sliceWriters:
+      writer.close()
@@ -0,0 +1,200 @@
+"""
+Memory-bounded window/level mapping of CT volumes to the [0-255] range.
+
+The volume is processed slab by slab (along the first, K, axis) so that the peak memory stays at
+the size of the input plus a single slab of temporaries, instead of several full-size float64 copies.
+8 and 16 bit integer volumes are mapped through a precomputed lookup table.
+
+NumPy is imported by the functions that use it, so that importing this module (e.g. for DEFAULT_SLAB_BYTES) is immediate.
+"""
+
+# Budget for the temporaries of one slab, in bytes
+DEFAULT_SLAB_BYTES = 16 * 1024 * 1024
+
+# Integer types small enough to be mapped through a lookup table (native byte order only), by NumPy type name
+_LOOKUP_TABLE_DTYPES = {
+  "uint8": "uint8",
+  "int8": "uint8",
+  "uint16": "uint16",
+  "int16": "uint16",
+}
+
+
+def windowLimits(window, level):
+  """
+  Return the (lower, upper) intensity limits of a window width/level pair.
+  """
+  window = float(window)
+  if window <= 0:
+    raise ValueError("Window width must be positive, got {0}".format(window))
+  lower = float(level) - window / 2.0
+  return lower, lower + window
+
+
+def mapToUChar(values, window, level):
+  """
+  Map an array of intensities to uint8 using the same formula as AR_Planner always used:
+  ((value - lowerLimit) / window) * 255, clipped to [0-255] and truncated.
+  """
+  import numpy as np
+  lower, _ = windowLimits(window, level)
+  scaled = np.asarray(values, dtype=np.float64) - lower
+  scaled /= float(window)
+  scaled *= 255.0
+  np.clip(scaled, 0, 255, out=scaled)
+  return scaled.astype(np.uint8)
+
+
+def supportsLookupTable(dtype):
+  """
+  Return True if volumes of this scalar type are mapped through a lookup table.
+  """
+  import numpy as np
+  dtype = np.dtype(dtype)
+  return dtype.isnative and dtype.name in _LOOKUP_TABLE_DTYPES
+
+
+def lookupTableIndexType(dtype):
+  """
+  Unsigned type whose view of the voxels is used to index the lookup table of this scalar type.
+  """
+  import numpy as np
+  return np.dtype(_LOOKUP_TABLE_DTYPES[np.dtype(dtype).name])
+
+
+def holdsUCharRange(dtype):
+  """
+  Return True if arrays of this scalar type hold every value of [0-255] exactly, so they can receive a windowed volume
+  (e.g. to window a volume in place). int8 and bool arrays cannot.
+  """
+  import numpy as np
+  dtype = np.dtype(dtype)
+  if np.issubdtype(dtype, np.integer):
+    typeInfo = np.iinfo(dtype)
+    return typeInfo.min <= 0 and typeInfo.max >= 255
+  return np.issubdtype(dtype, np.floating)
+
+
+def createLookupTable(dtype, window, level):
+  """
+  Create the uint8 lookup table of an 8 or 16 bit integer type.
+  The table is indexed by the unsigned reinterpretation (view) of the input values,
+  so signed volumes do not need to be widened before the lookup.
+  """
+  import numpy as np
+  dtype = np.dtype(dtype)
+  if not supportsLookupTable(dtype):
+    raise TypeError("No lookup table for scalar type {0}".format(dtype))
+  indexDtype = lookupTableIndexType(dtype)
+  allValues = np.arange(2 ** (8 * dtype.itemsize), dtype=np.int64).astype(indexDtype).view(dtype)
+  return mapToUChar(allValues, window, level)
+
+
+def slabSize(shape, itemsize, slabBytes=DEFAULT_SLAB_BYTES):
+  """
+  Number of slices (along the first axis) that fit in the slab memory budget.
+  """
+  import numpy as np
+  sliceBytes = int(np.prod(shape[1:], dtype=np.int64)) * max(int(itemsize), 8)
+  return max(1, int(slabBytes) // max(1, sliceBytes))
+
+
+def applyWindowLevel(imageArray, window, level, out=None, slabBytes=DEFAULT_SLAB_BYTES, lookupTable=None):
+  """
+  Map imageArray to [0-255] with the given window width and level, one slab at a time.
+
+  :param imageArray: volume array (typically the KJI array returned by slicer.util.arrayFromVolume)
+  :param out: output array of the same shape. If None, a new uint8 array is allocated.
+    Pass imageArray itself to window the volume in place (values are then stored in the input scalar type,
+    which must hold [0-255], see holdsUCharRange).
+  :param lookupTable: lookup table previously created by createLookupTable for this scalar type, window and level
+  :return: the output array
+  """
+  import numpy as np
+  if out is None:
+    out = np.empty(imageArray.shape, dtype=np.uint8)
+  elif out.shape != imageArray.shape:
+    raise ValueError("Output shape {0} does not match input shape {1}".format(out.shape, imageArray.shape))
+  elif not holdsUCharRange(out.dtype):
+    raise ValueError("Output scalar type {0} cannot hold the [0-255] range".format(out.dtype))
+
+  if imageArray.ndim < 2:
+    # Nothing to split in slabs
+    out[...] = mapToUChar(imageArray, window, level)
+    return out
+
+  if supportsLookupTable(imageArray.dtype):
+    if lookupTable is None:
+      lookupTable = createLookupTable(imageArray.dtype, window, level)
+    indexDtype = lookupTableIndexType(imageArray.dtype)
+  else:
+    lookupTable = None
+    lower, _ = windowLimits(window, level)
+
+  step = slabSize(imageArray.shape, imageArray.dtype.itemsize, slabBytes)
+  outputIsUChar = out.dtype == np.uint8
+  for start in range(0, imageArray.shape[0], step):
+    inputSlab = imageArray[start:start + step]
+    outputSlab = out[start:start + step]
+    if lookupTable is not None:
+      if outputIsUChar:
+        np.take(lookupTable, inputSlab.view(indexDtype), out=outputSlab)
+      else:
+        outputSlab[...] = np.take(lookupTable, inputSlab.view(indexDtype))
+    else:
+      scaled = np.subtract(inputSlab, lower, dtype=np.float64)
+      scaled /= float(window)
+      scaled *= 255.0
+      np.clip(scaled, 0, 255, out=scaled)
+      outputSlab[...] = scaled.astype(np.uint8)
+  return out
+
+
+class WindowLevelMapper:
+  """
+  Maps images to [0-255] with a window width/level that can change at any time.
+  The lookup table is only rebuilt when the window, the level or the scalar type change,
+  so mapping a small image (such as the CT reslice) costs a single table lookup.
+  """
+
+  def __init__(self, window=None, level=None):
+    self.window = window
+    self.level = level
+    self._lookupTable = None
+    self._lookupTableKey = None
+
+  def setWindowLevel(self, window, level):
+    """
+    Set the window width and level. Return True if they changed.
+    """
+    window = float(window)
+    level = float(level)
+    if window == self.window and level == self.level:
+      return False
+    windowLimits(window, level)  # validate
+    self.window = window
+    self.level = level
+    return True
+
+  def lookupTable(self, dtype):
+    """
+    Return the cached lookup table for the scalar type, or None if the type is not mapped through a table.
+    """
+    import numpy as np
+    dtype = np.dtype(dtype)
+    if not supportsLookupTable(dtype):
+      return None
+    key = (dtype, self.window, self.level)
+    if key != self._lookupTableKey:
+      self._lookupTable = createLookupTable(dtype, self.window, self.level)
+      self._lookupTableKey = key
+    return self._lookupTable
+
+  def map(self, imageArray, out=None):
+    """
+    Map imageArray to [0-255] with the current window width and level.
+    """
+    if self.window is None or self.level is None:
+      raise ValueError("Window width and level are not set")
+    return applyWindowLevel(imageArray, self.window, self.level, out=out,
+      lookupTable=self.lookupTable(imageArray.dtype))
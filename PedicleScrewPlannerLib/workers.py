@@ -0,0 +1,138 @@
+"""
+Background computation of images with double-buffered output.
+
+A worker thread computes an image for the most recent request into a back buffer, then swaps it with
+the front buffer. The main thread only copies completed frames out of the front buffer, so it never
+waits for a computation and never sees a partially written image.
+"""
+import logging
+import threading
+
+import numpy as np
+
+
+class DoubleBuffer:
+  """
+  Front/back pair of arrays. The producer writes into back and calls swap(), the consumer reads front.
+  """
+
+  def __init__(self, shape, dtype):
+    self.back = np.zeros(shape, dtype=dtype)
+    self._front = np.zeros(shape, dtype=dtype)
+    self._lock = threading.Lock()
+    self._frontMetadata = None
+    self.sequence = 0  # number of completed frames
+    self.readMetadata = None  # metadata of the last frame copied by read()
+
+  def swap(self, metadata=None):
+    """
+    Publish the back buffer as the new front buffer (producer side), with optional metadata describing the frame.
+    """
+    with self._lock:
+      self._front, self.back = self.back, self._front
+      self._frontMetadata = metadata
+      self.sequence += 1
+
+  def read(self, out, lastSequence=None):
+    """
+    Copy the front buffer into out (consumer side).
+    Return the sequence number of the copied frame, or None if there is no frame newer than lastSequence.
+    """
+    with self._lock:
+      if self.sequence == 0 or self.sequence == lastSequence:
+        return None
+      np.copyto(out, self._front)
+      self.readMetadata = self._frontMetadata
+      return self.sequence
+
+
+class LatestRequestWorker:
+  """
+  Runs compute(request, outputArray) on a worker thread for the most recently submitted request.
+  Requests submitted while the worker is busy replace each other (only the latest one is computed).
+  The value returned by compute is kept with the frame (lastFrameMetadata, once the frame is taken).
+
+  Counters: submittedCount, computedCount, coalescedCount (requests replaced before being computed)
+  and publishedCount (frames taken by the consumer).
+  """
+
+  def __init__(self, compute, shape, dtype, name="LatestRequestWorker"):
+    self.compute = compute
+    self.buffer = DoubleBuffer(shape, dtype)
+    self.submittedCount = 0
+    self.computedCount = 0
+    self.coalescedCount = 0
+    self.publishedCount = 0
+    self.lastError = None
+    self.lastFrameMetadata = None
+    self._request = None
+    self._hasRequest = False
+    self._stopRequested = False
+    self._lastPublishedSequence = None
+    self._condition = threading.Condition()
+    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+    self._thread.start()
+
+  def submit(self, request):
+    """
+    Request the computation of a new frame. Never blocks on the computation.
+    """
+    with self._condition:
+      if self._hasRequest:
+        self.coalescedCount += 1
+      self._request = request
+      self._hasRequest = True
+      self.submittedCount += 1
+      self._condition.notify()
+
+  def takeFrame(self, out):
+    """
+    Copy the latest completed frame into out. Return True if it is a frame that was not taken yet.
+    """
+    sequence = self.buffer.read(out, self._lastPublishedSequence)
+    if sequence is None:
+      return False
+    self._lastPublishedSequence = sequence
+    self.lastFrameMetadata = self.buffer.readMetadata
+    self.publishedCount += 1
+    return True
+
+  def isRunning(self):
+    return self._thread.is_alive()
+
+  def stop(self, timeout=1.0):
+    """
+    Stop the worker thread. Pending requests are discarded.
+    """
+    with self._condition:
+      self._stopRequested = True
+      self._condition.notify()
+    self._thread.join(timeout)
+
+  def statistics(self):
+    return {
+      "submittedCount": self.submittedCount,
+      "computedCount": self.computedCount,
+      "coalescedCount": self.coalescedCount,
+      "publishedCount": self.publishedCount,
+    }
+
+  def _run(self):
+    while True:
+      with self._condition:
+        while not self._hasRequest and not self._stopRequested:
+          self._condition.wait()
+        if self._stopRequested:
+          return
+        request = self._request
+        self._request = None
+        self._hasRequest = False
+      try:
+        metadata = self.compute(request, self.buffer.back)
+      except Exception as error:
+        # Keep the worker alive, the next request may succeed
+        self.lastError = error
+        logging.exception("Background computation failed")
+        continue
+      self.buffer.swap(metadata)
+      self.computedCount += 1
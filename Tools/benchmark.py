@@ -0,0 +1,243 @@
+"""
+Benchmark of the hot paths of the planners on deterministic synthetic data (CT volume, spine mesh, screw models).
+
+Run with plain Python to time the NumPy processing only:
+  python Tools/benchmark.py --output results.json
+
+Run inside 3D Slicer to also time the module logic (SetVolumeRangeTo_0_255, ChangeScalarTypeToUChar,
+reslice update, LoadScrewModelsFromFile, Desktop LoadScrewModel, scene saving):
+  Slicer --no-main-window --python-script Tools/benchmark.py --output results.json
+
+Results are written as JSON (see PedicleScrewPlannerLib/benchmarking.py) so that runs can be compared.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+_repositoryDirectory = Path(__file__).resolve().parent.parent
+sys.path.append(str(_repositoryDirectory))
+from PedicleScrewPlannerLib import benchmarking, framehash, imagecodec, objfile, phantoms, pyramid, reslice, windowing
+
+try:
+  import slicer
+except ImportError:
+  slicer = None
+
+WINDOW = 1500.0
+LEVEL = 300.0
+SCREW_FILE_NAME = phantoms.screwFileName(5, 45)
+
+
+def randomPoses(count, seed=0, translationRange=50.0):
+  """
+  Deterministic 4x4 poses (random rotations about the three axes and random translations).
+  """
+  random = np.random.default_rng(seed)
+  poses = []
+  for _ in range(count):
+    angles = random.uniform(-np.pi, np.pi, 3)
+    rotation = np.eye(3)
+    for axis, angle in enumerate(angles):
+      axisRotation = np.eye(3)
+      first, second = [index for index in range(3) if index != axis]
+      axisRotation[first, first] = axisRotation[second, second] = np.cos(angle)
+      axisRotation[first, second] = -np.sin(angle)
+      axisRotation[second, first] = np.sin(angle)
+      rotation = rotation @ axisRotation
+    pose = np.eye(4)
+    pose[:3, :3] = rotation
+    pose[:3, 3] = random.uniform(-translationRange, translationRange, 3)
+    poses.append(pose)
+  return poses
+
+
+def slicePoses(volumeShape, count, seed=0):
+  """
+  Slice-to-IJK poses of planes through the middle of the volume.
+  """
+  poses = randomPoses(count, seed, translationRange=min(volumeShape) / 8.0)
+  center = (np.array(volumeShape[::-1]) - 1) / 2.0
+  for pose in poses:
+    pose[:3, 3] += center - pose[:3, :3] @ np.array([50.0, 50.0, 0.0])
+  return poses
+
+
+def runNumpyBenchmarks(report, volume, args):
+  """
+  Benchmarks of the Slicer-independent processing.
+  """
+  repeats = args.repeats
+  workArray = np.empty_like(volume)
+  report.run("windowing.applyWindowLevel", lambda: windowing.applyWindowLevel(volume, WINDOW, LEVEL, out=workArray),
+    repeats, voxels=volume.size)
+  ucharVolume = np.empty(volume.shape, dtype=np.uint8)
+  report.run("windowing.applyWindowLevel (uint8 output)", lambda: windowing.applyWindowLevel(volume, WINDOW, LEVEL, out=ucharVolume),
+    repeats, voxels=volume.size)
+  report.run("pyramid.VolumePyramid", lambda: pyramid.VolumePyramid(volume, (0.8, 0.8, 1.0), 3), repeats)
+
+  poses = np.stack(slicePoses(volume.shape, args.planes))
+  outputExtent = [0, 99, 0, 99, 0, 0]
+  report.run("reslice.resliceVolume (1 plane)", lambda: reslice.resliceVolume(volume, poses[0], outputExtent, (1.0, 1.0, 1.0)),
+    repeats, interpolation="linear")
+  report.run("reslice.resliceVolume ({0} planes)".format(args.planes),
+    lambda: reslice.resliceVolume(volume, poses, outputExtent, (1.0, 1.0, 1.0)), repeats, planes=args.planes)
+
+  frames = reslice.resliceVolume(ucharVolume, poses, outputExtent, (1.0, 1.0, 1.0))
+  for mode in imagecodec.TRANSPORT_MODES:
+    encoder = imagecodec.FrameEncoder(mode)
+    frameIndex = iter(range(10 ** 9))
+    result = report.run("imagecodec.FrameEncoder.encode ({0})".format(mode),
+      lambda: encoder.encode(frames[next(frameIndex) % len(frames)]), repeats * 10)
+    result["compressionRatio"] = encoder.statistics()["compressionRatio"]
+  report.run("framehash.frameDigest", lambda: framehash.frameDigest(frames[0]), repeats * 10)
+
+
+def createSyntheticFiles(directory, args):
+  """
+  Write the synthetic spine and screw models. Return (models directory, screws directory, spine file name).
+  """
+  modelsDirectory = os.path.join(directory, "Models")
+  screwsDirectory = os.path.join(directory, "Screws")
+  os.makedirs(modelsDirectory, exist_ok=True)
+  spineFileName = "SyntheticSpine.obj"
+  vertices, faces = phantoms.spineMesh(args.vertebrae, extentS=args.size[0], resolution=args.meshResolution)
+  objfile.writeObj(os.path.join(modelsDirectory, spineFileName), vertices, faces, "Synthetic spine")
+  phantoms.writeScrewModels(screwsDirectory)
+  return modelsDirectory, screwsDirectory, spineFileName
+
+
+def runSlicerBenchmarks(report, volume, directory, args):
+  """
+  Benchmarks of the module logic. Must run inside 3D Slicer.
+  """
+  for moduleDirectory in ("AR_Planner-3DSlicer", "Desktop_Planner-3DSlicer"):
+    sys.path.append(str(_repositoryDirectory / moduleDirectory))
+  import AR_Planner
+  import Desktop_Planner
+
+  repeats = args.repeats
+  modelsDirectory, screwsDirectory, spineFileName = createSyntheticFiles(directory, args)
+  slicer.mrmlScene.Clear()
+
+  logic = AR_Planner.AR_PlannerLogic()
+  parameterNode = logic.getParameterNode()
+  ijkToRas = np.diag([0.8, 0.8, 1.0, 1.0])
+  inputVolume = slicer.util.addVolumeFromArray(volume.copy(), ijkToRas, "SyntheticCT")
+  inputVolume.GetDisplayNode().AutoWindowLevelOff()
+  inputVolume.GetDisplayNode().SetWindowLevel(WINDOW, LEVEL)
+  parameterNode.SetNodeReferenceID(logic.INPUT_VOLUME, inputVolume.GetID())
+
+  def restoreVolume():
+    slicer.util.updateVolumeFromArray(inputVolume, volume)
+
+  report.run("AR_Planner.SetVolumeRangeTo_0_255", logic.SetVolumeRangeTo_0_255, repeats, setup=restoreVolume, voxels=volume.size)
+  report.run("AR_Planner.ChangeScalarTypeToUChar", logic.ChangeScalarTypeToUChar, repeats, voxels=volume.size)
+  restoreVolume()
+
+  # Reslice update: move Image_T and run the scheduled update, as when a pose arrives from HoloLens
+  logic.CreateSlide(inputVolume)
+  imageTransformNode = slicer.mrmlScene.GetFirstNodeByName(logic.IMAGE_TRANSFORM)
+  imagePoses = randomPoses(10 ** 4, seed=1)
+  volumeCenter = ijkToRas[:3, :3] @ ((np.array(volume.shape[::-1]) - 1) / 2.0)
+  for pose in imagePoses:
+    pose[:3, 3] += volumeCenter
+  imagePoses = iter(imagePoses)
+
+  def updateReslice():
+    imageTransformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(next(imagePoses)))
+    logic.resliceTimer.stop()
+    logic.resliceScheduler.runPending()
+
+  report.run("AR_Planner reslice update", updateReslice, repeats * 10, resliceInBackground=logic.IsResliceInBackground())
+
+  # Screws received from HoloLens: Screw-N_T transforms with the OpenIGTLink metadata
+  logic.LoadModelFromFile(modelsDirectory, spineFileName, [0.9, 0.9, 0.8], True)
+  logic.GetOrCreateTransform(logic.SPINE_TRANSFORM)
+  parameterNode.SetParameter(logic.SCREWS_DIRECTORY, screwsDirectory)
+  imageTransformNode.SetAttribute("OpenIGTLink.NumOfScrews", str(args.screws))
+  for screwNumber, pose in enumerate(randomPoses(args.screws, seed=2), start=1):
+    transformName = "Screw-{0}_T".format(screwNumber)
+    screwTransformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", transformName)
+    screwTransformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(pose))
+    screwTransformNode.SetAttribute("OriginalNodeName", transformName)
+    screwTransformNode.SetAttribute("OpenIGTLink.ModelName", SCREW_FILE_NAME)
+    screwTransformNode.SetAttribute("OpenIGTLink.ModelColor", "0.0,0.73,0.95")
+    screwTransformNode.SetAttribute("OpenIGTLink.ModelNumber", str(screwNumber))
+  report.run("AR_Planner.LoadScrewModelsFromFile", logic.LoadScrewModelsFromFile, repeats, screws=args.screws)
+
+  # Scene saving (the .mrb of the AR planner)
+  settings = slicer.app.userSettings()
+  previousSavingDirectory = settings.value(logic.SAVING_DIRECTORY)
+  settings.setValue(logic.SAVING_DIRECTORY, os.path.join(directory, "Results"))
+  parameterNode.SetParameter(logic.PATIENT_ID, "1")
+  parameterNode.SetParameter(logic.USER_ID, "Benchmark")
+  def saveData():
+    logic.SaveData()
+    logic.waitForSceneSave()  # the whole save, and the next one does not find it pending
+
+  try:
+    report.run("AR_Planner.SaveData", saveData, max(1, repeats // 2), warmup=0,
+      sceneInBackground=parameterNode.GetParameter(logic.SAVE_SCENE_IN_BACKGROUND) == "true")
+  finally:
+    settings.setValue(logic.SAVING_DIRECTORY, previousSavingDirectory)
+
+  # Desktop planner: load the screws one by one
+  desktopLogic = Desktop_Planner.Desktop_PlannerLogic()
+  desktopLogic.setupScene()
+  previousScrewModelPath = settings.value(desktopLogic.SCREW_MODEL_PATH)
+  settings.setValue(desktopLogic.SCREW_MODEL_PATH, screwsDirectory)
+  try:
+    def loadDesktopScrews():
+      for screwNumber in range(1, args.screws + 1):
+        desktopLogic.LoadScrewModel(os.path.splitext(SCREW_FILE_NAME)[0], "Screw-{0}_T".format(screwNumber))
+    report.run("Desktop_Planner.LoadScrewModel", loadDesktopScrews, repeats, screws=args.screws)
+  finally:
+    settings.setValue(desktopLogic.SCREW_MODEL_PATH, previousScrewModelPath)
+  logic.StopResliceWorker()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--size", type=lambda text: tuple(int(size) for size in text.split(",")), default=(128, 256, 256),
+    help="slices,rows,columns of the synthetic CT (default: 128,256,256)")
+  parser.add_argument("--vertebrae", type=int, default=5)
+  parser.add_argument("--screws", type=int, default=10, help="number of screws to load")
+  parser.add_argument("--planes", type=int, default=32, help="number of planes of the batched NumPy reslice")
+  parser.add_argument("--mesh-resolution", dest="meshResolution", type=int, default=64)
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", default="benchmark.json", help="JSON report path")
+  parser.add_argument("--keep-data", dest="keepData", action="store_true", help="keep the generated files")
+  args = parser.parse_args()
+
+  report = benchmarking.BenchmarkReport(vars(args), lambda name, result: print(benchmarking.formatResult(name, result)))
+  report.environment["slicer"] = slicer.app.applicationVersion if slicer is not None else None
+  volume = phantoms.syntheticCtVolume(args.size, numberOfVertebrae=args.vertebrae, seed=args.seed)
+  directory = tempfile.mkdtemp(prefix="PedicleScrewPlannerBenchmark_")
+  try:
+    runNumpyBenchmarks(report, volume, args)
+    if slicer is not None:
+      runSlicerBenchmarks(report, volume, directory, args)
+    else:
+      print("3D Slicer not available: the module logic benchmarks are skipped")
+  finally:
+    if args.keepData:
+      print("Synthetic data kept in " + directory)
+    else:
+      shutil.rmtree(directory, ignore_errors=True)
+  report.write(args.output)
+  print("Results written to " + args.output)
+  return 0
+
+
+if __name__ == "__main__":
+  status = main()
+  if slicer is None:
+    sys.exit(status)
+  elif slicer.app.commandOptions().noMainWindow:
+    slicer.util.exit(status)
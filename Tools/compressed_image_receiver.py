@@ -0,0 +1,121 @@
+"""
+Receiver for the compressed CT_reslice stream of the AR_Planner module (ImageTransport parameter set to
+zlib, delta-zlib, lz4 or delta-lz4).
+
+It connects to the 3D Slicer OpenIGTLink server, decodes every CT_reslice_Packed frame and verifies
+it against the CRC-32 of the original pixels carried in the packet. With --self-test, no server is needed:
+synthetic frames are encoded, sent as OpenIGTLink IMAGE messages through a local socket, received,
+decoded and compared with the originals.
+
+Usage:
+  python Tools/compressed_image_receiver.py --host 127.0.0.1 --port 18944
+  python Tools/compressed_image_receiver.py --self-test --mode delta-zlib
+"""
+import argparse
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from PedicleScrewPlannerLib import imagecodec, openigtlink
+
+COMPRESSED_DEVICE_NAME = openigtlink.checkDeviceName("CT_reslice_Packed")
+
+
+def decodeImageMessage(decoder, message):
+  """
+  Decode the packet carried by an IMAGE message. Return the frame, or None if it cannot be decoded yet.
+  """
+  packetArray, _ = openigtlink.unpackImageContent(message.content)
+  return decoder.decode(packetArray)
+
+
+def receive(host, port, numberOfFrames=None):
+  """
+  Receive and verify compressed frames until numberOfFrames frames are decoded (or forever).
+  """
+  decoder = imagecodec.FrameDecoder()
+  receivedBytes = 0
+  startTime = time.perf_counter()
+  with socket.create_connection((host, port)) as connection:
+    print("Connected to {0}:{1}".format(host, port))
+    while numberOfFrames is None or decoder.decodedCount < numberOfFrames:
+      message = openigtlink.receiveMessage(connection)
+      if message.messageType != "IMAGE" or message.deviceName != COMPRESSED_DEVICE_NAME:
+        continue
+      receivedBytes += len(message.content)
+      frame = decodeImageMessage(decoder, message)  # raises ValueError if the checksum does not match
+      if frame is None:
+        print("Waiting for a key frame")
+        continue
+      elapsedTime = time.perf_counter() - startTime
+      print("Frame {0}: {1} verified, {2:.1f} fps, {3:.1f} kB/s".format(decoder.decodedCount, frame.shape,
+        decoder.decodedCount / elapsedTime, receivedBytes / elapsedTime / 1000))
+  return decoder
+
+
+def syntheticFrames(numberOfFrames, shape=(100, 100), seed=0):
+  """
+  Frames that look like a slowly moving CT slice: a smooth pattern with noise, shifted by one pixel per frame.
+  """
+  random = np.random.default_rng(seed)
+  rows, columns = np.mgrid[0:shape[0], 0:shape[1] + numberOfFrames]
+  pattern = 128 + 100 * np.sin(rows / 9.0) * np.cos(columns / 13.0) + random.normal(0, 4, rows.shape)
+  pattern = np.clip(pattern, 0, 255).astype(np.uint8)
+  return [pattern[:, index:index + shape[1]].copy() for index in range(numberOfFrames)]
+
+
+def selfTest(mode, numberOfFrames=100):
+  """
+  Round trip through a local socket: encode, send as IMAGE messages, receive, decode and compare.
+  """
+  frames = syntheticFrames(numberOfFrames)
+  encoder = imagecodec.FrameEncoder(mode)
+  server = socket.create_server(("127.0.0.1", 0))
+  port = server.getsockname()[1]
+
+  def serve():
+    connection, _ = server.accept()
+    with connection:
+      for frame in frames:
+        packet = imagecodec.packetToImage(encoder.encode(frame))
+        openigtlink.sendMessage(connection, openigtlink.Message("IMAGE", COMPRESSED_DEVICE_NAME, openigtlink.packImageContent(packet)))
+
+  serverThread = threading.Thread(target=serve, daemon=True)
+  serverThread.start()
+  decoder = imagecodec.FrameDecoder()
+  mismatches = 0
+  with socket.create_connection(("127.0.0.1", port)) as connection:
+    for frame in frames:
+      decodedFrame = decodeImageMessage(decoder, openigtlink.receiveMessage(connection))
+      if decodedFrame is None or not np.array_equal(decodedFrame, frame):
+        mismatches += 1
+  serverThread.join()
+  server.close()
+
+  statistics = encoder.statistics()
+  print("{mode}: {frameCount} frames, compression ratio {compressionRatio:.2f}, {meanEncodeTime:.6f} s/frame".format(**statistics))
+  print("Round trip: {0} of {1} frames identical".format(numberOfFrames - mismatches, numberOfFrames))
+  return mismatches == 0
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=18944)
+  parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+  parser.add_argument("--self-test", action="store_true", help="local round trip without 3D Slicer")
+  parser.add_argument("--mode", default="delta-zlib", choices=sorted(imagecodec.TRANSPORT_MODES), help="self-test transport mode")
+  args = parser.parse_args()
+  if args.self_test:
+    return 0 if selfTest(args.mode, args.frames or 100) else 1
+  receive(args.host, args.port, args.frames)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
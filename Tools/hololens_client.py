@@ -0,0 +1,272 @@
+"""
+Headless stand-in for the HoloLens application, to load test the AR_Planner OpenIGTLink server without a headset.
+
+It connects to the server opened by AR_Planner (port 18944), sends Image_T, Spine_T and Screw-N_T TRANSFORM
+messages with the same metadata as the Unity application (ModelName, ModelColor, ModelNumber, NumOfScrews),
+at configurable rates, and consumes the IMAGE messages sent back (CT_reslice, or CT_reslice_Packed which
+is decoded and verified). It reports the achieved image frame rate and the round-trip latency: the time from
+sending an Image_T pose to receiving the first image after it.
+
+Poses are synthetic (the image plane sweeps the spine, screws stay in place) or replayed from a recording:
+the transforms.psplog of an AR_Planner session recording (see PedicleScrewPlannerLib/sessionlog.py), or an
+.npz file with arrays "times" (seconds, N), "names" (transform names, N) and "matrices" (N x 4 x 4).
+
+Usage:
+  python Tools/hololens_client.py --host 127.0.0.1 --duration 30 --image-rate 60 --screws 6
+  python Tools/hololens_client.py --replay Session/transforms.psplog --speed 2
+"""
+import argparse
+import json
+import math
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from PedicleScrewPlannerLib import imagecodec, latency, openigtlink, screws, sessionlog
+
+IMAGE_TRANSFORM = "Image_T"
+SPINE_TRANSFORM = "Spine_T"
+IMAGE_DEVICE_NAMES = tuple(openigtlink.checkDeviceName(deviceName) for deviceName in ("CT_reslice", "CT_reslice_Packed"))
+SCREW_MODEL_NAME = "D5L45.obj"
+SCREW_COLOR = "0.0,0.73,0.95"
+
+
+def transformMetadata(transformName, numberOfScrews):
+  """
+  Metadata of a TRANSFORM message, as sent by SendMessageToServer.SendTransformMessage in the Unity application.
+  """
+  isScrew = transformName.startswith("Screw")
+  return {
+    "ModelName": SCREW_MODEL_NAME if isScrew else "None",
+    "ModelColor": SCREW_COLOR if isScrew else "1,1,1",
+    "ModelNumber": str(screws.parseScrewNumber(transformName)) if isScrew else "0",
+    "NumOfScrews": str(numberOfScrews),
+  }
+
+
+def imagePlanePose(elapsedTime, center=(0.0, 0.0, 0.0), amplitude=40.0, period=4.0):
+  """
+  Image plane sweeping up and down the spine while slowly tilting.
+  """
+  phase = 2 * math.pi * elapsedTime / period
+  angle = math.radians(20.0) * math.sin(phase / 3.0)
+  pose = np.eye(4)
+  pose[1, 1] = pose[2, 2] = math.cos(angle)
+  pose[1, 2] = -math.sin(angle)
+  pose[2, 1] = math.sin(angle)
+  pose[:3, 3] = np.asarray(center) + [0.0, 0.0, amplitude * math.sin(phase)]
+  return pose
+
+
+def screwPose(screwNumber, jitter=0.0, random=None):
+  """
+  Screws inserted alternately on the left and right pedicles of consecutive vertebrae.
+  """
+  pose = np.eye(4)
+  side = -1 if screwNumber % 2 else 1
+  pose[:3, 3] = [side * 20.0, 30.0, 30.0 * ((screwNumber - 1) // 2)]
+  if jitter and random is not None:
+    pose[:3, 3] += random.normal(0.0, jitter, 3)
+  return pose
+
+
+class SyntheticPoseStream:
+  """
+  Timed (time, transform name, matrix) events: Image_T at imageRate, Spine_T and the screws at screwRate.
+  """
+
+  def __init__(self, duration, imageRate=60.0, screwRate=10.0, numberOfScrews=6, jitter=0.2, seed=0):
+    self.duration = duration
+    self.imageRate = imageRate
+    self.screwRate = screwRate
+    self.numberOfScrews = numberOfScrews
+    self.jitter = jitter
+    self.random = np.random.default_rng(seed)
+
+  def events(self):
+    imageTimes = np.arange(0.0, self.duration, 1.0 / self.imageRate) if self.imageRate > 0 else []
+    screwTimes = np.arange(0.0, self.duration, 1.0 / self.screwRate) if self.screwRate > 0 else []
+    events = [(t, IMAGE_TRANSFORM) for t in imageTimes] + [(t, "") for t in screwTimes]
+    for eventTime, name in sorted(events, key=lambda event: event[0]):
+      if name == IMAGE_TRANSFORM:
+        yield eventTime, IMAGE_TRANSFORM, imagePlanePose(eventTime)
+      else:
+        yield eventTime, SPINE_TRANSFORM, np.eye(4)
+        for screwNumber in range(1, self.numberOfScrews + 1):
+          yield eventTime, screws.screwTransformName(screwNumber), screwPose(screwNumber, self.jitter, self.random)
+
+
+class RecordedPoseStream:
+  """
+  Timed events replayed from a session log or an .npz recording, optionally faster or slower than recorded.
+  """
+
+  def __init__(self, path, speed=1.0):
+    if str(path).endswith(sessionlog.LOG_EXTENSION):
+      recording = sessionlog.openLog(path)
+      self.times = np.asarray(recording["time"], dtype=np.float64)
+      self.names = [name.decode("ascii") for name in recording["name"]]
+      self.matrices = recording["matrix"]
+    else:
+      recording = np.load(path, allow_pickle=False)
+      self.times = np.asarray(recording["times"], dtype=np.float64)
+      self.names = [str(name) for name in recording["names"]]
+      self.matrices = np.asarray(recording["matrices"], dtype=np.float64)
+    self.speed = speed
+    self.numberOfScrews = len({name for name in self.names if name.startswith("Screw")})
+
+  def events(self):
+    startTime = self.times[0] if len(self.times) else 0.0
+    for eventTime, name, matrix in zip(self.times, self.names, self.matrices):
+      yield (eventTime - startTime) / self.speed, name, matrix
+
+
+class HoloLensClient:
+  """
+  Sends the pose events and receives the images on the same connection, from two threads.
+  """
+
+  def __init__(self, host, port, timeout=5.0):
+    self.connection = socket.create_connection((host, port), timeout=timeout)
+    self.connection.settimeout(None)
+    self.sentCounts = {}
+    self.imageCount = 0
+    self.imageBytes = 0
+    self.firstImageTime = None
+    self.lastImageTime = None
+    self.latencies = []
+    self.decodeErrors = 0
+    self._unansweredPoseTimes = []
+    self._lock = threading.Lock()
+    self._decoder = imagecodec.FrameDecoder()
+    self._stopRequested = False
+    self._receiverThread = threading.Thread(target=self._receive, name="HoloLensClientReceiver", daemon=True)
+
+  def run(self, poseStream, numberOfScrews):
+    """
+    Send the events of poseStream at their times while receiving images. Return when all events are sent.
+    """
+    self._receiverThread.start()
+    startTime = time.perf_counter()
+    for eventTime, name, matrix in poseStream.events():
+      delay = startTime + eventTime - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+      message = openigtlink.Message("TRANSFORM", name, openigtlink.packTransformContent(matrix),
+        transformMetadata(name, numberOfScrews))
+      packedMessage = openigtlink.packMessage(message)
+      sendTime = time.perf_counter()
+      self.connection.sendall(packedMessage)
+      self.sentCounts[name] = self.sentCounts.get(name, 0) + 1
+      if name == IMAGE_TRANSFORM:
+        with self._lock:
+          self._unansweredPoseTimes.append(sendTime)
+
+  def stop(self, drainTime=0.5):
+    """
+    Wait for the last images, then close the connection.
+    """
+    time.sleep(drainTime)
+    self._stopRequested = True
+    try:
+      self.connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self.connection.close()
+    self._receiverThread.join(1.0)
+
+  def _receive(self):
+    while not self._stopRequested:
+      try:
+        message = openigtlink.receiveMessage(self.connection)
+      except (ConnectionError, OSError):
+        return
+      if message.messageType != "IMAGE" or message.deviceName not in IMAGE_DEVICE_NAMES:
+        continue
+      receiveTime = time.perf_counter()
+      if message.deviceName == "CT_reslice_Packed":
+        try:
+          packetArray, _ = openigtlink.unpackImageContent(message.content)
+          if self._decoder.decode(packetArray) is None:
+            continue
+        except ValueError:
+          self.decodeErrors += 1
+          continue
+      with self._lock:
+        self.imageCount += 1
+        self.imageBytes += len(message.content)
+        self.firstImageTime = self.firstImageTime or receiveTime
+        self.lastImageTime = receiveTime
+        # The image answers every pose sent before it that had not been answered yet
+        self.latencies.extend(receiveTime - sendTime for sendTime in self._unansweredPoseTimes)
+        self._unansweredPoseTimes = []
+
+  def report(self, duration):
+    with self._lock:
+      imageDuration = (self.lastImageTime - self.firstImageTime) if self.imageCount > 1 else 0.0
+      latencies = np.array(self.latencies)
+      result = {
+        "duration": duration,
+        "sent": dict(self.sentCounts),
+        "imagesReceived": self.imageCount,
+        "imageFrameRate": (self.imageCount - 1) / imageDuration if imageDuration > 0 else 0.0,
+        "imageBytesPerSecond": self.imageBytes / duration if duration > 0 else 0.0,
+        "unansweredPoses": len(self._unansweredPoseTimes),
+        "decodeErrors": self.decodeErrors,
+        "roundTripLatency": {"count": len(latencies)},
+      }
+      for percentile in latency.PERCENTILES:
+        result["roundTripLatency"]["p{0}".format(percentile)] = float(np.percentile(latencies, percentile)) if len(latencies) else None
+      return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=18944)
+  parser.add_argument("--duration", type=float, default=10.0, help="seconds of synthetic poses")
+  parser.add_argument("--image-rate", dest="imageRate", type=float, default=60.0, help="Image_T messages per second")
+  parser.add_argument("--screw-rate", dest="screwRate", type=float, default=10.0, help="Spine_T and Screw-N_T messages per second")
+  parser.add_argument("--screws", type=int, default=6, help="number of screws")
+  parser.add_argument("--replay", default=None, help="session log (.psplog) or .npz recording to replay instead of synthetic poses")
+  parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+  parser.add_argument("--output", default=None, help="write the report to this JSON file")
+  args = parser.parse_args()
+
+  if args.replay:
+    poseStream = RecordedPoseStream(args.replay, args.speed)
+    numberOfScrews = poseStream.numberOfScrews
+  else:
+    poseStream = SyntheticPoseStream(args.duration, args.imageRate, args.screwRate, args.screws)
+    numberOfScrews = args.screws
+
+  client = HoloLensClient(args.host, args.port)
+  print("Connected to {0}:{1}".format(args.host, args.port))
+  startTime = time.perf_counter()
+  try:
+    client.run(poseStream, numberOfScrews)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    client.stop()
+  report = client.report(time.perf_counter() - startTime)
+
+  print("Sent: " + ", ".join("{0} {1}".format(count, name) for name, count in sorted(report["sent"].items())))
+  print("Images: {imagesReceived} received, {imageFrameRate:.1f} fps, {imageBytesPerSecond:.0f} B/s".format(**report))
+  roundTrip = report["roundTripLatency"]
+  if roundTrip["count"]:
+    print("Round-trip latency (ms): p50 {0:.1f}, p95 {1:.1f}, p99 {2:.1f} over {3} poses ({4} unanswered)".format(
+      roundTrip["p50"] * 1000, roundTrip["p95"] * 1000, roundTrip["p99"] * 1000, roundTrip["count"], report["unansweredPoses"]))
+  if args.output:
+    with open(args.output, "w") as reportFile:
+      json.dump(report, reportFile, indent=2)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
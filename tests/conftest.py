@@ -0,0 +1,10 @@
+"""
+The tests cover the Slicer-independent PedicleScrewPlannerLib package, so they run in a plain Python interpreter:
+python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+REPOSITORY_DIRECTORY = Path(__file__).resolve().parent.parent
+if str(REPOSITORY_DIRECTORY) not in sys.path:
+  sys.path.insert(0, str(REPOSITORY_DIRECTORY))
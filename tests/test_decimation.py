@@ -0,0 +1,39 @@
+import numpy as np
+
+from PedicleScrewPlannerLib import decimation
+
+
+def _gridMesh(size):
+  """
+  Flat square of size x size vertices (1 mm apart), two triangles per grid square.
+  """
+  x, y = np.meshgrid(np.arange(size, dtype=np.float64), np.arange(size, dtype=np.float64), indexing="ij")
+  vertices = np.stack([x.ravel(), y.ravel(), np.zeros(size * size)], axis=1)
+  corners = (np.arange(size - 1)[:, np.newaxis] * size + np.arange(size - 1)).ravel()
+  faces = np.concatenate([np.stack([corners, corners + size, corners + 1], axis=1),
+    np.stack([corners + 1, corners + size, corners + size + 1], axis=1)])
+  return vertices, faces
+
+
+def test_levelsOfDetailReduceTriangles():
+  vertices, faces = _gridMesh(120)
+  levels = decimation.levelsOfDetail(vertices, faces)
+  triangleCounts = [len(levelFaces) for _, levelFaces in levels]
+  assert triangleCounts[0] == len(faces)
+  for ratio, triangleCount in zip(decimation.LEVEL_RATIOS[1:], triangleCounts[1:]):
+    assert abs(triangleCount - ratio * len(faces)) <= 0.5 * ratio * len(faces)
+  for levelVertices, levelFaces in levels:
+    assert levelFaces.min() >= 0 and levelFaces.max() < len(levelVertices)
+    assert len(np.unique(np.sort(levelFaces, axis=1), axis=0)) == len(levelFaces)
+  assert decimation.chooseLevel(triangleCounts, triangleCounts[1]) == 1
+  assert decimation.chooseLevel(triangleCounts, 0) == len(levels) - 1
+
+
+def test_degenerateMeshIsReturnedUnchanged():
+  vertices = np.zeros((4, 3))
+  faces = np.array([[0, 1, 2], [1, 2, 3]])
+  assert decimation.meanEdgeLength(vertices, faces) == 0.0
+  for levelVertices, levelFaces in decimation.levelsOfDetail(vertices, faces):
+    np.testing.assert_array_equal(levelVertices, vertices)
+    np.testing.assert_array_equal(levelFaces, faces)
+  np.testing.assert_array_equal(decimation.clusterVertices(vertices, faces, 0.0)[1], faces)
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from PedicleScrewPlannerLib import objfile
+
+OBJ_TEXT = (
+  "# SPACE=RAS\r\n"
+  "mtllib spine.mtl\r\n"
+  "v 0 0 0\r\n"
+  "  v 1.5 0 0\r\n"
+  "\tv 0 2 0 1.0\r\n"
+  "v 0 0 -3e-1\r\n"
+  "vt 0.5 0.5\r\n"
+  "vn 0 0 1\r\n"
+  "vp 1 2 3\r\n"
+  "g screw\r\n"
+  "f 1 2 3\r\n"
+  "  f 1/1/1 3/1/1 4/1/1\r\n"
+  "\tf -4//1 -3//1 -1//1\r\n"
+  "f 1/1 2/1 3/1 4/1\r\n"
+  "fo 1 2 3\r\n"
+  "   \r\n"
+  "v 5 5 5"
+)
+
+
+def _naiveReadObj(text):
+  """
+  Reference line-by-line parser.
+  """
+  vertices, faces = [], []
+  for line in text.splitlines():
+    tokens = line.split()
+    if not tokens:
+      continue
+    if tokens[0] == "v":
+      vertices.append([float(value) for value in tokens[1:4]])
+    elif tokens[0] == "f":
+      indices = [int(token.split("/")[0]) for token in tokens[1:]]
+      indices = [index + len(vertices) if index < 0 else index - 1 for index in indices]
+      faces.extend([indices[0], indices[corner], indices[corner + 1]] for corner in range(1, len(indices) - 1))
+  return np.array(vertices, np.float32).reshape(-1, 3), np.array(faces, np.int32).reshape(-1, 3)
+
+
+def test_readObjMatchesNaiveParser(tmp_path):
+  path = tmp_path / "model.obj"
+  path.write_bytes(OBJ_TEXT.encode("ascii"))
+  vertices, faces = objfile.readObj(str(path))
+  expectedVertices, expectedFaces = _naiveReadObj(OBJ_TEXT)
+  assert len(expectedVertices) == 5 and len(expectedFaces) == 5
+  np.testing.assert_array_equal(vertices, expectedVertices)
+  np.testing.assert_array_equal(faces, expectedFaces)
+  assert objfile.objCoordinateSystem(str(path)) == "RAS"
+
+
+def test_writeObjRoundTripAndCache(tmp_path):
+  path = str(tmp_path / "mesh.obj")
+  vertices = np.random.default_rng(0).uniform(-50, 50, (40, 3)).astype(np.float32)
+  faces = np.random.default_rng(1).integers(0, 40, (60, 3)).astype(np.int32)
+  objfile.writeObj(path, vertices, faces, comment="SPACE=LPS")
+  assert objfile.objCoordinateSystem(path) == "LPS"
+
+  loadedVertices, loadedFaces = objfile.loadObj(path)  # parses and writes the cache
+  assert os.path.exists(objfile.meshCachePath(path))
+  np.testing.assert_allclose(loadedVertices, vertices, atol=1e-6)
+  np.testing.assert_array_equal(loadedFaces, faces)
+  cachedVertices, cachedFaces = objfile.loadObj(path)
+  assert isinstance(cachedVertices, np.memmap)
+  np.testing.assert_array_equal(cachedVertices, loadedVertices)
+  np.testing.assert_array_equal(cachedFaces, loadedFaces)
@@ -0,0 +1,58 @@
+import ast
+import importlib.util
+
+import numpy as np
+import pytest
+
+from PedicleScrewPlannerLib import openigtlink
+
+from conftest import REPOSITORY_DIRECTORY
+
+
+def _classConstant(path, className, name):
+  """
+  Value of a string constant of a class, read from the source (the planner modules need 3D Slicer to be imported).
+  """
+  tree = ast.parse(path.read_text(encoding="utf-8"))
+  for node in ast.walk(tree):
+    if isinstance(node, ast.ClassDef) and node.name == className:
+      for statement in node.body:
+        if isinstance(statement, ast.Assign) and any(getattr(target, "id", None) == name for target in statement.targets):
+          return ast.literal_eval(statement.value)
+  raise KeyError(name)
+
+
+def _loadTool(name):
+  spec = importlib.util.spec_from_file_location(name, REPOSITORY_DIRECTORY / "Tools" / (name + ".py"))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def test_deviceNamesFitInHeader():
+  arPlanner = REPOSITORY_DIRECTORY / "AR_Planner-3DSlicer" / "AR_Planner.py"
+  deviceNames = [
+    _classConstant(arPlanner, "AR_PlannerLogic", "CT_RESLICE_OUTPUT"),
+    _classConstant(arPlanner, "AR_PlannerLogic", "COMPRESSED_RESLICE_OUTPUT"),
+    _loadTool("compressed_image_receiver").COMPRESSED_DEVICE_NAME,
+  ] + list(_loadTool("hololens_client").IMAGE_DEVICE_NAMES)
+  for deviceName in deviceNames:
+    assert len(deviceName) <= openigtlink.MAX_DEVICE_NAME_LENGTH, deviceName
+  assert _classConstant(arPlanner, "AR_PlannerLogic", "COMPRESSED_RESLICE_OUTPUT") in deviceNames[2:]
+
+
+def test_longDeviceNameIsRejected():
+  with pytest.raises(ValueError):
+    openigtlink.checkDeviceName("CT_reslice_Compressed")
+  with pytest.raises(ValueError):
+    openigtlink.packMessage(openigtlink.Message("IMAGE", "CT_reslice_Compressed", b""))
+
+
+def test_messageRoundTrip():
+  message = openigtlink.Message("TRANSFORM", "Screw-1_T", np.arange(12, dtype=">f4").tobytes(), {"ModelNumber": "1"}, 5)
+  packed = openigtlink.packMessage(message)
+  header = openigtlink.unpackHeader(packed[:openigtlink.HEADER.size])
+  received = openigtlink.unpackBody(header[0], header[1], header[2], packed[openigtlink.HEADER.size:], header[3])
+  assert (received.messageType, received.deviceName, received.content, received.metadata) == (
+    "TRANSFORM", "Screw-1_T", message.content, {"ModelNumber": "1"})
+  assert header[5] == openigtlink.crc64(packed[openigtlink.HEADER.size:])
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+from PedicleScrewPlannerLib import planexport
+
+
+def test_planRoundTrip(tmp_path):
+  basePath = str(tmp_path / "trial.mrb")
+  matrices = [np.eye(4), np.diag([1.0, -1.0, -1.0, 1.0])]
+  matrices[1][:3, 3] = [4.0, 5.0, 6.0]
+  plannedScrews = [
+    planexport.PlannedScrew(7, "D5L45.obj", (1.0, 0.0, 0.0), matrices[1], matrices[1] * 2.0),
+    planexport.PlannedScrew(2, "custom.obj", None, matrices[0], matrices[0]),
+  ]
+  jsonPath, arraysPath = planexport.writePlan(basePath, plannedScrews, spineMatrix=np.eye(4), digests={"ct": "abc"},
+    description={"user": "test"})
+  assert (jsonPath, arraysPath) == planexport.planPaths(basePath)
+  assert sorted(os.listdir(str(tmp_path))) == sorted([os.path.basename(jsonPath), os.path.basename(arraysPath)])
+
+  document, arrays = planexport.readPlan(str(tmp_path / "trial"))
+  assert document["digests"] == {"ct": "abc"} and document["description"] == {"user": "test"}
+  assert [screw["number"] for screw in document["screws"]] == [2, 7]
+  assert document["screws"][1]["transform"] == "Screw-7_T"
+  assert (document["screws"][1]["diameter"], document["screws"][1]["length"]) == (5.0, 45.0)
+  assert document["screws"][0]["diameter"] is None and document["screws"][0]["color"] is None
+  np.testing.assert_array_equal(arrays["screwNumbers"], [2, 7])
+  np.testing.assert_array_equal(arrays["screwMatrices"], [matrices[0], matrices[1]])
+  np.testing.assert_array_equal(arrays["screwMatricesToWorld"][1], matrices[1] * 2.0)
+  np.testing.assert_array_equal(arrays["spineMatrix"], np.eye(4))
+
+
+def test_digestCacheOnlyRecomputesModifiedData():
+  volume = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+  assert planexport.arrayDigest(volume) == planexport.arrayDigest(volume.copy())
+  assert planexport.arrayDigest(volume) != planexport.arrayDigest(volume.astype(np.int32))
+  assert planexport.arrayDigest(volume) != planexport.arrayDigest(volume.reshape(4, 3, 2))
+
+  calls = []
+
+  def getArrays():
+    calls.append(None)
+    return [volume]
+
+  cache = planexport.DigestCache(maximumNumberOfEntries=1)
+  digest = cache.get("vtkMRMLScalarVolumeNode1", 10, getArrays)
+  assert cache.get("vtkMRMLScalarVolumeNode1", 10, getArrays) == digest and len(calls) == 1
+  cache.get("vtkMRMLScalarVolumeNode1", 11, getArrays)
+  assert len(calls) == 2
+  cache.get("vtkMRMLModelNode1", 1, getArrays)  # evicts the volume
+  cache.get("vtkMRMLScalarVolumeNode1", 11, getArrays)
+  assert len(calls) == 4
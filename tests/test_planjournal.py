@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import REPOSITORY_DIRECTORY
+from PedicleScrewPlannerLib import planjournal
+
+# Journal of a session that crashes: the process ends without closing it
+CRASHED_SESSION = """
+import os, sys
+import numpy as np
+sys.path.insert(0, sys.argv[1])
+from PedicleScrewPlannerLib import planjournal
+journal = planjournal.PlanJournal(sys.argv[2], {"module": "Test"}, flushInterval=0.0)
+journal.recordSpec(3, "screw.obj", (0.0, 0.5, 1.0))
+journal.recordTransform(3, np.diag([1.0, 2.0, 3.0, 1.0]))
+while journal.writtenCount < 2:
+  pass
+os._exit(1)
+"""
+
+
+def test_journalReplay(tmp_path):
+  path = str(tmp_path / ("session" + planjournal.JOURNAL_EXTENSION))
+  journal = planjournal.PlanJournal(path, {"module": "Test"}, flushInterval=0.0)
+  matrix = np.eye(4)
+  matrix[:3, 3] = [10.0, -5.0, 2.5]
+  journal.recordSpec(1, "screw.obj", (1.0, 0.0, 0.0))
+  journal.recordTransform(1, matrix)
+  journal.recordTransform(1, matrix)  # unchanged: skipped
+  journal.recordSpec(2, None, None)
+  journal.recordRemove(2)
+  assert planjournal.isJournalActive(path)
+  assert planjournal.findUnfinishedJournals(str(tmp_path)) == []
+  journal.close()
+  assert not os.path.exists(planjournal.journalLockPath(path))
+  assert not planjournal.isJournalActive(path)
+
+  replay = planjournal.replayJournal(path)
+  assert replay.closed and replay.header["module"] == "Test"
+  assert list(replay.screws) == [1]
+  assert replay.screws[1].modelName == "screw.obj"
+  np.testing.assert_allclose(replay.screws[1].color, (1.0, 0.0, 0.0))
+  np.testing.assert_allclose(replay.screws[1].matrix, matrix, atol=1e-6)
+
+  # A torn last record is ignored
+  with open(path, "r+b") as journalFile:
+    journalFile.truncate(replay.validSize - 3)
+  tornReplay = planjournal.replayJournal(path)
+  assert not tornReplay.closed and tornReplay.recordCount == replay.recordCount - 1
+
+
+def test_crashedSessionIsFoundAndClosed(tmp_path):
+  path = str(tmp_path / ("crashed" + planjournal.JOURNAL_EXTENSION))
+  subprocess.run([sys.executable, "-c", CRASHED_SESSION, str(REPOSITORY_DIRECTORY), path], timeout=60)
+  assert os.path.exists(planjournal.journalLockPath(path))  # left by the crash, but not locked anymore
+  assert not planjournal.isJournalActive(path)
+  assert planjournal.findUnfinishedJournals(str(tmp_path)) == [path]
+
+  replay = planjournal.closeJournal(path)
+  assert not replay.closed and replay.screws[3].modelName == "screw.obj"
+  np.testing.assert_allclose(np.diag(replay.screws[3].matrix), [1.0, 2.0, 3.0, 1.0])
+  assert not os.path.exists(planjournal.journalLockPath(path))
+  assert planjournal.findUnfinishedJournals(str(tmp_path)) == []
+
+
+def test_pruneJournalsKeepsActiveJournals(tmp_path):
+  paths = [str(tmp_path / "{0}{1}".format(index, planjournal.JOURNAL_EXTENSION)) for index in range(3)]
+  activeJournal = planjournal.PlanJournal(paths[0])
+  for path in paths[1:]:
+    planjournal.PlanJournal(path).close()
+  for mtime, path in enumerate(paths):
+    os.utime(path, (mtime, mtime))
+  planjournal.pruneJournals(str(tmp_path), keepCount=1)
+  assert sorted(os.listdir(str(tmp_path))) == sorted([os.path.basename(paths[0]), os.path.basename(planjournal.journalLockPath(paths[0])),
+    os.path.basename(paths[2])])
+  activeJournal.close()
@@ -0,0 +1,59 @@
+import math
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import REPOSITORY_DIRECTORY
+import PedicleScrewPlannerLib
+from PedicleScrewPlannerLib import pose
+
+# Import the package modules that batch tools use without NumPy, and report whether NumPy got loaded
+IMPORT_WITHOUT_NUMPY = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import PedicleScrewPlannerLib
+from PedicleScrewPlannerLib import pose, reslice, screws, windowing
+print("numpy" in sys.modules)
+"""
+
+
+def _rotation(axis, degrees):
+  cos, sin = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+  first, second = [index for index in range(3) if index != axis]
+  matrix = np.eye(4)
+  matrix[first, first] = matrix[second, second] = cos
+  matrix[second, first] = sin
+  matrix[first, second] = -sin
+  if axis == 1:
+    matrix[:3, :3] = matrix[:3, :3].T
+  return matrix
+
+
+def test_poseMatrixMatchesTranslateRotateXRotateY():
+  translation = [12.5, -40.0, 7.25]
+  translationMatrix = np.eye(4)
+  translationMatrix[:3, 3] = translation
+  expected = translationMatrix @ _rotation(0, 30.0) @ _rotation(1, -65.0)
+  matrix = pose.poseMatrix(translation, 30.0, -65.0)
+  np.testing.assert_allclose(matrix, expected, atol=1e-12)
+
+  poseTranslation, rotationX, rotationY = pose.poseFromMatrix(np.array(matrix))
+  np.testing.assert_allclose(poseTranslation, translation)
+  assert math.isclose(rotationX, 30.0) and math.isclose(rotationY, -65.0)
+
+  moved = pose.moveAlongAxis(translation, matrix, 10.0)
+  np.testing.assert_allclose(moved, np.array(translation) + 10.0 * expected[:3, 2])
+
+
+def test_importDoesNotLoadNumpy():
+  result = subprocess.run([sys.executable, "-c", IMPORT_WITHOUT_NUMPY, str(REPOSITORY_DIRECTORY)],
+    capture_output=True, text=True, timeout=60, check=True)
+  assert result.stdout.strip() == "False"
+
+
+def test_reloadSubmodules():
+  poseMatrix = pose.poseMatrix
+  reloadedNames = PedicleScrewPlannerLib.reloadSubmodules()
+  assert "pose" in reloadedNames and "plannerlogic" not in reloadedNames
+  assert PedicleScrewPlannerLib.pose is pose and pose.poseMatrix is not poseMatrix
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from PedicleScrewPlannerLib import reslice
+
+EXTENT = [0, 79, 0, 79, 0, 0]
+SPACING = (0.5, 0.5, 1.0)
+
+
+def _volume(seed=0):
+  return np.random.default_rng(seed).integers(-1000, 2000, size=(18, 22, 26)).astype(np.int16)
+
+
+def _randomObliqueMatrices(volume, count, seed=1):
+  """
+  ijkFromSlice matrices of planes crossing the volume at random orientations, centered near the center of the volume.
+  """
+  rng = np.random.default_rng(seed)
+  matrices = []
+  for _ in range(count):
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    center = (np.array(volume.shape[::-1]) - 1) / 2 + rng.uniform(-3, 3, 3)
+    sliceCenter = np.array([EXTENT[1] * SPACING[0], EXTENT[3] * SPACING[1], 0]) / 2
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = center - rotation @ sliceCenter
+    matrices.append(matrix)
+  return np.array(matrices)
+
+
+def test_axisAlignedPlaneReproducesSlice():
+  volume = _volume()
+  matrix = np.eye(4)
+  matrix[2, 3] = 5
+  extent = [0, volume.shape[2] - 1, 0, volume.shape[1] - 1, 0, 0]
+  for interpolation in reslice.INTERPOLATION_MODES:
+    plane = reslice.resliceVolume(volume, matrix, extent, (1.0, 1.0), interpolation=interpolation)
+    np.testing.assert_array_equal(plane, volume[5])
+
+
+@pytest.mark.parametrize("interpolation", reslice.INTERPOLATION_MODES)
+def test_halfVoxelBorderIsSampled(interpolation):
+  volume = _volume()
+  matrix = np.eye(4)
+  matrix[:3, 3] = [-0.4, -0.4, 5]  # first row and column within the border, before the first voxel
+  extent = [0, 3, 0, 3, 0, 0]
+  plane = reslice.resliceVolume(volume, matrix, extent, (1.0, 1.0), interpolation=interpolation, backgroundValue=-5000)
+  assert plane[0, 0] == volume[5, 0, 0]
+  matrix[:3, 3] = [-0.6, -0.6, 5]  # beyond the border
+  plane = reslice.resliceVolume(volume, matrix, extent, (1.0, 1.0), interpolation=interpolation, backgroundValue=-5000)
+  assert plane[0, 0] == -5000 and plane[1, 1] != -5000
+
+
+def test_batchMatchesSinglePlanes():
+  volume = _volume()
+  matrices = _randomObliqueMatrices(volume, 6)
+  planes = reslice.resliceVolume(volume, matrices, EXTENT, SPACING, slabBytes=4096)
+  for matrix, plane in zip(matrices, planes):
+    np.testing.assert_array_equal(plane, reslice.resliceVolume(volume, matrix, EXTENT, SPACING))
+
+
+def _nearHalfVoxel(matrix, margin=1e-4):
+  """
+  Pixels that map within margin of a half-integer IJK coordinate: nearest neighbour ties and the limits of the border,
+  where the single precision coordinates of vtkImageReslice may fall on either side.
+  """
+  ijk = matrix[:3] @ reslice.slicePoints(EXTENT, SPACING)
+  return np.any(np.abs(ijk - np.floor(ijk) - 0.5) < margin, axis=0).reshape(reslice.outputShape(EXTENT))
+
+
+@pytest.mark.parametrize("interpolation", reslice.INTERPOLATION_MODES)
+def test_parityWithVtkImageReslice(interpolation):
+  vtk = pytest.importorskip("vtk")
+  from vtk.util import numpy_support
+
+  volume = _volume().astype(np.float64)
+  imageData = vtk.vtkImageData()
+  imageData.SetDimensions(volume.shape[::-1])
+  imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(volume.ravel(), deep=True))
+  background = -3000.0
+  for matrix in _randomObliqueMatrices(volume, 20):
+    vtkReslice = vtk.vtkImageReslice()
+    vtkReslice.SetInputData(imageData)
+    axes = vtk.vtkMatrix4x4()
+    axes.DeepCopy(matrix.ravel())
+    vtkReslice.SetResliceAxes(axes)
+    vtkReslice.SetOutputDimensionality(2)
+    vtkReslice.SetOutputExtent(EXTENT)
+    vtkReslice.SetOutputSpacing(SPACING)
+    vtkReslice.SetOutputOrigin(0.0, 0.0, 0.0)
+    vtkReslice.SetBackgroundLevel(background)
+    if interpolation == "nearest":
+      vtkReslice.SetInterpolationModeToNearestNeighbor()
+    else:
+      vtkReslice.SetInterpolationModeToLinear()
+    vtkReslice.Update()
+    expected = numpy_support.vtk_to_numpy(vtkReslice.GetOutput().GetPointData().GetScalars()).reshape(reslice.outputShape(EXTENT))
+    actual = reslice.resliceVolume(volume, matrix, EXTENT, SPACING, interpolation=interpolation, backgroundValue=background)
+    compared = ~_nearHalfVoxel(matrix)
+    # vtkImageReslice interpolates with single precision coordinates: about 0.01 of difference for steep gradients
+    np.testing.assert_allclose(actual[compared], expected[compared], atol=0.1)
+    assert (expected == background).any() and (expected != background).any()
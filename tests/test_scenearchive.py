@@ -0,0 +1,43 @@
+import os
+import zipfile
+
+import pytest
+
+from PedicleScrewPlannerLib import scenearchive
+
+
+@pytest.fixture
+def sceneBundle(tmp_path):
+  bundleDirectory = tmp_path / "Scene"
+  (bundleDirectory / "Data").mkdir(parents=True)
+  (bundleDirectory / "Scene.mrml").write_text("<MRML></MRML>\n" * 100)
+  (bundleDirectory / "Data" / "CT.nrrd").write_bytes(bytes(range(256)) * 64 + os.urandom(4096) + b"\0" * 2**18)
+  return bundleDirectory
+
+
+def _writeArchive(sourceDirectory, archivePath, compressionLevel):
+  writer = scenearchive.ArchiveWriter(str(sourceDirectory), str(archivePath), compressionLevel)
+  assert writer.wait(30) and writer.error is None
+  assert writer.progress == 1.0 and writer.writtenBytes == writer.totalBytes
+  return writer
+
+
+def test_archiveRoundTripAndCompressionLevels(sceneBundle, tmp_path):
+  archiveSizes = {}
+  for compressionLevel in (0, 1, 9):
+    archivePath = tmp_path / "Scene-{0}.mrb".format(compressionLevel)
+    archiveSizes[compressionLevel] = _writeArchive(sceneBundle, archivePath, compressionLevel).archiveBytes
+    with zipfile.ZipFile(archivePath) as archive:
+      assert archive.namelist() == ["Scene.mrml", "Data/CT.nrrd"]
+      assert archive.read("Data/CT.nrrd") == (sceneBundle / "Data" / "CT.nrrd").read_bytes()
+      expectedCompression = zipfile.ZIP_DEFLATED if compressionLevel else zipfile.ZIP_STORED
+      assert all(entry.compress_type == expectedCompression for entry in archive.infolist())
+  assert archiveSizes[0] > archiveSizes[1] > archiveSizes[9]
+  assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_removeSource(sceneBundle, tmp_path):
+  _writeArchive(sceneBundle, tmp_path / "Scene.mrb", 1)
+  assert sceneBundle.exists()
+  scenearchive.ArchiveWriter(str(sceneBundle), str(tmp_path / "Removed.mrb"), 1, removeSource=True).wait(30)
+  assert not sceneBundle.exists() and (tmp_path / "Removed.mrb").exists()
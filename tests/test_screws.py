@@ -0,0 +1,62 @@
+from PedicleScrewPlannerLib import screws
+
+
+class _Node:
+  """
+  Stand-in for a Slicer node: the registry only uses GetName and GetAttribute.
+  """
+
+  def __init__(self, name, **attributes):
+    self.name = name
+    self.attributes = attributes
+
+  def GetName(self):
+    return self.name
+
+  def GetAttribute(self, attributeName):
+    return self.attributes.get(attributeName)
+
+
+def test_screwNamesAndMetadata():
+  assert screws.screwModelName(3) == "Screw-3" and screws.screwTransformName(3) == "Screw-3_T"
+  assert screws.parseScrewNumber("Screw-12_T") == 12 and screws.parseScrewNumber("Screw-12") == 12
+  assert screws.parseScrewNumber("Screw-12_T1") is None and screws.parseScrewNumber(None) is None
+  assert screws.parseScrewNodeName("Screw-4_T") == (4, True) and screws.parseScrewNodeName("Screw-4") == (4, False)
+  assert screws.parseScrewSize("d6.5L40.OBJ") == (6.5, 40.0) and screws.parseScrewSize("screw.obj") is None
+  assert screws.parseColor(screws.formatColor((1, 0.5, 0))) == (1.0, 0.5, 0.0)
+  assert screws.screwSpecFromMetadata({"ModelNumber": "2", "ModelName": "D5L45.obj", "ModelColor": "0,1,0"}) == \
+    screws.ScrewSpec(2, "D5L45.obj", (0.0, 1.0, 0.0))
+
+
+def test_diffScrews():
+  current = {number: screws.ScrewSpec(number, "D5L45.obj", (1.0, 0.0, 0.0)) for number in (1, 2, 3)}
+  desired = {
+    1: current[1],
+    2: screws.ScrewSpec(2, "D6L50.obj", (1.0, 0.0, 0.0)),
+    3: screws.ScrewSpec(3, "D5L45.obj", (0.0, 0.0, 1.0)),
+    5: screws.ScrewSpec(5, "D5L45.obj", (1.0, 0.0, 0.0)),
+  }
+  diff = screws.diffScrews(current, desired)
+  assert diff.added == [desired[5]] and diff.modelChanged == [desired[2]] and diff.colorChanged == [desired[3]]
+  assert diff.removed == []
+  assert screws.diffScrews(desired, {}).removed == [1, 2, 3, 5]
+
+
+def test_screwRegistry():
+  model = _Node("Screw-2", **{screws.MODEL_NAME_ATTRIBUTE: "D5L45.obj", screws.MODEL_COLOR_ATTRIBUTE: "1,0,0"})
+  transform = _Node("Screw-2_T", **{"OpenIGTLink.ModelName": "D6L50.obj", "OpenIGTLink.ModelColor": "0,1,0"})
+  otherTransform = _Node("Screw-7_T", **{"OpenIGTLink.ModelName": "D6L50.obj", "OpenIGTLink.ModelColor": "0,1,0"})
+  registry = screws.ScrewRegistry()
+  registry.rebuild([transform, _Node("Spine_T"), model, otherTransform])
+  assert registry.numbers() == [2, 7] and registry.nextNumber() == 8
+  assert registry.models() == {2: model} and registry.transforms() == {2: transform, 7: otherTransform}
+  # The attributes of the model come first, the OpenIGTLink metadata of the transform otherwise
+  assert registry.get(2).spec() == screws.ScrewSpec(2, "D5L45.obj", (1.0, 0.0, 0.0))
+  assert registry.get(7).size == (6.0, 50.0)
+
+  assert registry.addNode(_Node("Image_T")) is None
+  model.name = "Renamed"  # found by a search
+  assert registry.removeNode(model) == 2 and 2 in registry
+  assert registry.get(2).spec() == screws.ScrewSpec(2, "D6L50.obj", (0.0, 1.0, 0.0))
+  assert registry.removeNode(transform) == 2 and 2 not in registry
+  assert registry.removeNode(transform) is None and len(registry) == 1
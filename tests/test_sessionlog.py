@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from PedicleScrewPlannerLib import sessionlog
+
+
+def test_recordingRoundTrip(tmp_path):
+  recorder = sessionlog.SessionRecorder(str(tmp_path), recordSlices=True)
+  matrix = np.arange(16, dtype=np.float32).reshape(4, 4)
+  recorder.recordTransform("Image_T", matrix, timestamp=1.0)
+  recorder.recordTransform("Screw-12_T", np.eye(4), timestamp=2.0)
+  recorder.recordSlice(np.full((3, 4), 7, np.uint8), timestamp=3.0)
+  recorder.recordSlice(np.zeros((5, 5), np.uint8), timestamp=4.0)  # new shape: new slice log
+  recorder.close()
+  assert recorder.statistics() == {"transformCount": 2, "sliceCount": 2, "droppedCount": 0}
+
+  transforms = sessionlog.openLog(str(tmp_path / sessionlog.SessionRecorder.TRANSFORM_LOG_NAME))
+  assert list(transforms["name"]) == [b"Image_T", b"Screw-12_T"]
+  np.testing.assert_array_equal(transforms["matrix"][0], matrix)
+  slices = sessionlog.openLog(str(tmp_path / ("slices-0" + sessionlog.LOG_EXTENSION)))
+  assert slices["sequence"].tolist() == [1] and (slices["pixels"][0] == 7).all()
+
+
+def test_longTransformNameIsRejected(tmp_path):
+  recorder = sessionlog.SessionRecorder(str(tmp_path))
+  name = "T" * sessionlog.MAX_TRANSFORM_NAME_LENGTH
+  recorder.recordTransform(name, np.eye(4))
+  with pytest.raises(ValueError):
+    recorder.recordTransform(name + "_T", np.eye(4))
+  recorder.close()
+  assert sessionlog.openLog(str(tmp_path / sessionlog.SessionRecorder.TRANSFORM_LOG_NAME))["name"].tolist() == [name.encode()]
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from PedicleScrewPlannerLib import windowing
+
+VALUES = [-100, 0, 50, 100, 127]
+EXPECTED = [0, 127, 191, 255, 255]  # window width 200, level 0
+
+
+def test_integerInPlaceMatchesNewBuffer():
+  for dtype in (np.int16, np.int32):
+    imageArray = np.array(VALUES, dtype=dtype).reshape(1, 1, -1)
+    np.testing.assert_array_equal(windowing.applyWindowLevel(imageArray, 200, 0).ravel(), EXPECTED)
+    windowing.applyWindowLevel(imageArray, 200, 0, out=imageArray)
+    assert imageArray.dtype == dtype
+    np.testing.assert_array_equal(imageArray.ravel(), EXPECTED)
+
+
+def test_int8CannotBeWindowedInPlace():
+  imageArray = np.array(VALUES, dtype=np.int8).reshape(1, 1, -1)
+  np.testing.assert_array_equal(windowing.applyWindowLevel(imageArray, 200, 0).ravel(), EXPECTED)
+  assert not windowing.holdsUCharRange(np.int8) and windowing.holdsUCharRange(np.float32)
+  with pytest.raises(ValueError):
+    windowing.applyWindowLevel(imageArray, 200, 0, out=imageArray)
+  np.testing.assert_array_equal(imageArray.ravel(), VALUES)  # unchanged
+
+
+def test_float32InPlaceMatchesNewBuffer():
+  imageArray = np.array(VALUES, dtype=np.float32).reshape(1, 1, -1)
+  windowing.applyWindowLevel(imageArray, 200, 0, out=imageArray)
+  np.testing.assert_array_equal(imageArray.ravel(), np.array(EXPECTED, dtype=np.float32))